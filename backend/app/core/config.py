@@ -4,6 +4,30 @@ class Settings(BaseSettings):
     PROJECT_NAME: str = "Time Table Generator AI Microservice"
     API_V1_STR: str = "/api/v1"
     HF_API_KEY: str = "YOUR_HF_API_KEY"
+    BATCH_VALIDATION_WORKERS: int = 4
+    BATCH_VALIDATION_SPOOL_BYTES: int = 8 * 1024 * 1024  # /validate/batch bodies beyond this are spooled to disk
+    BATCH_GENERATION_WORKERS: int = 4  # Processes for independent groups of /generate/batch requests
+    SOLVER_TIME_LIMIT_SECONDS: float = 15.0  # Safe timeout for Render instances
+    SOLVER_JOINT_LECTURER_ASSIGNMENT: bool = True  # Solver picks lecturers for subjects without an assigned one
+    ALLOCATION_TIME_LIMIT_SECONDS: float = 2.0  # CP-SAT subject-to-lecturer assignment (/auto-allocate)
+    LLM_STAGE_BUDGET_SECONDS: float = 120.0  # All LLM attempts of one generation run
+    REQUEST_DEADLINE_MARGIN_SECONDS: float = 2.0  # Kept back from the caller's deadline to send the response
+    LLM_TIMEOUT_SECONDS: float = 10.0
+    LLM_HEDGE_TOP_K: int = 3
+    LLM_CIRCUIT_FAILURE_THRESHOLD: int = 3
+    LLM_CIRCUIT_TTL_SECONDS: float = 300.0
+    LLM_CREDIT_COOLDOWN_SECONDS: float = 3600.0
+    LLM_PROMPT_TOKEN_BUDGET: int = 2000
+    LLM_STREAM_MAX_INVALID_SLOTS: int = 5
+    LLM_STRUCTURED_OUTPUT: bool = True
+    LLM_BASE_URL: str = ""
+    LLM_RECORD_REPLAY: str = ""  # "", "record" or "replay"
+    LLM_CASSETTE_PATH: str = "llm_cassette.jsonl"
+    LLM_REPLAY_LATENCY: bool = False
+    LLM_CACHE_ENABLED: bool = True
+    LLM_CACHE_PATH: str = "llm_cache.sqlite3"
+    LLM_CACHE_TTL_SECONDS: float = 7 * 24 * 3600.0
+    LLM_CACHE_MAX_ENTRIES: int = 1000
 
     class Config:
         case_sensitive = True
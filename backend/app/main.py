@@ -1,6 +1,8 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from app.routes import timetable
+from app.services.metrics import registry
 
 app = FastAPI(title="Time Table Generator AI Microservice")
 
@@ -17,4 +19,9 @@ app.add_middleware(
 def read_root():
     return {"message": "Time Table Generator AI Microservice is running"}
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    # Prometheus text exposition of this worker's generation and solver metrics
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 app.include_router(timetable.router, prefix="/timetable", tags=["Timetable"])
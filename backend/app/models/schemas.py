@@ -1,5 +1,5 @@
-from pydantic import BaseModel, EmailStr, Field
-from typing import List, Optional, Dict, Literal
+from pydantic import BaseModel, EmailStr, Field, model_validator
+from typing import List, Optional, Dict, Literal, Any
 
 # --- Auth Models ---
 class UserLogin(BaseModel):
@@ -78,6 +78,20 @@ class Division(BaseModel):
     strength: int = 60
     subjects: List[Subject] # Each division has its own subject constraints (e.g. maybe different teachers for same subject code?)
 
+class BlockedPeriod(BaseModel):
+    # A period the lecturer and/or room is already committed elsewhere (another department, semester, event)
+    lecturer: Optional[str] = None
+    room: Optional[str] = None
+    day: str
+    period: int
+    reason: Optional[str] = None
+
+    @model_validator(mode="after")
+    def check_resource(self):
+        if not self.lecturer and not self.room:
+            raise ValueError("A blocked period needs a lecturer or a room")
+        return self
+
 class TimetableRequest(BaseModel):
     metadata: TimetableMetadata
     divisions: List[Division] # MULTI-DIVISION SUPPORT
@@ -85,6 +99,7 @@ class TimetableRequest(BaseModel):
     classrooms: List[Classroom] # Global Pool
     labs: Optional[List[Laboratory]] = [] # Global Pool of Labs
     constraints: Optional[List[str]] = None
+    blocked: List[BlockedPeriod] = [] # Existing commitments of lecturers/rooms, treated as occupied
 
 class TimetableSlot(BaseModel):
     division: str # ADDED
@@ -105,7 +120,27 @@ class TimetableResponse(BaseModel):
     classrooms: List[Classroom]
     labs: Optional[List[Laboratory]] = []
     slots: List[TimetableSlot]
+    blocked: List[BlockedPeriod] = []
     created_at: Optional[datetime] = None
+    pipeline: Optional[Dict[str, Any]] = None # Stage timings/budgets of the run that generated it
+    diagnostics: Optional[Dict[str, Any]] = None # Solver telemetry, with ?diagnostics=true
+
+class CompactTimetableResponse(BaseModel):
+    """?format=compact form of a TimetableResponse (see services/compact_encoding.py); documentation only."""
+    format: str # "timetable.compact/1"
+    timetable_id: str
+    created_at: Optional[datetime] = None
+    metadata: TimetableMetadata
+    pipeline: Optional[Dict[str, Any]] = None
+    diagnostics: Optional[Dict[str, Any]] = None
+    blocked: List[BlockedPeriod] = []
+    divisions: List[str] # Content hashes, bodies in `resources`
+    lecturers: List[str]
+    classrooms: List[str]
+    labs: List[str]
+    tables: Dict[str, List[str]] # Per-field lookup tables (day in working-day order)
+    slots: Dict[str, List[int]] # Parallel columns: period as-is, other fields index `tables`
+    resources: Optional[Dict[str, Dict[str, Any]]] = None # Omitted with include_resources=false
 
 class AutoAllocateRequest(BaseModel):
     department: str
@@ -113,7 +148,9 @@ class AutoAllocateRequest(BaseModel):
     divisions: List[Division]
     subjects: List[Subject]
     lecturers: List[Lecturer]
+    use_llm: bool = False # Ask the LLM for a suggested allocation, used only to break ties
 
 class AutoAllocateResponse(BaseModel):
     divisions: List[Division]
+    report: Optional[Dict[str, Any]] = None # Feasibility: loads, unassigned subjects, solver status
 
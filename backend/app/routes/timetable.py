@@ -1,353 +1,304 @@
-from fastapi import APIRouter, HTTPException
-from typing import List, Optional
-from app.models.schemas import TimetableRequest, TimetableResponse, TimetableSlot, Classroom, AutoAllocateRequest, AutoAllocateResponse
+from fastapi import APIRouter, HTTPException, Request, Query, Depends
+from fastapi.responses import StreamingResponse, JSONResponse, ORJSONResponse
+from typing import List, Optional, Literal, Union
+from app.models.schemas import TimetableRequest, TimetableResponse, CompactTimetableResponse, AutoAllocateRequest, AutoAllocateResponse
 from pydantic import BaseModel
-from app.services.llm_service import generate_timetable_with_llm, allocate_subjects_with_llm, explain_conflicts_with_llm
+from app.services.llm_service import suggest_allocation_with_llm
+from app.services.allocation import allocate_subjects
+from app.services.pipeline import run_generation_pipeline, PipelineContext, PipelineError
+from app.services.deadline import Deadline, DeadlineExceeded, DEADLINE_HEADER, deadline_from_header
+from app.services.compact_encoding import encode_compact, compact_response
+from app.services.explanations import request_conflict_explanation, get_conflict_explanation
+from app.services.llm_cache import llm_cache
+from app.services.model_health import model_health
+from app.services.metrics import record_generation
 from datetime import datetime
+import asyncio
 import uuid
 
-from app.services.validator import validate_timetable
-from app.services.repair import repair_division_slots_full
-from app.services.prompt_builder import build_single_division_prompt
-from app.services.solver import schedule_with_ortools
+from app.services.batch_validation import stream_batch_validation, spool_body, iter_spooled, iter_ndjson_lines, iter_json_list
+from starlette.requests import ClientDisconnect
+from app.services.batch_generation import run_batch_generation
+from fastapi.concurrency import run_in_threadpool
+import time
 
 router = APIRouter()
 
-@router.post("/generate", response_model=TimetableResponse)
-def generate_timetable_endpoint(request: TimetableRequest):
-    # Try Google OR-Tools CP-SAT Solver first
+# /generate and /regenerate return ready-made responses (orjson, or the compact
+# encoding), so they have no response_model; this documents both shapes
+GENERATION_RESPONSES = {
+    200: {
+        "model": Union[TimetableResponse, CompactTimetableResponse],
+        "description": "The timetable. With ?format=compact: CompactTimetableResponse, gzip or zstd compressed as Accept-Encoding allows.",
+    },
+    400: {"description": "Infeasible request: template explanation, conflicts and an explanation_id to fetch the LLM explanation."},
+    499: {"description": "The client disconnected before the timetable was generated."},
+}
+
+
+async def infeasible_response(conflicts: List[str], pipeline: Optional[dict] = None, diagnostics: Optional[dict] = None) -> JSONResponse:
+    """
+    400 response for an infeasible request, returned without waiting on the LLM:
+    `detail` holds the template explanation, the LLM one is fetched later by id.
+    """
+    # The explanation store is sqlite: keep its I/O off the event loop
+    report = await run_in_threadpool(request_conflict_explanation, conflicts)
+    return JSONResponse(status_code=400, content={
+        "detail": report["explanation"],
+        "conflicts": report["conflicts"],
+        "explanation_id": report["explanation_id"],
+        "explanation_status": report["status"],
+        "explanation_url": f"/timetable/explanations/{report['explanation_id']}",
+        "pipeline": pipeline,
+        "diagnostics": diagnostics
+    })
+
+
+def timetable_payload(request: TimetableRequest, slots: List[dict], pipeline: Optional[dict] = None, diagnostics: Optional[dict] = None) -> dict:
+    """
+    TimetableResponse-shaped dict for a generated timetable. The request was
+    validated on the way in and the slots are trusted internal Slots, so no
+    TimetableResponse/TimetableSlot models are built for the response.
+    """
+    resources = request.model_dump(mode="json", include={"metadata", "divisions", "lecturers", "classrooms", "labs", "blocked"})
+    return {
+        "timetable_id": str(uuid.uuid4()),
+        **resources,
+        "labs": resources.get("labs") or [],
+        "slots": slots,
+        "created_at": datetime.utcnow(),
+        "pipeline": pipeline,
+        "diagnostics": diagnostics
+    }
+
+
+async def cancel_on_disconnect(http_request: Request, deadline: Deadline, task: asyncio.Task) -> None:
+    """Cancels the generation task (and any CP-SAT search via the deadline) once the client hangs up."""
+    while not task.done():
+        if await http_request.is_disconnected():
+            print("Client disconnected; cancelling generation.")
+            deadline.cancel("client disconnected")
+            task.cancel()
+            return
+        await asyncio.sleep(0.5)
+
+
+class ResponseEncoding(BaseModel):
+    """Opt-in compact timetable encoding, selected with ?format=compact."""
+    format: Literal["full", "compact"] = "full"
+    include_resources: bool = True
+
+
+def response_encoding(
+    format: Literal["full", "compact"] = Query("full", description="'compact': hashed resources, integer-coded slot columns, orjson + gzip/zstd"),
+    include_resources: bool = Query(True, description="Compact format only: false sends resource hashes without their bodies")
+) -> ResponseEncoding:
+    return ResponseEncoding(format=format, include_resources=include_resources)
+
+
+async def run_pipeline_response(request: TimetableRequest, http_request: Request, encoding: ResponseEncoding, endpoint: str, diagnostics: bool = False, solver_with_free_text: bool = True):
+    """
+    Runs the generation pipeline under the caller's deadline (DEADLINE_HEADER):
+    every stage only gets the time that remains, and the run is cancelled if the
+    client disconnects. Every run is recorded on /metrics; `diagnostics` also
+    returns the run's solver telemetry in the response.
+    """
+    started = time.monotonic()
+    deadline = deadline_from_header(http_request.headers.get(DEADLINE_HEADER))
+    # Created here so the solver stats of a failed run still reach /metrics
+    ctx = PipelineContext(request, solver_with_free_text=solver_with_free_text, deadline=deadline)
+    task = asyncio.create_task(run_generation_pipeline(request, ctx=ctx))
+    watcher = asyncio.create_task(cancel_on_disconnect(http_request, deadline, task))
     try:
-        print("Running Google OR-Tools CP-SAT constraint scheduler...")
-        solver_result = schedule_with_ortools(request)
-        
-        if solver_result["status"] == "SUCCESS":
-            print("CP-SAT Solver successfully generated optimal timetable.")
-            slots_data = solver_result["slots"]
-            all_generated_slots = [TimetableSlot(**slot) for slot in slots_data]
-            
-            final_response = TimetableResponse(
-                timetable_id=str(uuid.uuid4()),
-                metadata=request.metadata,
-                divisions=request.divisions,
-                lecturers=request.lecturers,
-                classrooms=request.classrooms,
-                labs=request.labs or [],
-                slots=all_generated_slots,
-                created_at=datetime.utcnow()
-            )
-            return final_response
-            
-        elif solver_result["status"] == "INFEASIBLE":
-            conflicts = solver_result.get("conflicts", [])
-            print(f"CP-SAT Solver reported INFEASIBLE. Conflicts: {conflicts}")
-            ai_explanation = explain_conflicts_with_llm(conflicts)
-            raise HTTPException(status_code=400, detail=ai_explanation)
-            
-    except HTTPException as http_ex:
-        raise http_ex
-    except Exception as e:
-        print(f"CP-SAT Solver failed or crashed: {e}. Falling back to sequential LLM/Heuristic pipeline...")
-
-    # Fallback to sequential LLM/Heuristic generation
-    # Merge labs into classrooms pool if provided
-    if request.labs:
-        for lab in request.labs:
-            if not any(c.id == lab.id for c in request.classrooms):
-                request.classrooms.append(
-                    Classroom(
-                        id=lab.id,
-                        name=lab.name,
-                        capacity=lab.capacity,
-                        building=lab.department,
-                        floor=0,
-                        type="Lab",
-                        status=lab.status
-                    )
-                )
-
-    all_generated_slots: List[TimetableSlot] = []
-
-    # Iterate through each division sequentially
-    for division in request.divisions:
-        print(f"Generating Timetable for Division: {division.name}")
-        
-        # Build prompt for THIS division, passing already occupied slots
-        current_prompt = build_single_division_prompt(request, division, all_generated_slots)
-        
-        max_retries = 5
-        last_error = None
-        division_slots = []
-        success = False
-        
-        for attempt in range(max_retries):
-            print(f"  Attempt {attempt + 1}/{max_retries} for Div {division.name}")
-            
-            # Call LLM
-            llm_response = generate_timetable_with_llm(current_prompt)
-            if "error" in llm_response:
-                print(f"  LLM Error: {llm_response['error']}")
-                last_error = f"LLM Error: {llm_response['error']}"
-                continue
-
-            try:
-                # Parse output
-                slots_data = llm_response.get("slots", [])
-                division_slots = [TimetableSlot(**slot) for slot in slots_data]
-                
-                # Repair algorithm
-                division_slots = repair_division_slots_full(division_slots, all_generated_slots, request, division.name)
-
-                # Check global conflicts
-                temp_slots = all_generated_slots + division_slots
-                
-                temp_response = TimetableResponse(
-                    timetable_id="temp",
-                    metadata=request.metadata,
-                    divisions=request.divisions,
-                    lecturers=request.lecturers,
-                    classrooms=request.classrooms,
-                    slots=temp_slots
-                )
-                
-                # Validate
-                validation_result = validate_timetable(temp_response, request, specific_divisions=[division.name])
-                
-                if validation_result["valid"]:
-                    print(f"  Division {division.name} valid!")
-                    success = True
-                    break
-                else:
-                    print(f"  Validation Failed: {validation_result['errors']}")
-                    last_error = str(validation_result['errors'])
-                    
-                    # Refine Prompt
-                    current_prompt += f"\n\nCRITICAL: The previous generation was INVALID. Violations:\n"
-                    current_prompt += "\n".join([f"- {e}" for e in validation_result["errors"] if division.name in e or "double-booked" in e])
-                    current_prompt += "\n\nPlease try again used UNUSED time slots."
-
-            except Exception as e:
-                print(f"  Parsing Error: {e}")
-                last_error = f"Parsing Error: {e}"
-                current_prompt += f"\n\nJSON Parsing Error: {e}. Output valid JSON only."
-
-        if not success:
-            print(f"HuggingFace failed to generate timetable for Division {division.name}. Falling back to local heuristic scheduler...")
-            try:
-                division_slots = repair_division_slots_full([], all_generated_slots, request, division.name)
-                # Check validation of local generation
-                temp_slots = all_generated_slots + division_slots
-                temp_response = TimetableResponse(
-                    timetable_id="temp",
-                    metadata=request.metadata,
-                    divisions=request.divisions,
-                    lecturers=request.lecturers,
-                    classrooms=request.classrooms,
-                    slots=temp_slots
-                )
-                validation_result = validate_timetable(temp_response, request, specific_divisions=[division.name])
-                if validation_result["valid"]:
-                    print(f"  Local heuristic scheduler succeeded for Div {division.name}!")
-                    success = True
-                else:
-                    # If still not fully valid, we use it anyway rather than raising 500!
-                    print(f"  Local heuristic scheduler validation warnings: {validation_result['errors']}")
-                    success = True
-            except Exception as fallback_err:
-                print(f"Local heuristic scheduler fallback failed: {fallback_err}")
-                raise HTTPException(status_code=500, detail=f"Failed to generate valid schedule for Division {division.name} after retries. Errors: {last_error}. Heuristic fallback failed: {fallback_err}")
-        
-        # If successful, add these slots to the global list
-        all_generated_slots.extend(division_slots)
-
-    # All divisions done. Return result.
-    final_response = TimetableResponse(
-        timetable_id=str(uuid.uuid4()),
-        metadata=request.metadata,
-        divisions=request.divisions,
-        lecturers=request.lecturers,
-        classrooms=request.classrooms,
-        labs=request.labs or [],
-        slots=all_generated_slots,
-        created_at=datetime.utcnow()
-    )
-    
-    return final_response
+        await task
+    except PipelineError as e:
+        record_generation(endpoint, "error", time.monotonic() - started, ctx.diagnostics())
+        raise HTTPException(status_code=500, detail=str(e))
+    except (DeadlineExceeded, asyncio.CancelledError):
+        record_generation(endpoint, "cancelled" if deadline.cancelled else "timeout", time.monotonic() - started, ctx.diagnostics())
+        if not deadline.cancelled:
+            raise
+        # Nobody is waiting for this response any more
+        return JSONResponse(status_code=499, content={"detail": f"Generation cancelled: {deadline.reason}"})
+    finally:
+        watcher.cancel()
+        if not task.done():
+            deadline.cancel("request cancelled")
+            task.cancel()
+    run_diagnostics = ctx.diagnostics()
+    outcome = "infeasible" if ctx.conflicts is not None else "success"
+    record_generation(endpoint, outcome, time.monotonic() - started, run_diagnostics)
+    if not diagnostics:
+        run_diagnostics = None
+    if ctx.conflicts is not None:
+        return await infeasible_response(ctx.conflicts, ctx.report(), run_diagnostics)
+    timetable = timetable_payload(request, [slot.to_dict() for slot in ctx.slots], ctx.report(), run_diagnostics)
+    if encoding.format == "compact":
+        return compact_response(encode_compact(timetable, encoding.include_resources), http_request.headers.get("accept-encoding"))
+    # Serialized straight to JSON, skipping FastAPI's response_model re-validation
+    return ORJSONResponse(timetable)
+
+
+@router.post("/generate", response_model=None, responses=GENERATION_RESPONSES)
+async def generate_timetable_endpoint(
+    request: TimetableRequest,
+    http_request: Request,
+    encoding: ResponseEncoding = Depends(response_encoding),
+    diagnostics: bool = Query(False, description="Include solver telemetry (model size, timings, objective, gap, LLM attempts)")
+):
+    # Presolve, then Google OR-Tools CP-SAT, then the sequential LLM/heuristic fallback
+    return await run_pipeline_response(request, http_request, encoding, "generate", diagnostics)
+
+class BatchGenerateRequest(BaseModel):
+    requests: List[TimetableRequest]
+
+
+@router.post("/generate/batch")
+async def generate_batch_endpoint(batch: BatchGenerateRequest, http_request: Request):
+    """
+    Generates timetables for several departments that share one staff and room
+    pool, without double-booking a lecturer or room across them. Solver and
+    heuristic only: free-text constraints that are not DSL are not applied.
+    Honours DEADLINE_HEADER like /generate: requests not reached in time are
+    TIMEOUT, and the batch is cancelled if the client disconnects. A heuristic
+    timetable that misses periods is PARTIAL (returned with its errors); one
+    that breaks a hard rule is INVALID (errors only).
+    """
+    started = time.monotonic()
+    deadline = deadline_from_header(http_request.headers.get(DEADLINE_HEADER))
+    task = asyncio.create_task(run_in_threadpool(run_batch_generation, batch.requests, deadline=deadline))
+    watcher = asyncio.create_task(cancel_on_disconnect(http_request, deadline, task))
+    try:
+        results = await task
+    except asyncio.CancelledError:
+        if not deadline.cancelled:
+            raise
+        return JSONResponse(status_code=499, content={"detail": f"Batch generation cancelled: {deadline.reason}"})
+    finally:
+        watcher.cancel()
+        if not task.done():
+            deadline.cancel("request cancelled")
+            task.cancel()
+    response = []
+    for result in results:
+        entry = {"index": result["index"], "status": result["status"], "seconds": result["seconds"]}
+        if result["status"] in ("SUCCESS", "PARTIAL"):
+            entry["timetable"] = timetable_payload(result["request"], result["slots"], {"source": result["source"]})
+        if result["status"] in ("PARTIAL", "INVALID"):
+            entry["errors"] = result["errors"]
+        elif result["status"] in ("TIMEOUT", "CANCELLED"):
+            entry["detail"] = "Request deadline reached before this timetable was generated." if result["status"] == "TIMEOUT" else "Batch generation cancelled."
+        elif result["status"] == "INFEASIBLE":
+            report = await run_in_threadpool(request_conflict_explanation, result["conflicts"])
+            entry.update({
+                "detail": report["explanation"],
+                "conflicts": report["conflicts"],
+                "explanation_id": report["explanation_id"],
+                "explanation_url": f"/timetable/explanations/{report['explanation_id']}"
+            })
+        response.append(entry)
+    return ORJSONResponse({"results": response, "seconds": round(time.monotonic() - started, 4)})
 
 class StatelessRegenerateRequest(BaseModel):
     original_timetable: TimetableResponse
     additional_constraints: str
 
-@router.post("/regenerate", response_model=TimetableResponse)
-def regenerate_timetable(request: StatelessRegenerateRequest):
+@router.post("/regenerate", response_model=None, responses=GENERATION_RESPONSES)
+async def regenerate_timetable(
+    request: StatelessRegenerateRequest,
+    http_request: Request,
+    encoding: ResponseEncoding = Depends(response_encoding),
+    diagnostics: bool = Query(False, description="Include solver telemetry (model size, timings, objective, gap, LLM attempts)")
+):
     original_timetable = request.original_timetable
     new_constraints = [request.additional_constraints] if request.additional_constraints else []
-    
-    # Merge labs into classrooms pool if provided
-    if original_timetable.labs:
-        for lab in original_timetable.labs:
-            if not any(c.id == lab.id for c in original_timetable.classrooms):
-                original_timetable.classrooms.append(
-                    Classroom(
-                        id=lab.id,
-                        name=lab.name,
-                        capacity=lab.capacity,
-                        building=lab.department,
-                        floor=0,
-                        type="Lab",
-                        status=lab.status
-                    )
-                )
 
     # TimetableRequest for reference (used in prompt building / solving)
     prompt_request = TimetableRequest(
         metadata=original_timetable.metadata,
-        divisions=original_timetable.divisions, 
+        divisions=original_timetable.divisions,
         lecturers=original_timetable.lecturers,
         classrooms=original_timetable.classrooms,
         labs=original_timetable.labs,
-        constraints=new_constraints 
+        constraints=new_constraints,
+        blocked=original_timetable.blocked
     )
 
-    # If there are NO new natural language constraints, use the fast mathematical OR-Tools solver
-    if not new_constraints:
-        try:
-            print("Regenerating with Google OR-Tools CP-SAT scheduler...")
-            solver_result = schedule_with_ortools(prompt_request)
-            if solver_result["status"] == "SUCCESS":
-                slots_data = solver_result["slots"]
-                all_generated_slots = [TimetableSlot(**slot) for slot in slots_data]
-                return TimetableResponse(
-                    timetable_id=str(uuid.uuid4()),
-                    metadata=original_timetable.metadata,
-                    divisions=original_timetable.divisions,
-                    lecturers=original_timetable.lecturers,
-                    classrooms=original_timetable.classrooms,
-                    labs=original_timetable.labs or [],
-                    slots=all_generated_slots,
-                    created_at=datetime.utcnow()
-                )
-            elif solver_result["status"] == "INFEASIBLE":
-                conflicts = solver_result.get("conflicts", [])
-                print(f"CP-SAT Regene Solver reported INFEASIBLE. Conflicts: {conflicts}")
-                ai_explanation = explain_conflicts_with_llm(conflicts)
-                raise HTTPException(status_code=400, detail=ai_explanation)
-        except HTTPException as http_ex:
-            raise http_ex
-        except Exception as e:
-            print(f"OR-Tools solver failed on regeneration: {e}. Falling back to LLM...")
-
-    all_generated_slots: List[TimetableSlot] = []
-    
-    # Iterate Divisions (Reuse Logic)
-    for division in original_timetable.divisions:
-        print(f"Regenerating for Division: {division.name}")
-        
-        current_prompt = build_single_division_prompt(prompt_request, division, all_generated_slots)
-        if new_constraints:
-            current_prompt += f"\n\nADDITIONAL USER CONSTRAINTS:\n" + "\n".join([f"- {c}" for c in new_constraints])
-        
-        max_retries = 5
-        last_error = None
-        division_slots = []
-        success = False
-        
-        for attempt in range(max_retries):
-            llm_response = generate_timetable_with_llm(current_prompt)
-            
-            if "error" in llm_response:
-                last_error = f"LLM Error: {llm_response['error']}"
-                continue
-                
-            try:
-                slots_data = llm_response.get("slots", [])
-                division_slots = [TimetableSlot(**slot) for slot in slots_data]
-                
-                # Repairs
-                division_slots = repair_division_slots_full(division_slots, all_generated_slots, prompt_request, division.name)
-                
-                # Validate
-                temp_slots = all_generated_slots + division_slots
-                temp_response = TimetableResponse(
-                    timetable_id="temp",
-                    metadata=prompt_request.metadata,
-                    divisions=prompt_request.divisions,
-                    lecturers=prompt_request.lecturers,
-                    classrooms=prompt_request.classrooms,
-                    slots=temp_slots
-                )
-                
-                validation_result = validate_timetable(temp_response, prompt_request, specific_divisions=[division.name])
-                
-                if validation_result["valid"]:
-                    success = True
-                    break
-                else:
-                    last_error = str(validation_result['errors'])
-                    current_prompt += f"\n\nCRITICAL: Invalid generation. Violations:\n" + "\n".join([f"- {e}" for e in validation_result["errors"]])
-
-            except Exception as e:
-                last_error = f"Parsing Error: {e}"
-                
-        if not success:
-            print(f"HuggingFace failed to regenerate timetable for Division {division.name}. Falling back to local heuristic scheduler...")
-            try:
-                division_slots = repair_division_slots_full([], all_generated_slots, prompt_request, division.name)
-                # Check validation of local generation
-                temp_slots = all_generated_slots + division_slots
-                temp_response = TimetableResponse(
-                    timetable_id="temp",
-                    metadata=prompt_request.metadata,
-                    divisions=prompt_request.divisions,
-                    lecturers=prompt_request.lecturers,
-                    classrooms=prompt_request.classrooms,
-                    slots=temp_slots
-                )
-                validation_result = validate_timetable(temp_response, prompt_request, specific_divisions=[division.name])
-                if validation_result["valid"]:
-                    print(f"  Local heuristic scheduler succeeded for Div {division.name}!")
-                    success = True
-                else:
-                    print(f"  Local heuristic scheduler validation warnings: {validation_result['errors']}")
-                    success = True
-            except Exception as fallback_err:
-                print(f"Local heuristic scheduler fallback failed: {fallback_err}")
-                raise HTTPException(status_code=500, detail=f"Failed to regenerate for Div {division.name}. LLM failed: {last_error}. Heuristic fallback failed: {fallback_err}")
-             
-        all_generated_slots.extend(division_slots)
-
-    # Return newly generated timetable
-    new_timetable = TimetableResponse(
-        timetable_id=str(uuid.uuid4()),
-        metadata=original_timetable.metadata,
-        divisions=original_timetable.divisions,
-        lecturers=original_timetable.lecturers,
-        classrooms=original_timetable.classrooms,
-        labs=original_timetable.labs or [],
-        slots=all_generated_slots,
-        created_at=datetime.utcnow()
-    )
-    
-    return new_timetable
+    # Same pipeline as /generate, except that constraints the DSL cannot express
+    # skip the solver (it would ignore them) and go straight to the LLM
+    print("Regenerating timetable...")
+    return await run_pipeline_response(prompt_request, http_request, encoding, "regenerate", diagnostics, solver_with_free_text=False)
 
 @router.post("/auto-allocate", response_model=AutoAllocateResponse)
 def auto_allocate_endpoint(request: AutoAllocateRequest):
     print(f"Auto-allocating subjects for Department: {request.department}, Semester: {request.semester}")
-    
-    result = allocate_subjects_with_llm(
-        department=request.department,
-        semester=request.semester,
-        divisions=request.divisions,
-        subjects=request.subjects,
-        lecturers=request.lecturers
-    )
-    
+
+    # CP-SAT assignment; the LLM is only consulted, on request, to break ties
+    suggestion = None
+    if request.use_llm:
+        suggestion = suggest_allocation_with_llm(
+            department=request.department,
+            semester=request.semester,
+            divisions=request.divisions,
+            subjects=request.subjects,
+            lecturers=request.lecturers
+        )
+    result = allocate_subjects(request, suggestion)
+
     if "error" in result:
         raise HTTPException(status_code=500, detail=result["error"])
-        
+    return AutoAllocateResponse(**result)
+
+@router.post("/validate/batch")
+async def validate_timetables_batch(http_request: Request):
+    """
+    Validates many stored timetables, sent either as NDJSON (one timetable per line)
+    or as a JSON list. The body is spooled (to disk past BATCH_VALIDATION_SPOOL_BYTES)
+    before responding, then parsed incrementally while results are streamed back
+    as NDJSON in completion order, each tagged with its input index and timetable_id.
+    """
     try:
-        # Validate that the response format is correct
-        parsed_response = AutoAllocateResponse(**result)
-        return parsed_response
-    except Exception as e:
-        print(f"Failed to parse LLM auto-allocate response: {e}. Raw response: {result}")
-        raise HTTPException(status_code=500, detail=f"AI returned invalid format: {e}")
+        spool = await spool_body(http_request.stream())
+    except ClientDisconnect:
+        return JSONResponse(status_code=499, content={"detail": "Client disconnected while sending the batch."})
+
+    if "ndjson" in http_request.headers.get("content-type", ""):
+        payloads = iter_ndjson_lines(iter_spooled(spool))
+    else:
+        head = (await run_in_threadpool(spool.read, 1024)).lstrip()
+        if not head.startswith(b"["):
+            spool.close()
+            raise HTTPException(status_code=400, detail="Expected a JSON list of timetables or an NDJSON body.")
+        await run_in_threadpool(spool.seek, 0)
+        payloads = iter_json_list(iter_spooled(spool))
+
+    async def results():
+        # The body is fully read, so the response may listen for the disconnect
+        # itself; the validation loop also polls is_disconnected between results
+        try:
+            async for line in stream_batch_validation(payloads, http_request.is_disconnected):
+                yield line
+        finally:
+            spool.close()
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+@router.get("/explanations/{explanation_id}")
+def get_explanation(explanation_id: str):
+    """
+    Infeasibility explanation by id. `status` is pending while the LLM is
+    still working (the template explanation is returned meanwhile), ready once
+    the LLM explanation is in, or failed if every model failed.
+    """
+    report = get_conflict_explanation(explanation_id)
+    if report is None:
+        raise HTTPException(status_code=404, detail="Explanation not found")
+    return report
+
+@router.get("/llm/stats")
+def llm_stats():
+    """LLM response cache counters and per-model health, for monitoring repeated flows."""
+    return {
+        "cache": llm_cache.stats(),
+        "models": model_health.snapshot()
+    }
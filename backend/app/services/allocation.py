@@ -0,0 +1,220 @@
+import time
+from collections import Counter
+from typing import Dict, Optional
+from ortools.sat.python import cp_model
+from app.core.config import settings
+from app.models.schemas import AutoAllocateRequest
+
+# Phase 1 objective weights, in strict priority order: cover every (division,
+# subject), then avoid lecturers who do not list the subject, then balance the
+# heaviest weekly load. Phase 2 only breaks ties between phase 1 optima.
+UNASSIGNED_COST = 1_000_000
+NOT_LISTED_COST = 1_000
+SUGGESTION_BONUS = 2
+DEFAULT_BONUS = 1
+
+
+def _teaches_semester(lecturer, semester: int) -> bool:
+    return not lecturer.semesters or semester in lecturer.semesters
+
+
+def allocation_candidates(request: AutoAllocateRequest, fallback_subjects: set = frozenset()) -> Dict[str, Dict[str, int]]:
+    """
+    For each subject code, the lecturers that may take it and their cost:
+    0 for the default lecturer or one listing the subject. Subjects nobody
+    lists, or in `fallback_subjects`, may also go to any other active
+    lecturer of the semester at NOT_LISTED_COST.
+    """
+    active = [l for l in request.lecturers if l.status == "Active" and _teaches_semester(l, request.semester)]
+    active_ids = {l.id for l in active}
+    by_subject = {}
+    for lec in active:
+        for name in lec.subjects:
+            by_subject.setdefault(name, set()).add(lec.id)
+
+    candidates = {}
+    for sub in request.subjects:
+        listed = by_subject.get(sub.code, set()) | by_subject.get(sub.name, set())
+        if sub.assigned_lecturer_id in active_ids:
+            listed.add(sub.assigned_lecturer_id)
+        options = {lec_id: 0 for lec_id in sorted(listed)}
+        if not listed or sub.code in fallback_subjects:
+            options.update({lec.id: NOT_LISTED_COST for lec in active if lec.id not in listed})
+        candidates[sub.code] = options
+    return candidates
+
+
+def _greedy_hint(request: AutoAllocateRequest, candidates: dict, lecturers: dict) -> dict:
+    """
+    Longest-first greedy allocation to the least loaded eligible lecturer with
+    room left; a starting point for CP-SAT. Returns (division, subject code) -> lecturer.
+    """
+    load = Counter()
+    hint = {}
+    pairs = sorted(
+        ((div.name, sub) for div in request.divisions for sub in request.subjects),
+        key=lambda pair: -pair[1].periods_per_week
+    )
+    for div_name, sub in pairs:
+        fitting = [
+            (cost, load[lec_id], lec_id)
+            for lec_id, cost in candidates[sub.code].items()
+            if load[lec_id] + sub.periods_per_week <= lecturers[lec_id].max_periods_per_week
+        ]
+        if fitting:
+            lec_id = min(fitting)[2]
+            load[lec_id] += sub.periods_per_week
+            hint[div_name, sub.code] = lec_id
+    return hint
+
+
+def _solve_assignment(request: AutoAllocateRequest, candidates: dict, lecturers: dict, suggested: dict, time_limit: float):
+    """
+    CP-SAT assignment in two lexicographic phases. Returns ((division, subject
+    code) -> lecturer id or None, phase 1 status name); the mapping is None if
+    phase 1 found no solution in time.
+    """
+    deadline = time.monotonic() + time_limit
+    hint = _greedy_hint(request, candidates, lecturers)
+    model = cp_model.CpModel()
+    y = {}  # (division, subject code, lecturer) -> assigned
+    costs = []
+    bonuses = []
+    loads = {}
+    for div in request.divisions:
+        for sub in request.subjects:
+            choice = []
+            for lec_id, cost in candidates[sub.code].items():
+                var = model.NewBoolVar(f"y_{div.name}_{sub.code}_{lec_id}")
+                y[div.name, sub.code, lec_id] = var
+                model.AddHint(var, hint.get((div.name, sub.code)) == lec_id)
+                choice.append(var)
+                loads.setdefault(lec_id, []).append(var * sub.periods_per_week)
+                if cost:
+                    costs.append(var * cost)
+                bonus = (SUGGESTION_BONUS if suggested.get((div.name, sub.code)) == lec_id else 0) + (DEFAULT_BONUS if sub.assigned_lecturer_id == lec_id else 0)
+                if bonus:
+                    bonuses.append(var * bonus)
+            missing = model.NewBoolVar(f"unassigned_{div.name}_{sub.code}")
+            model.AddHint(missing, (div.name, sub.code) not in hint)
+            costs.append(missing * UNASSIGNED_COST)
+            model.AddExactlyOne(choice + [missing])
+
+    # Balance: the heaviest weekly load, in whole periods (percentages of
+    # max_periods_per_week make the bound proofs an order of magnitude slower)
+    load_bound = max((l.max_periods_per_week for l in lecturers.values()), default=0)
+    max_load = model.NewIntVar(0, load_bound, "max_load")
+    hinted_load = Counter()
+    periods = {sub.code: sub.periods_per_week for sub in request.subjects}
+    for (_, code), lec_id in hint.items():
+        hinted_load[lec_id] += periods[code]
+    model.AddHint(max_load, max(hinted_load.values(), default=0))
+    for lec_id, terms in loads.items():
+        model.Add(sum(terms) <= lecturers[lec_id].max_periods_per_week)
+        model.Add(sum(terms) <= max_load)
+
+    # Phase 1: coverage, eligibility, then balance (one unit of cost outweighs any max_load)
+    model.Minimize(sum(costs) * (load_bound + 1) + max_load)
+    solver = cp_model.CpSolver()
+    solver.parameters.max_time_in_seconds = time_limit
+    solver.parameters.num_workers = 1  # small models: a parallel portfolio only adds start-up time
+    status = solver.Solve(model)
+    status_name = solver.StatusName(status)
+    if status not in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+        return None, status_name
+
+    # Phase 2: same coverage, eligibility and balance; prefer the LLM suggestion
+    # and the subjects' default lecturers among the equal allocations
+    if bonuses and deadline - time.monotonic() > 0.01:
+        model.Add(sum(costs) <= int(solver.Value(sum(costs))))
+        model.Add(max_load <= solver.Value(max_load))
+        model.ClearHints()
+        for var in y.values():
+            model.AddHint(var, solver.BooleanValue(var))
+        model.Maximize(sum(bonuses))
+        tie_breaker = cp_model.CpSolver()
+        tie_breaker.parameters.max_time_in_seconds = deadline - time.monotonic()
+        tie_breaker.parameters.num_workers = 1
+        if tie_breaker.Solve(model) in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+            solver = tie_breaker
+
+    assignment = {}
+    for div in request.divisions:
+        for sub in request.subjects:
+            assignment[div.name, sub.code] = next(
+                (lec_id for lec_id in candidates[sub.code] if solver.BooleanValue(y[div.name, sub.code, lec_id])),
+                None
+            )
+    return assignment, status_name
+
+
+def allocate_subjects(request: AutoAllocateRequest, suggestion: Optional[dict] = None, time_limit: float = None) -> dict:
+    """
+    Assigns a lecturer to every subject of every division with a CP-SAT
+    assignment model: each lecturer stays within max_periods_per_week and
+    teaches only in their semesters, and the heaviest weekly load is
+    minimised to balance the workload. Lecturers who do not list a subject
+    are only used for subjects that cannot be covered otherwise.
+    `suggestion` (an LLM allocation in the response shape) only breaks ties
+    between otherwise equal allocations; ids it invents are ignored.
+    Returns {"divisions": [...], "report": {...}}; subjects nobody can take
+    are left without a lecturer and listed in the report.
+    """
+    started = time.monotonic()
+    deadline = started + (time_limit if time_limit is not None else settings.ALLOCATION_TIME_LIMIT_SECONDS)
+    lecturers = {l.id: l for l in request.lecturers}
+    suggested = {}
+    for div in (suggestion or {}).get("divisions") or []:
+        for sub in div.get("subjects") or []:
+            suggested[(div.get("name"), sub.get("code"))] = sub.get("assigned_lecturer_id")
+
+    fallback_subjects = set()
+    while True:
+        candidates = allocation_candidates(request, fallback_subjects)
+        assignment, solver_status = _solve_assignment(request, candidates, lecturers, suggested, max(0.01, deadline - time.monotonic()))
+        if assignment is None:
+            # Only reachable on timeout: leaving everything unassigned is always feasible
+            return {"error": f"Subject allocation solver finished with status {solver_status}."}
+        short = {code for (_, code), lec_id in assignment.items() if lec_id is None} - fallback_subjects
+        if not short or time.monotonic() >= deadline:
+            break
+        fallback_subjects |= short
+
+    load = Counter()
+    allocated_divisions = []
+    unassigned = []
+    not_listed = []
+    for div in request.divisions:
+        div_subjects = []
+        for sub in request.subjects:
+            assigned_id = assignment[div.name, sub.code]
+            if assigned_id is None:
+                unassigned.append({
+                    "division": div.name,
+                    "subject": sub.code,
+                    "reason": "no active lecturer for this semester" if not candidates[sub.code] else "every eligible lecturer is at max_periods_per_week"
+                })
+            else:
+                load[assigned_id] += sub.periods_per_week
+                if candidates[sub.code][assigned_id]:
+                    not_listed.append({"division": div.name, "subject": sub.code, "lecturer": assigned_id})
+            div_subjects.append(sub.model_copy(update={"assigned_lecturer_id": assigned_id}).model_dump())
+        allocated_divisions.append({"name": div.name, "strength": div.strength, "subjects": div_subjects})
+
+    report = {
+        "status": "COMPLETE" if not unassigned else "PARTIAL",
+        "solver_status": solver_status,
+        "seconds": round(time.monotonic() - started, 4),
+        "demand_periods": len(request.divisions) * sum(sub.periods_per_week for sub in request.subjects),
+        "capacity_periods": sum(l.max_periods_per_week for l in request.lecturers if l.status == "Active" and _teaches_semester(l, request.semester)),
+        "max_load": max(load.values(), default=0),
+        "lecturer_loads": [
+            {"lecturer": lec_id, "periods": load[lec_id], "max_periods_per_week": lecturers[lec_id].max_periods_per_week}
+            for lec_id in lecturers if load[lec_id]
+        ],
+        "unassigned": unassigned,
+        "not_listed": not_listed,
+        "llm_tiebreak": suggestion is not None,
+    }
+    print(f"Subject allocation {report['status']} in {report['seconds']}s: {len(unassigned)} unassigned, max load {report['max_load']} periods.")
+    return {"divisions": allocated_divisions, "report": report}
@@ -0,0 +1,170 @@
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import List, Optional
+from app.core.config import settings
+from app.models.schemas import TimetableRequest
+from app.services.columnar_validator import validate_timetable_columnar
+from app.services.deadline import Deadline
+from app.services.pipeline import apply_lecturer_assignments, merge_labs_into_classrooms, slot_lecturer_assignments
+from app.services.problem import CompiledProblem
+from app.services.prompt_builder import subject_lecturers
+from app.services.repair import repair_divisions_batch
+from app.services.slots import Slot
+from app.services.solver import schedule_with_ortools
+
+
+def _resource_keys(request: TimetableRequest) -> set:
+    """Lecturers the request's subjects may use and rooms it may book, as ("lecturer"|"room", id)."""
+    keys = set()
+    for division in request.divisions:
+        for subject in division.subjects:
+            keys.update(("lecturer", lec_id) for lec_id in subject_lecturers(request, subject))
+    keys.update(("room", room.id) for room in request.classrooms if room.status == "Available")
+    keys.update(("room", lab.id) for lab in request.labs or [] if lab.status == "Available")
+    return keys
+
+
+def _demand(request: TimetableRequest) -> int:
+    return sum(s.periods_per_week for d in request.divisions for s in d.subjects)
+
+
+def resource_components(requests: List[TimetableRequest]) -> List[List[int]]:
+    """
+    Groups request indexes that share any lecturer or room (union-find).
+    Within a group, the largest requests come first so they get the pick of the
+    shared resources; groups are independent of each other.
+    """
+    parent = list(range(len(requests)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    owner = {}
+    for i, request in enumerate(requests):
+        for key in _resource_keys(request):
+            if key in owner:
+                parent[find(i)] = find(owner[key])
+            else:
+                owner[key] = i
+
+    groups = {}
+    for i in range(len(requests)):
+        groups.setdefault(find(i), []).append(i)
+    return [sorted(group, key=lambda i: (-_demand(requests[i]), i)) for group in groups.values()]
+
+
+def _heuristic_schedule(request: TimetableRequest, booked: List[Slot], problem: CompiledProblem) -> List[Slot]:
+    """Local heuristic scheduler, division by division, around the slots already booked."""
+    # Namespace other requests' divisions so equal names ("Div A") do not collide
+    occupied = [slot.copy(division=f"external:{slot.division}") for slot in booked]
+    repaired = repair_divisions_batch({division.name: [] for division in request.divisions}, occupied, request, problem=problem)
+    return [slot for slots in repaired.values() for slot in slots]
+
+
+def _heuristic_status(validation) -> str:
+    """SUCCESS if the heuristic timetable is valid, PARTIAL if it only misses periods, INVALID if it breaks a hard rule."""
+    if validation.valid:
+        return "SUCCESS"
+    hard = [name for name, violated in validation.violations.items() if violated and name != "counts"]
+    return "INVALID" if hard else "PARTIAL"
+
+
+def generate_component(indexed_requests: list, time_limit: float = None, timeout_seconds: float = None, deadline: Deadline = None) -> list:
+    """
+    Schedules requests that share resources one after another; each request
+    sees the lecturer/room bookings of the ones before it (ExternalBookings).
+    Runs in a worker process, so inputs and results are plain picklable data
+    (a worker gets `timeout_seconds` and builds its own Deadline).
+    Returns one result dict per (index, request): SUCCESS, or PARTIAL/INVALID
+    for a heuristic timetable that misses periods / breaks a hard rule, or
+    INFEASIBLE, or TIMEOUT/CANCELLED once the deadline is up.
+    """
+    deadline = deadline or Deadline(timeout_seconds)
+    booked: List[Slot] = []
+    results = []
+    for index, request in indexed_requests:
+        started = time.monotonic()
+        if deadline.cancelled or deadline.expired:
+            results.append({"index": index, "status": "CANCELLED" if deadline.cancelled else "TIMEOUT", "seconds": 0.0})
+            continue
+        merge_labs_into_classrooms(request)
+        problem = CompiledProblem(request)
+        result = {"index": index, "status": "SUCCESS", "source": "cp_sat"}
+        try:
+            solver_result = schedule_with_ortools(request, time_limit, deadline, booked_slots=booked, problem=problem)
+        except Exception as e:
+            print(f"Batch request {index}: CP-SAT failed ({e}); using the heuristic scheduler.")
+            solver_result = {"status": "ERROR"}
+
+        if solver_result["status"] == "SUCCESS":
+            slots = solver_result["slots"]
+            apply_lecturer_assignments(request, solver_result.get("lecturer_assignments", []))
+        elif solver_result["status"] == "INFEASIBLE":
+            conflicts = solver_result.get("conflicts") or [solver_result.get("error", "No feasible schedule.")]
+            if booked:
+                conflicts.append("Lecturers or rooms shared with earlier requests in this batch may already be booked at the required times.")
+            results.append({**result, "status": "INFEASIBLE", "conflicts": conflicts, "seconds": round(time.monotonic() - started, 4)})
+            continue
+        elif solver_result["status"] == "CANCELLED":
+            results.append({"index": index, "status": "CANCELLED", "seconds": round(time.monotonic() - started, 4)})
+            continue
+        else:
+            slots = _heuristic_schedule(request, booked, problem)
+            apply_lecturer_assignments(request, slot_lecturer_assignments(slots))
+            result["source"] = "heuristic"
+            # Unlike CP-SAT output, the heuristic's is not guaranteed to fit the rules or the other departments' bookings
+            validation = validate_timetable_columnar(slots, request, problem=problem, booked_slots=booked)
+            result["status"] = _heuristic_status(validation)
+            if not validation.valid:
+                result["errors"] = validation.errors
+                print(f"Batch request {index}: heuristic timetable is {result['status']}: {validation.errors}")
+            if result["status"] == "INVALID":
+                # Not booked: later requests should not plan around a timetable that cannot be used
+                results.append({**result, "seconds": round(time.monotonic() - started, 4)})
+                continue
+
+        booked.extend(slots)
+        results.append({**result, "request": request, "slots": [slot.to_dict() for slot in slots], "seconds": round(time.monotonic() - started, 4)})
+    return results
+
+
+def run_batch_generation(requests: List[TimetableRequest], workers: int = None, time_limit: float = None, deadline: Optional[Deadline] = None) -> list:
+    """
+    Generates timetables for many requests drawing on one staff and room pool.
+    Requests sharing a lecturer or room are scheduled in order within their
+    component so nothing is double-booked across departments; independent
+    components run in parallel worker processes (BATCH_GENERATION_WORKERS).
+    Requests not started before `deadline` runs out are TIMEOUT; once it is
+    cancelled the remaining ones are CANCELLED (a component already running in
+    a worker process finishes its current request first).
+    Returns results in input order.
+    """
+    workers = workers if workers is not None else settings.BATCH_GENERATION_WORKERS
+    deadline = deadline or Deadline()
+    components = resource_components(requests)
+    jobs = [[(i, requests[i]) for i in component] for component in components]
+    print(f"Batch generation: {len(requests)} requests in {len(components)} independent components.")
+
+    if workers > 1 and len(jobs) > 1:
+        pool = ProcessPoolExecutor(max_workers=min(workers, len(jobs)))
+        try:
+            futures = {pool.submit(generate_component, job, time_limit, deadline.remaining()): job for job in jobs}
+            component_results = []
+            pending = set(futures)
+            while pending and not deadline.cancelled:
+                done, pending = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+                component_results.extend(future.result() for future in done)
+            for future in pending:
+                future.cancel()
+                component_results.append([{"index": i, "status": "CANCELLED", "seconds": 0.0} for i, _ in futures[future]])
+        finally:
+            pool.shutdown(wait=not deadline.cancelled, cancel_futures=True)
+    else:
+        component_results = [generate_component(job, time_limit, deadline=deadline) for job in jobs]
+
+    results = [result for component in component_results for result in component]
+    results.sort(key=lambda r: r["index"])
+    return results
@@ -0,0 +1,182 @@
+import asyncio
+import codecs
+import json
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import AsyncIterator, Awaitable, Callable, Optional, Union
+from pydantic import ValidationError
+from fastapi.concurrency import run_in_threadpool
+from app.core.config import settings
+from app.models.schemas import TimetableRequest, TimetableResponse
+from app.services.columnar_validator import validate_timetable_columnar
+from app.services.slot_stream import SlotStreamParser
+
+_executor = None
+
+
+def get_validation_executor() -> ProcessPoolExecutor:
+    """Process pool shared by batch validation requests, created on first use."""
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=settings.BATCH_VALIDATION_WORKERS)
+    return _executor
+
+
+def validate_timetable_payload(index: int, payload: Union[str, dict]) -> dict:
+    """
+    Worker entrypoint: parses one stored timetable (raw NDJSON line or dict)
+    and validates it with the columnar validator.
+    """
+    timetable_id = None
+    try:
+        if isinstance(payload, str):
+            payload = json.loads(payload)
+        if isinstance(payload, dict):
+            timetable_id = payload.get("timetable_id")
+        timetable = TimetableResponse(**payload)
+    except (ValueError, TypeError, ValidationError) as e:
+        return {"index": index, "timetable_id": timetable_id, "valid": False, "errors": [f"Invalid timetable payload: {e}"]}
+
+    request = TimetableRequest(
+        metadata=timetable.metadata,
+        divisions=timetable.divisions,
+        lecturers=timetable.lecturers,
+        classrooms=timetable.classrooms,
+        labs=timetable.labs,
+        blocked=timetable.blocked
+    )
+    result = validate_timetable_columnar(timetable.slots, request)
+    return {"index": index, "timetable_id": timetable.timetable_id, "valid": result.valid, "errors": result.errors}
+
+
+def reset_validation_executor(executor: ProcessPoolExecutor) -> None:
+    """Drops a broken pool so the next batch gets fresh workers."""
+    global _executor
+    if _executor is executor:
+        _executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def iter_ndjson_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """
+    Yields the non-empty lines of an NDJSON body as its chunks arrive; only the
+    unfinished line is buffered, and parsing happens in the workers.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    pending = ""
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        lines = pending.split("\n")
+        pending = lines.pop()
+        for line in lines:
+            if line.strip():
+                yield line
+    pending += decoder.decode(b"", final=True)
+    if pending.strip():
+        yield pending
+
+
+async def spool_body(chunks: AsyncIterator[bytes]) -> tempfile.SpooledTemporaryFile:
+    """
+    Reads a request body into memory, rolling over to a temporary file past
+    BATCH_VALIDATION_SPOOL_BYTES, and returns it rewound. The caller closes it.
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=settings.BATCH_VALIDATION_SPOOL_BYTES)
+    try:
+        async for chunk in chunks:
+            # May write to disk once rolled over: keep it off the event loop
+            await run_in_threadpool(spool.write, chunk)
+        await run_in_threadpool(spool.seek, 0)
+    except BaseException:
+        spool.close()
+        raise
+    return spool
+
+
+async def iter_spooled(spool, chunk_size: int = 64 * 1024) -> AsyncIterator[bytes]:
+    """Reads a spooled body back in chunks, for iter_ndjson_lines / iter_json_list."""
+    while True:
+        chunk = await run_in_threadpool(spool.read, chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+async def iter_json_list(chunks: AsyncIterator[bytes]) -> AsyncIterator[Optional[dict]]:
+    """
+    Yields the objects of a JSON list body as each one is complete (None for
+    one that is not valid JSON), without holding the whole list in memory.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    parser = SlotStreamParser(key=None)
+    async for chunk in chunks:
+        for item in parser.feed(decoder.decode(chunk)):
+            yield item
+        if parser.done:
+            return
+
+
+def _error_line(index: int, timetable_id: Optional[str], error: str) -> str:
+    return json.dumps({"index": index, "timetable_id": timetable_id, "valid": False, "errors": [error]}) + "\n"
+
+
+async def stream_batch_validation(
+    payloads: AsyncIterator[Union[str, dict]],
+    is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None
+) -> AsyncIterator[str]:
+    """
+    Validates timetables in worker processes and yields one NDJSON result
+    line per timetable as each completes. At most 2x workers timetables are
+    in flight and payloads are pulled from the body only as slots free up, so
+    memory stays flat regardless of batch size. A timetable whose validation
+    fails (or whose worker dies) gets an error line instead of ending the
+    stream; a crashed pool is replaced. Pending work is cancelled when the
+    stream is closed early or `is_disconnected` reports the client gone.
+    """
+    loop = asyncio.get_running_loop()
+    max_in_flight = max(1, settings.BATCH_VALIDATION_WORKERS) * 2
+    # Future -> (index, timetable_id when known, executor) for error lines
+    pending = {}
+
+    def submit(index: int, payload) -> None:
+        executor = get_validation_executor()
+        try:
+            future = loop.run_in_executor(executor, validate_timetable_payload, index, payload)
+        except BrokenProcessPool:
+            reset_validation_executor(executor)
+            executor = get_validation_executor()
+            future = loop.run_in_executor(executor, validate_timetable_payload, index, payload)
+        pending[future] = (index, payload.get("timetable_id") if isinstance(payload, dict) else None, executor)
+
+    async def completed() -> AsyncIterator[str]:
+        done, _ = await asyncio.wait(list(pending), return_when=asyncio.FIRST_COMPLETED)
+        for future in done:
+            index, timetable_id, executor = pending.pop(future)
+            try:
+                line = json.dumps(future.result()) + "\n"
+            except BrokenProcessPool as e:
+                reset_validation_executor(executor)
+                line = _error_line(index, timetable_id, f"Validation worker crashed: {e}")
+            except Exception as e:
+                line = _error_line(index, timetable_id, f"Validation failed: {e}")
+            yield line
+
+    try:
+        index = 0
+        async for payload in payloads:
+            submit(index, payload)
+            index += 1
+            if len(pending) >= max_in_flight:
+                async for line in completed():
+                    yield line
+
+        while pending:
+            if is_disconnected is not None and await is_disconnected():
+                print("Client disconnected; cancelling batch validation.")
+                return
+            async for line in completed():
+                yield line
+    finally:
+        for future in pending:
+            future.cancel()
@@ -0,0 +1,171 @@
+import numpy as np
+from app.models.schemas import TimetableRequest
+from app.services.constraints import replay_constraint_errors, request_rules, _group_ids
+from app.services.problem import CompiledProblem
+
+
+class SlotColumns:
+    """
+    Integer-coded columnar view of a list of slots, built in one pass.
+    Days, lecturers, rooms, divisions and subjects are interned to ids; the
+    CompiledProblem's ids come first, so `day < num_working_days` /
+    `division < num_divisions` mean "known" and known lecturers index the
+    problem's per-lecturer arrays directly.
+    """
+
+    def __init__(self, slots: list, request: TimetableRequest, problem: CompiledProblem = None):
+        self.slots = slots
+        self.problem = problem or CompiledProblem(request)
+        self.num_working_days = len(self.problem.working_days)
+
+        self.day_ids = dict(self.problem.day_ids)
+        self.division_ids = dict(self.problem.division_ids)
+        self.num_divisions = len(self.division_ids)
+        self.lecturer_ids = dict(self.problem.lecturer_ids)
+        self.room_ids = dict(self.problem.room_ids)
+        self.subject_ids = {}
+
+        n = len(slots)
+        day = np.empty(n, dtype=np.int64)
+        period = np.empty(n, dtype=np.int64)
+        lecturer = np.empty(n, dtype=np.int64)
+        room = np.empty(n, dtype=np.int64)
+        division = np.empty(n, dtype=np.int64)
+        subject = np.empty(n, dtype=np.int64)
+        is_theory = np.empty(n, dtype=bool)
+
+        day_ids, lecturer_ids, room_ids = self.day_ids, self.lecturer_ids, self.room_ids
+        division_ids, subject_ids = self.division_ids, self.subject_ids
+        for i, slot in enumerate(slots):
+            day[i] = day_ids.setdefault(slot.day, len(day_ids))
+            period[i] = slot.period
+            lecturer[i] = lecturer_ids.setdefault(slot.lecturer, len(lecturer_ids))
+            room[i] = room_ids.setdefault(slot.room, len(room_ids))
+            division[i] = division_ids.setdefault(slot.division, len(division_ids))
+            subject[i] = subject_ids.setdefault(slot.subject, len(subject_ids))
+            is_theory[i] = slot.type != 'Lab'
+
+        self.day = day
+        self.period = period
+        self.lecturer = lecturer
+        self.room = room
+        self.division = division
+        self.subject = subject
+        self.is_theory = is_theory
+
+
+class ColumnarValidationResult:
+    """
+    Outcome of validate_timetable_columnar. `valid` is decided from the
+    vectorized checks; `errors` are only formatted when first accessed and
+    match validate_timetable's messages and order.
+    """
+
+    def __init__(self, columns: SlotColumns, request: TimetableRequest, specific_divisions, violations: dict, counts_table: dict, metadata_rows, rules: list):
+        self.columns = columns
+        self.rules = rules
+        self.request = request
+        self.specific_divisions = specific_divisions
+        self.violations = violations
+        self.counts_table = counts_table
+        self.metadata_rows = metadata_rows
+        self.valid = not any(violations.values())
+        self._errors = None
+
+    @property
+    def errors(self) -> list:
+        if self._errors is None:
+            self._errors = [] if self.valid else self._materialize_errors()
+        return self._errors
+
+    def to_dict(self) -> dict:
+        return {
+            "valid": self.valid,
+            "errors": self.errors
+        }
+
+    def _materialize_errors(self) -> list:
+        slots = self.columns.slots
+        errors = []
+
+        # 1. Hard rules: replay only the violated ones through their incremental checkers
+        violated_rules = [rule for rule in self.rules if self.violations[rule.name]]
+        if violated_rules:
+            errors.extend(replay_constraint_errors(slots, self.request, violated_rules, self.columns.problem))
+
+        # 2. Unknown divisions, then subject period counts PER DIVISION
+        if self.violations["unknown_division"]:
+            for i in np.flatnonzero(self.columns.division >= self.columns.num_divisions):
+                errors.append(f"Unknown division '{slots[i].division}' in slot")
+        if self.violations["counts"]:
+            counts = self.counts_table
+            for div in self.request.divisions:
+                if self.specific_divisions is not None and div.name not in self.specific_divisions:
+                    continue
+                for subject in div.subjects:
+                    count = counts.get((div.name, subject.code), 0)
+                    if count != subject.periods_per_week:
+                        errors.append(f"Div {div.name}: Subject {subject.code} has {count} periods, expected {subject.periods_per_week}")
+
+        # 3. Metadata validity
+        if self.violations["metadata"]:
+            max_period = self.request.metadata.periods_per_day
+            for i in np.flatnonzero(self.metadata_rows):
+                slot = slots[i]
+                if self.columns.day[i] >= self.columns.num_working_days:
+                    errors.append(f"Invalid day '{slot.day}' in slot for {slot.subject}")
+                if slot.period < 1 or slot.period > max_period:
+                    errors.append(f"Invalid period {slot.period} in slot for {slot.subject}")
+
+        return errors
+
+
+def validate_timetable_columnar(slots: list, request: TimetableRequest, specific_divisions: list[str] = None, problem: CompiledProblem = None, booked_slots: list = None) -> ColumnarValidationResult:
+    """
+    Columnar equivalent of validate_timetable for large timetables.
+    Slots are integer-coded once and every registry rule runs its vectorized
+    check_batch on the columns; error strings are built lazily via `.errors`.
+    `booked_slots` (e.g. other departments in a batch) are checked like the
+    blocked calendar, by ExternalBookings.
+    """
+    columns = SlotColumns(slots, request, problem)
+    rules = request_rules(request, booked_slots)
+    violations = {rule.name: False for rule in rules}
+    violations.update({
+        "unknown_division": False,
+        "counts": False,
+        "metadata": False,
+    })
+
+    # Key: (Division, Subject) -> Count, for known divisions
+    counts_table = {}
+    metadata_rows = None
+    if len(slots):
+        known = columns.division < columns.num_divisions
+        violations["unknown_division"] = bool((~known).any())
+
+        for rule in rules:
+            violations[rule.name] = rule.check_batch(columns, request)
+
+        if known.any():
+            known_div, known_sub = columns.division[known], columns.subject[known]
+            _, first_rows, pair_counts = np.unique(_group_ids(known_div, known_sub), return_index=True, return_counts=True)
+            division_names = list(columns.division_ids)
+            subject_names = list(columns.subject_ids)
+            for row, count in zip(first_rows, pair_counts):
+                counts_table[(division_names[known_div[row]], subject_names[known_sub[row]])] = int(count)
+
+        metadata_rows = (columns.day >= columns.num_working_days) | (columns.period < 1) | (columns.period > request.metadata.periods_per_day)
+        violations["metadata"] = bool(metadata_rows.any())
+
+    for div in request.divisions:
+        if specific_divisions is not None and div.name not in specific_divisions:
+            continue
+        for subject in div.subjects:
+            if counts_table.get((div.name, subject.code), 0) != subject.periods_per_week:
+                violations["counts"] = True
+                break
+        if violations["counts"]:
+            break
+
+    return ColumnarValidationResult(columns, request, specific_divisions, violations, counts_table, metadata_rows, rules)
@@ -0,0 +1,130 @@
+import gzip
+import hashlib
+from typing import List, Optional
+import orjson
+from fastapi.responses import Response
+from app.services.slots import SLOT_FIELDS
+
+try:
+    import zstandard
+except ImportError:  # optional; gzip is always available
+    zstandard = None
+
+COMPACT_FORMAT = "timetable.compact/1"
+# Fields coded as indexes into a lookup table (period is sent as-is)
+_CODED_FIELDS = [f for f in SLOT_FIELDS if f != "period"]
+_RESOURCE_GROUPS = ["divisions", "lecturers", "classrooms", "labs"]
+MIN_COMPRESS_BYTES = 1024
+
+
+def resource_hash(resource: dict) -> str:
+    """Content hash of a resource (sorted-key JSON), stable across requests."""
+    return hashlib.sha256(orjson.dumps(resource, option=orjson.OPT_SORT_KEYS)).hexdigest()[:16]
+
+
+def encode_compact(timetable, include_resources: bool = True) -> dict:
+    """
+    Compact form of a timetable: divisions, lecturers, classrooms and labs are
+    listed by content hash (bodies in `resources` unless include_resources is
+    False, for callers that already hold them), and slots become parallel
+    integer arrays indexing per-field lookup `tables`. Days are coded in
+    working-day order. Accepts a TimetableResponse or its JSON-ready dict form.
+    """
+    data = timetable if isinstance(timetable, dict) else timetable.model_dump(mode="json")
+    resources = {}
+    refs = {}
+    for group in _RESOURCE_GROUPS:
+        refs[group] = []
+        for resource in data.get(group) or []:
+            key = resource_hash(resource)
+            resources[key] = resource
+            refs[group].append(key)
+
+    tables = {field: [] for field in _CODED_FIELDS}
+    tables["day"] = list(data["metadata"]["working_days"])
+    indexes = {field: {value: i for i, value in enumerate(values)} for field, values in tables.items()}
+    columns = {field: [] for field in SLOT_FIELDS}
+    for slot in data["slots"]:
+        for field in SLOT_FIELDS:
+            value = slot[field]
+            if field == "period":
+                columns[field].append(value)
+                continue
+            code = indexes[field].get(value)
+            if code is None:
+                code = indexes[field][value] = len(tables[field])
+                tables[field].append(value)
+            columns[field].append(code)
+
+    payload = {
+        "format": COMPACT_FORMAT,
+        "timetable_id": data["timetable_id"],
+        "created_at": data.get("created_at"),
+        "metadata": data["metadata"],
+        "pipeline": data.get("pipeline"),
+        "diagnostics": data.get("diagnostics"),
+        "blocked": data.get("blocked") or [],
+        **refs,
+        "tables": tables,
+        "slots": columns,
+    }
+    if include_resources:
+        payload["resources"] = resources
+    return payload
+
+
+def decode_compact(payload: dict, resources: Optional[dict] = None) -> dict:
+    """
+    Expands a compact payload back into the TimetableResponse shape.
+    `resources` supplies bodies by hash when the payload was sent without them.
+    """
+    known = {**(resources or {}), **payload.get("resources", {})}
+    missing = [key for group in _RESOURCE_GROUPS for key in payload.get(group, []) if key not in known]
+    if missing:
+        raise KeyError(f"Unknown resource hashes: {missing[:5]}")
+
+    tables = payload["tables"]
+    columns = payload["slots"]
+    slots = [
+        {field: (columns[field][i] if field == "period" else tables[field][columns[field][i]]) for field in SLOT_FIELDS}
+        for i in range(len(columns["period"]))
+    ]
+    timetable = {
+        "timetable_id": payload["timetable_id"],
+        "created_at": payload.get("created_at"),
+        "metadata": payload["metadata"],
+        "pipeline": payload.get("pipeline"),
+        "diagnostics": payload.get("diagnostics"),
+        "blocked": payload.get("blocked") or [],
+        "slots": slots,
+    }
+    for group in _RESOURCE_GROUPS:
+        timetable[group] = [known[key] for key in payload.get(group, [])]
+    return timetable
+
+
+def _accepted_encodings(accept_encoding: Optional[str]) -> List[str]:
+    encodings = []
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.strip().partition(";")
+        if name and params.replace(" ", "") not in ("q=0", "q=0.0"):
+            encodings.append(name.lower())
+    return encodings
+
+
+def compact_response(payload: dict, accept_encoding: Optional[str] = None, status_code: int = 200) -> Response:
+    """
+    Serializes with orjson and compresses with zstd (if the zstandard package
+    is installed) or gzip, whichever the client accepts first in that order.
+    """
+    body = orjson.dumps(payload)
+    headers = {"Vary": "Accept-Encoding"}
+    if len(body) >= MIN_COMPRESS_BYTES:
+        accepted = _accepted_encodings(accept_encoding)
+        if zstandard is not None and "zstd" in accepted:
+            body = zstandard.ZstdCompressor(level=3).compress(body)
+            headers["Content-Encoding"] = "zstd"
+        elif "gzip" in accepted:
+            body = gzip.compress(body, compresslevel=6)
+            headers["Content-Encoding"] = "gzip"
+    return Response(content=body, status_code=status_code, media_type="application/json", headers=headers)
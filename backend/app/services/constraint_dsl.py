@@ -0,0 +1,152 @@
+import math
+import re
+from typing import List, Optional, Tuple
+from app.models.schemas import TimetableRequest
+
+DSL_HELP = """One rule per line:
+  <target> not before period <N>
+  <target> not after period <N>
+  <target> not on <days> [<part>]
+  <target> not in <part>
+  <target> only on <days>
+  <target> only in <part>
+  no classes on <days> [<part>]
+<target>: lecturer <id> | subject <code> | division <name> | labs | all
+<days>: working day names separated by commas or "and"
+<part>: morning | afternoon | period <N> | periods <A>-<B>
+Morning is the first half of the day (periods 1..ceil(periods_per_day / 2)), afternoon the rest."""
+
+_TARGET = r"(?P<target>lecturer\s+\S+|subject\s+\S+|division\s+\S+|labs|all)"
+_PART = r"(?P<part>mornings?|afternoons?|periods?\s+\d+(?:\s*-\s*\d+)?)"
+_PATTERNS = [
+    ("before", re.compile(rf"^{_TARGET}\s+not\s+before\s+period\s+(?P<n>\d+)$")),
+    ("after", re.compile(rf"^{_TARGET}\s+not\s+after\s+period\s+(?P<n>\d+)$")),
+    ("not_on", re.compile(rf"^{_TARGET}\s+not\s+on\s+(?P<days>.+?)(?:\s+{_PART})?$")),
+    ("not_in", re.compile(rf"^{_TARGET}\s+not\s+(?:in\s+)?{_PART}$")),
+    ("only_on", re.compile(rf"^{_TARGET}\s+only\s+on\s+(?P<days>.+)$")),
+    ("only_in", re.compile(rf"^{_TARGET}\s+only\s+(?:in\s+)?{_PART}$")),
+    ("not_on", re.compile(rf"^no\s+classes\s+(?:on\s+)?(?P<days>.+?)(?:\s+{_PART})?$")),
+]
+
+
+class ConstraintSyntaxError(ValueError):
+    pass
+
+
+class CompiledRule:
+    """
+    One DSL rule resolved against a request: the slots it targets and the
+    (day, period) cells they may not use.
+    """
+
+    def __init__(self, text: str, target_kind: str, target_value: Optional[str], forbidden: set):
+        self.text = text
+        self.target_kind = target_kind
+        self.target_value = target_value
+        self.forbidden = forbidden
+
+    def targets(self, lecturer: str, subject: str, division: str, slot_type: str) -> bool:
+        if self.target_kind == "all":
+            return True
+        if self.target_kind == "labs":
+            return slot_type == "Lab"
+        if self.target_kind == "lecturer":
+            return lecturer == self.target_value
+        if self.target_kind == "subject":
+            return subject == self.target_value
+        return division == self.target_value
+
+
+def _resolve_target(target: str, request: TimetableRequest) -> Tuple[str, Optional[str]]:
+    parts = target.split(None, 1)
+    kind = parts[0]
+    if kind in ("labs", "all"):
+        return kind, None
+    value = parts[1]
+    if kind == "lecturer":
+        match = next((l.id for l in request.lecturers if value.lower() in (l.id.lower(), l.name.lower())), None)
+    elif kind == "subject":
+        match = next((s.code for d in request.divisions for s in d.subjects if value.lower() in (s.code.lower(), s.name.lower())), None)
+    else:
+        match = next((d.name for d in request.divisions if d.name.lower() == value.lower()), None)
+    if match is None:
+        raise ConstraintSyntaxError(f"Unknown {kind} '{value}'")
+    return kind, match
+
+
+def _resolve_days(text: str, working_days: List[str]) -> List[str]:
+    days = []
+    for token in re.split(r"\s*,\s*|\s+and\s+|\s+", text.strip()):
+        if not token:
+            continue
+        day = next((d for d in working_days if d.lower().startswith(token.lower()[:3]) and len(token) >= 3), None)
+        if day is None:
+            raise ConstraintSyntaxError(f"Unknown day '{token}'")
+        days.append(day)
+    return days
+
+
+def _resolve_part(text: Optional[str], periods_per_day: int) -> List[int]:
+    all_periods = list(range(1, periods_per_day + 1))
+    if not text:
+        return all_periods
+    half = math.ceil(periods_per_day / 2)
+    if text.startswith("morning"):
+        return all_periods[:half]
+    if text.startswith("afternoon"):
+        return all_periods[half:]
+    numbers = [int(n) for n in re.findall(r"\d+", text)]
+    start, end = numbers[0], numbers[-1]
+    if start < 1 or end > periods_per_day or start > end:
+        raise ConstraintSyntaxError(f"Invalid period range '{text}' (1-{periods_per_day})")
+    return list(range(start, end + 1))
+
+
+def parse_constraint(text: str, request: TimetableRequest) -> CompiledRule:
+    """Parses one DSL line (see DSL_HELP) into a CompiledRule, raising ConstraintSyntaxError."""
+    line = re.sub(r"\s+", " ", text.strip().rstrip(".")).lower()
+    working_days = request.metadata.working_days
+    periods_per_day = request.metadata.periods_per_day
+    all_cells = {(day, p) for day in working_days for p in range(1, periods_per_day + 1)}
+
+    for form, pattern in _PATTERNS:
+        match = pattern.match(line)
+        if not match:
+            continue
+        groups = match.groupdict()
+        kind, value = _resolve_target(groups.get("target") or "all", request)
+
+        if form == "before":
+            forbidden = {(d, p) for d, p in all_cells if p < int(groups["n"])}
+        elif form == "after":
+            forbidden = {(d, p) for d, p in all_cells if p > int(groups["n"])}
+        elif form == "not_on":
+            days = set(_resolve_days(groups["days"], working_days))
+            periods = set(_resolve_part(groups.get("part"), periods_per_day))
+            forbidden = {(d, p) for d, p in all_cells if d in days and p in periods}
+        elif form == "not_in":
+            periods = set(_resolve_part(groups["part"], periods_per_day))
+            forbidden = {(d, p) for d, p in all_cells if p in periods}
+        elif form == "only_on":
+            days = set(_resolve_days(groups["days"], working_days))
+            forbidden = {(d, p) for d, p in all_cells if d not in days}
+        else:
+            periods = set(_resolve_part(groups["part"], periods_per_day))
+            forbidden = {(d, p) for d, p in all_cells if p not in periods}
+        return CompiledRule(text.strip(), kind, value, forbidden)
+
+    raise ConstraintSyntaxError(f"Not a constraint rule: '{text.strip()}'")
+
+
+def compile_constraints(lines: Optional[List[str]], request: TimetableRequest) -> Tuple[List[CompiledRule], List[str]]:
+    """Splits constraint lines into compiled DSL rules and the free-text lines that did not parse."""
+    rules, unparsed = [], []
+    for line in lines or []:
+        for part in line.splitlines():
+            if not part.strip():
+                continue
+            try:
+                rules.append(parse_constraint(part, request))
+            except ConstraintSyntaxError:
+                unparsed.append(part.strip())
+    return rules, unparsed
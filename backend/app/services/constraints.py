@@ -0,0 +1,694 @@
+"""
+Hard scheduling rules shared by the CP-SAT solver, the repair heuristics and
+the validators. Each rule provides:
+- encode():      CP-SAT constraints over the solver's start variables
+- allows_start(): optional pruning of solver variables before they are created
+- allows_room(): the same pruning for a specific room
+- check():       O(1) incremental check of a block against a ScheduleState
+- finalize():    whole-state check for rules that cannot be decided per block
+- check_batch(): vectorized check over integer-coded slot columns
+HARD_CONSTRAINTS always apply; request_rules() adds the request's own
+constraints written in the DSL of app/services/constraint_dsl.py, and
+ExternalBookings adds lecturer/room time booked outside the request
+(its `blocked` calendar, or other departments in a batch run).
+"""
+from collections import Counter
+from typing import List, Optional
+import numpy as np
+from app.models.schemas import TimetableRequest
+from app.services.constraint_dsl import compile_constraints
+from app.services.problem import CompiledProblem
+
+_MISSING = object()
+
+
+def _group_ids(*columns) -> np.ndarray:
+    """Collapses parallel integer columns into one composite key per row."""
+    dims = []
+    shifted = []
+    for col in columns:
+        low = int(col.min())
+        shifted.append(col - low)
+        dims.append(int(col.max()) - low + 1)
+    return np.ravel_multi_index(shifted, dims)
+
+
+def _per_lecturer(columns, values: np.ndarray) -> np.ndarray:
+    """A CompiledProblem per-lecturer array over the columns' lecturer ids; unknown lecturers get no limit."""
+    padded = np.full(len(columns.lecturer_ids), np.iinfo(np.int64).max, dtype=np.int64)
+    padded[:len(values)] = values
+    return padded
+
+
+def _has_duplicates(keys: np.ndarray) -> bool:
+    if len(keys) < 2:
+        return False
+    return len(np.unique(keys)) != len(keys)
+
+
+class ScheduleState:
+    """
+    Indexed occupancy of already-placed slots, updated in O(1) per slot
+    (add() and remove()). Between begin() and commit()/rollback() every change
+    is journaled so a rejected candidate can be undone without rebuilding the indexes.
+    """
+
+    def __init__(self, request: TimetableRequest, slots: list = (), problem: CompiledProblem = None):
+        self.request = request
+        self.problem = problem or CompiledProblem(request)
+        self.lecturers_by_id = self.problem.lecturers_by_id
+        self.required_periods = {key: s.periods_per_week for key, s in self.problem.subjects.items()}
+
+        # Key: (Day, Period, Lecturer) / (Day, Period, Room) -> Division of the last slot placed there
+        self.lecturer_slots = {}
+        self.room_slots = {}
+        # Key: (Division, Day, Period) -> Subject
+        self.division_slots = {}
+        # Key: (Lecturer, Day) -> Periods taught
+        self.lecturer_day_load = {}
+        # Key: Lecturer -> Periods taught in the week
+        self.lecturer_week_load = {}
+        # Key: (Division, Day, Subject) -> Theory periods
+        self.theory_day_count = {}
+        # Key: (Division, Subject, Day, Period) -> Lab periods
+        self.lab_periods = {}
+
+        self._journal = None
+        for slot in slots:
+            self.add(slot)
+
+    def _set(self, table: dict, key, value) -> None:
+        if self._journal is not None:
+            self._journal.append((table, key, table.get(key, _MISSING)))
+        table[key] = value
+
+    def add(self, slot) -> None:
+        self._set(self.lecturer_slots, (slot.day, slot.period, slot.lecturer), slot.division)
+        self._set(self.room_slots, (slot.day, slot.period, slot.room), slot.division)
+        self._set(self.division_slots, (slot.division, slot.day, slot.period), slot.subject)
+        key = (slot.lecturer, slot.day)
+        self._set(self.lecturer_day_load, key, self.lecturer_day_load.get(key, 0) + 1)
+        self._set(self.lecturer_week_load, slot.lecturer, self.lecturer_week_load.get(slot.lecturer, 0) + 1)
+        if slot.type == 'Lab':
+            key = (slot.division, slot.subject, slot.day, slot.period)
+            self._set(self.lab_periods, key, self.lab_periods.get(key, 0) + 1)
+        else:
+            key = (slot.division, slot.day, slot.subject)
+            self._set(self.theory_day_count, key, self.theory_day_count.get(key, 0) + 1)
+
+    def remove(self, slot) -> None:
+        """
+        Inverse of add() for a slot placed earlier. The cell indexes keep one
+        occupant per cell, so the slot's cells are freed if it is their occupant.
+        """
+        for table, key, value in (
+            (self.lecturer_slots, (slot.day, slot.period, slot.lecturer), slot.division),
+            (self.room_slots, (slot.day, slot.period, slot.room), slot.division),
+            (self.division_slots, (slot.division, slot.day, slot.period), slot.subject),
+        ):
+            if table.get(key) == value:
+                self._delete(table, key)
+        self._decrement(self.lecturer_day_load, (slot.lecturer, slot.day))
+        self._decrement(self.lecturer_week_load, slot.lecturer)
+        if slot.type == 'Lab':
+            self._decrement(self.lab_periods, (slot.division, slot.subject, slot.day, slot.period))
+        else:
+            self._decrement(self.theory_day_count, (slot.division, slot.day, slot.subject))
+
+    def _delete(self, table: dict, key) -> None:
+        if self._journal is not None:
+            self._journal.append((table, key, table[key]))
+        del table[key]
+
+    def _decrement(self, table: dict, key) -> None:
+        count = table.get(key, 0)
+        if count > 1:
+            self._set(table, key, count - 1)
+        elif count == 1:
+            self._delete(table, key)
+
+    def begin(self) -> None:
+        """Starts journaling changes so they can be rolled back."""
+        self._journal = []
+
+    def commit(self) -> None:
+        self._journal = None
+
+    def rollback(self) -> None:
+        """Undoes every change since begin()."""
+        if self._journal is None:
+            return
+        for table, key, old_value in reversed(self._journal):
+            if old_value is _MISSING:
+                del table[key]
+            else:
+                table[key] = old_value
+        self._journal = None
+
+    def violations(self, block: list, rules: list = None) -> List[str]:
+        """Error messages from every rule the block would break if placed now."""
+        errors = []
+        for rule in (rules if rules is not None else HARD_CONSTRAINTS):
+            error = rule.check(self, block)
+            if error:
+                errors.append(error)
+        return errors
+
+    def allows(self, block: list, rules: list = None) -> bool:
+        for rule in (rules if rules is not None else HARD_CONSTRAINTS):
+            if rule.check(self, block):
+                return False
+        return True
+
+
+class SolverContext:
+    """
+    Shared state handed to rule encoders: the CP-SAT model, the blocks to
+    schedule and their start variables x[(block, day_idx, period, room)],
+    indexed by the (day_idx, period) cells each variable occupies.
+    """
+
+    def __init__(self, model, request: TimetableRequest, blocks: list, rules: list = None, problem: CompiledProblem = None):
+        self.model = model
+        self.rules = rules if rules is not None else HARD_CONSTRAINTS
+        self.request = request
+        self.problem = problem or CompiledProblem(request)
+        self.blocks = blocks
+        self.working_days = self.problem.working_days
+        self.periods_per_day = self.problem.periods_per_day
+        self.lecturers_by_id = self.problem.lecturers_by_id
+        self.x = {}
+        # Key: (Day idx, Period) -> list of (block, room_id, var) occupying that cell
+        self.occupancy = {}
+
+    def allows_start(self, block: dict, d_idx: int, p: int) -> bool:
+        for rule in self.rules:
+            if not rule.allows_start(self, block, d_idx, p):
+                return False
+        return True
+
+    def allows_room(self, block: dict, d_idx: int, p: int, room_id: str) -> bool:
+        for rule in self.rules:
+            if not rule.allows_room(self, block, d_idx, p, room_id):
+                return False
+        return True
+
+    def index_variables(self) -> None:
+        for (b_id, d_idx, p_start, r_id), var in self.x.items():
+            block = self.blocks[b_id]
+            for step in range(block["duration"]):
+                self.occupancy.setdefault((d_idx, p_start + step), []).append((block, r_id, var))
+
+    def add_at_most_one_per(self, key_fn) -> None:
+        """At most one occupying block per key (e.g. lecturer, room) in every cell."""
+        for entries in self.occupancy.values():
+            groups = {}
+            for block, room_id, var in entries:
+                groups.setdefault(key_fn(block, room_id), []).append(var)
+            for variables in groups.values():
+                if len(variables) > 1:
+                    self.model.AddAtMostOne(variables)
+
+    def add_daily_limit(self, key_fn, limit_fn) -> None:
+        """Caps the periods per (key, day) where key_fn returns a non-None key."""
+        groups = {}
+        for (b_id, d_idx, p_start, r_id), var in self.x.items():
+            block = self.blocks[b_id]
+            key = key_fn(block)
+            if key is None:
+                continue
+            groups.setdefault((key, d_idx), []).append(var * block["duration"])
+        for (key, d_idx), terms in groups.items():
+            limit = limit_fn(key)
+            if limit is not None:
+                self.model.Add(sum(terms) <= limit)
+
+
+class HardConstraint:
+    name = ""
+
+    def allows_start(self, ctx: SolverContext, block: dict, d_idx: int, p: int) -> bool:
+        return True
+
+    def allows_room(self, ctx: SolverContext, block: dict, d_idx: int, p: int, room_id: str) -> bool:
+        return True
+
+    def encode(self, ctx: SolverContext) -> None:
+        pass
+
+    def check(self, state: ScheduleState, block: list) -> Optional[str]:
+        return None
+
+    def finalize(self, state: ScheduleState, divisions=None) -> List[str]:
+        return []
+
+    def check_batch(self, columns, request: TimetableRequest) -> bool:
+        return False
+
+
+class LecturerClash(HardConstraint):
+    name = "lecturer_clash"
+
+    def encode(self, ctx):
+        ctx.add_at_most_one_per(lambda block, room_id: block["lecturer"])
+
+    def check(self, state, block):
+        for slot in block:
+            prev_division = state.lecturer_slots.get((slot.day, slot.period, slot.lecturer))
+            if prev_division is not None:
+                return f"Lecturer {slot.lecturer} double-booked on {slot.day} P{slot.period} (Div {slot.division} & Div {prev_division})"
+        return None
+
+    def check_batch(self, columns, request):
+        return _has_duplicates(_group_ids(columns.day, columns.period, columns.lecturer))
+
+
+class RoomClash(HardConstraint):
+    name = "room_clash"
+
+    def encode(self, ctx):
+        ctx.add_at_most_one_per(lambda block, room_id: room_id)
+
+    def check(self, state, block):
+        for slot in block:
+            prev_division = state.room_slots.get((slot.day, slot.period, slot.room))
+            if prev_division is not None:
+                return f"Room {slot.room} double-booked on {slot.day} P{slot.period} (Div {slot.division} & Div {prev_division})"
+        return None
+
+    def check_batch(self, columns, request):
+        return _has_duplicates(_group_ids(columns.day, columns.period, columns.room))
+
+
+class DivisionClash(HardConstraint):
+    name = "division_clash"
+
+    def encode(self, ctx):
+        ctx.add_at_most_one_per(lambda block, room_id: block["division"])
+
+    def check(self, state, block):
+        for slot in block:
+            prev_subject = state.division_slots.get((slot.division, slot.day, slot.period))
+            if prev_subject is not None:
+                return f"Div {slot.division} double-booked on {slot.day} P{slot.period} ({slot.subject} & {prev_subject})"
+        return None
+
+    def check_batch(self, columns, request):
+        return _has_duplicates(_group_ids(columns.division, columns.day, columns.period))
+
+
+class LecturerAvailability(HardConstraint):
+    name = "lecturer_availability"
+
+    def allows_start(self, ctx, block, d_idx, p):
+        return ctx.problem.is_available(block["lecturer"], d_idx)
+
+    def check(self, state, block):
+        day_ids = state.problem.day_ids
+        for slot in block:
+            d_idx = day_ids.get(slot.day)
+            if d_idx is not None:
+                available = state.problem.is_available(slot.lecturer, d_idx)
+            else:
+                lec = state.lecturers_by_id.get(slot.lecturer)
+                available = not lec or slot.day in lec.available_days
+            if not available:
+                return f"Lecturer {slot.lecturer} is not available on {slot.day} (Div {slot.division} {slot.subject})"
+        return None
+
+    def check_batch(self, columns, request):
+        # Known lecturers and working days index the availability mask directly;
+        # a known lecturer on any other day is left to check() to judge
+        mask = columns.problem.lecturer_available
+        known = columns.lecturer < mask.shape[0]
+        on_working_day = columns.day < columns.num_working_days
+        checked = known & on_working_day
+        unavailable = ~mask[columns.lecturer[checked], columns.day[checked]]
+        return bool(unavailable.any() or (known & ~on_working_day).any())
+
+
+class LecturerDailyLoad(HardConstraint):
+    name = "lecturer_daily_load"
+
+    def encode(self, ctx):
+        ctx.add_daily_limit(
+            lambda block: block["lecturer"] if block["lecturer"] in ctx.lecturers_by_id else None,
+            lambda lec_id: ctx.lecturers_by_id[lec_id].max_periods_per_day
+        )
+
+    def check(self, state, block):
+        added = {}
+        for slot in block:
+            lec = state.lecturers_by_id.get(slot.lecturer)
+            if not lec:
+                continue
+            key = (slot.lecturer, slot.day)
+            added[key] = added.get(key, 0) + 1
+            if state.lecturer_day_load.get(key, 0) + added[key] > lec.max_periods_per_day:
+                return f"Lecturer {slot.lecturer} exceeds {lec.max_periods_per_day} periods on {slot.day}"
+        return None
+
+    def check_batch(self, columns, request):
+        num_days = len(columns.day_ids)
+        num_lecturers = len(columns.lecturer_ids)
+        max_per_day = _per_lecturer(columns, columns.problem.max_periods_per_day)
+        counts = np.bincount(columns.lecturer * num_days + columns.day, minlength=num_lecturers * num_days)
+        return bool((counts.reshape(num_lecturers, num_days) > max_per_day[:, None]).any())
+
+
+class LecturerWeeklyLoad(HardConstraint):
+    name = "lecturer_weekly_load"
+
+    def encode(self, ctx):
+        groups = {}
+        for (b_id, d_idx, p_start, r_id), var in ctx.x.items():
+            block = ctx.blocks[b_id]
+            if block["lecturer"] in ctx.lecturers_by_id:
+                groups.setdefault(block["lecturer"], []).append(var * block["duration"])
+        for lec_id, terms in groups.items():
+            ctx.model.Add(sum(terms) <= ctx.lecturers_by_id[lec_id].max_periods_per_week)
+
+    def check(self, state, block):
+        added = {}
+        for slot in block:
+            lec = state.lecturers_by_id.get(slot.lecturer)
+            if not lec:
+                continue
+            added[slot.lecturer] = added.get(slot.lecturer, 0) + 1
+            if state.lecturer_week_load.get(slot.lecturer, 0) + added[slot.lecturer] > lec.max_periods_per_week:
+                return f"Lecturer {slot.lecturer} exceeds {lec.max_periods_per_week} periods per week"
+        return None
+
+    def check_batch(self, columns, request):
+        num_lecturers = len(columns.lecturer_ids)
+        max_per_week = _per_lecturer(columns, columns.problem.max_periods_per_week)
+        return bool((np.bincount(columns.lecturer, minlength=num_lecturers) > max_per_week).any())
+
+
+class TheoryDailyLimit(HardConstraint):
+    """Max 2 periods per day of any Theory subject per division."""
+    name = "theory_daily_limit"
+    limit = 2
+
+    def encode(self, ctx):
+        ctx.add_daily_limit(
+            lambda block: (block["division"], block["subject"]) if block["type"] != "Lab" else None,
+            lambda key: self.limit
+        )
+
+    def check(self, state, block):
+        added = {}
+        for slot in block:
+            if slot.type == 'Lab':
+                continue
+            key = (slot.division, slot.day, slot.subject)
+            added[key] = added.get(key, 0) + 1
+            if state.theory_day_count.get(key, 0) + added[key] > self.limit:
+                return f"Div {slot.division}: Subject {slot.subject} exceeds {self.limit} periods on {slot.day}"
+        return None
+
+    def check_batch(self, columns, request):
+        theory = columns.is_theory
+        if not theory.any():
+            return False
+        day_keys = _group_ids(columns.division[theory], columns.day[theory], columns.subject[theory])
+        return bool((np.bincount(day_keys - day_keys.min()) > self.limit).any())
+
+
+class LabContiguity(HardConstraint):
+    """
+    Lab periods must come in consecutive pairs on the same day; a subject with
+    an odd periods_per_week may keep one single period.
+    """
+    name = "lab_contiguity"
+
+    def encode(self, ctx):
+        # The solver builds labs as 2-period blocks, so pairs are contiguous by construction.
+        pass
+
+    def check(self, state, block):
+        labs = [slot for slot in block if slot.type == 'Lab']
+        if len(labs) < 2:
+            # A single period can only be judged once the whole division is placed (see finalize)
+            return None
+        first = labs[0]
+        periods = sorted(slot.period for slot in labs)
+        if any(slot.day != first.day for slot in labs) or periods != list(range(periods[0], periods[0] + len(periods))):
+            return f"Div {first.division}: Lab {first.subject} periods must be consecutive on the same day"
+        return None
+
+    def finalize(self, state, divisions=None):
+        isolated = {}
+        for (division, subject, day, period), count in state.lab_periods.items():
+            if divisions is not None and division not in divisions:
+                continue
+            if (division, subject, day, period - 1) in state.lab_periods or (division, subject, day, period + 1) in state.lab_periods:
+                continue
+            isolated[(division, subject)] = isolated.get((division, subject), 0) + count
+
+        errors = []
+        for (division, subject), count in isolated.items():
+            if count > state.required_periods.get((division, subject), 0) % 2:
+                errors.append(f"Div {division}: Lab {subject} has {count} isolated single period(s); labs must be scheduled as consecutive pairs")
+        return errors
+
+    def check_batch(self, columns, request):
+        lab = ~columns.is_theory
+        if not lab.any():
+            return False
+        division, subject, day, period = columns.division[lab], columns.subject[lab], columns.day[lab], columns.period[lab]
+
+        # Period is the innermost dimension, padded so that +-1 never wraps into another group
+        group = _group_ids(division, subject, day)
+        span = int(period.max()) - int(period.min()) + 3
+        codes = group * span + (period - int(period.min()) + 1)
+        isolated = ~np.isin(codes - 1, codes) & ~np.isin(codes + 1, codes)
+        if not isolated.any():
+            return False
+
+        subjects = columns.problem.subjects
+        division_names = list(columns.division_ids)
+        subject_names = list(columns.subject_ids)
+        pair_keys = _group_ids(division, subject)
+        _, first_rows, inverse = np.unique(pair_keys, return_index=True, return_inverse=True)
+        isolated_counts = np.bincount(inverse[isolated], minlength=len(first_rows))
+        for pair_idx, row in enumerate(first_rows):
+            sub = subjects.get((division_names[division[row]], subject_names[subject[row]]))
+            allowed = sub.periods_per_week % 2 if sub else 0
+            if isolated_counts[pair_idx] > allowed:
+                return True
+        return False
+
+
+HARD_CONSTRAINTS = [
+    LecturerClash(),
+    RoomClash(),
+    DivisionClash(),
+    LecturerAvailability(),
+    LecturerDailyLoad(),
+    LecturerWeeklyLoad(),
+    TheoryDailyLimit(),
+    LabContiguity(),
+]
+
+
+class UserConstraints(HardConstraint):
+    """
+    The request's DSL constraints (TimetableRequest.constraints). Each compiled
+    rule forbids a set of (day, period) cells to the slots it targets, so the
+    solver never creates those variables and the checkers reject such slots.
+    """
+    name = "user_constraints"
+
+    def __init__(self, rules: list):
+        self.rules = rules
+
+    def allows_start(self, ctx, block, d_idx, p):
+        day = ctx.working_days[d_idx]
+        for rule in self.rules:
+            if rule.targets(block["lecturer"], block["subject"], block["division"], block["type"]):
+                if any((day, p + step) in rule.forbidden for step in range(block["duration"])):
+                    return False
+        return True
+
+    def check(self, state, block):
+        for slot in block:
+            for rule in self.rules:
+                if (slot.day, slot.period) in rule.forbidden and rule.targets(slot.lecturer, slot.subject, slot.division, slot.type):
+                    return f"Div {slot.division}: {slot.subject} on {slot.day} P{slot.period} breaks constraint '{rule.text}'"
+        return None
+
+    def check_batch(self, columns, request):
+        max_period = request.metadata.periods_per_day
+        period = np.clip(columns.period, 0, max_period + 1)
+        lecturer_names, subject_names = list(columns.lecturer_ids), list(columns.subject_ids)
+        division_names, day_names = list(columns.division_ids), list(columns.day_ids)
+        for rule in self.rules:
+            cells = np.zeros((len(day_names), max_period + 2), dtype=bool)
+            for day, p in rule.forbidden:
+                if day in columns.day_ids:
+                    cells[columns.day_ids[day], p] = True
+            if rule.target_kind == "all":
+                targeted = np.ones(len(columns.slots), dtype=bool)
+            elif rule.target_kind == "labs":
+                targeted = ~columns.is_theory
+            else:
+                names, ids = {
+                    "lecturer": (lecturer_names, columns.lecturer),
+                    "subject": (subject_names, columns.subject),
+                    "division": (division_names, columns.division),
+                }[rule.target_kind]
+                targeted = np.array([name == rule.target_value for name in names], dtype=bool)[ids] if names else np.zeros(len(ids), dtype=bool)
+            if (targeted & cells[columns.day, period]).any():
+                return True
+        return False
+
+
+class ExternalBookings(HardConstraint):
+    """
+    Lecturer and room time already booked outside this request: the request's
+    `blocked` calendar and, in a batch run, slots of earlier departments.
+    Those cells are never offered to the solver, and the booked periods count
+    towards the lecturer's daily and weekly load.
+    """
+    name = "external_bookings"
+
+    def __init__(self, lecturer_cells: set, room_cells: set):
+        self.lecturer_cells = lecturer_cells
+        self.room_cells = room_cells
+        self.lecturer_day_load = Counter((lec_id, day) for lec_id, day, _ in lecturer_cells)
+        self.lecturer_week_load = Counter(lec_id for lec_id, _, _ in lecturer_cells)
+
+    @classmethod
+    def from_request(cls, request: TimetableRequest, booked_slots: list = None) -> "ExternalBookings":
+        """Cells from request.blocked plus slots booked by other requests (e.g. earlier in a batch)."""
+        booked_slots = booked_slots or []
+        blocked = request.blocked or []
+        lecturer_cells = {(s.lecturer, s.day, s.period) for s in booked_slots}
+        lecturer_cells.update((b.lecturer, b.day, b.period) for b in blocked if b.lecturer)
+        room_cells = {(s.room, s.day, s.period) for s in booked_slots}
+        room_cells.update((b.room, b.day, b.period) for b in blocked if b.room)
+        return cls(lecturer_cells, room_cells)
+
+    def allows_start(self, ctx, block, d_idx, p):
+        day = ctx.working_days[d_idx]
+        return not any((block["lecturer"], day, p + step) in self.lecturer_cells for step in range(block["duration"]))
+
+    def allows_room(self, ctx, block, d_idx, p, room_id):
+        day = ctx.working_days[d_idx]
+        return not any((room_id, day, p + step) in self.room_cells for step in range(block["duration"]))
+
+    def encode(self, ctx):
+        groups = {}
+        for (b_id, d_idx, p_start, r_id), var in ctx.x.items():
+            block = ctx.blocks[b_id]
+            booked = self.lecturer_day_load.get((block["lecturer"], ctx.working_days[d_idx]), 0)
+            if booked and block["lecturer"] in ctx.lecturers_by_id:
+                groups.setdefault((block["lecturer"], d_idx, booked), []).append(var * block["duration"])
+        for (lec_id, d_idx, booked), terms in groups.items():
+            ctx.model.Add(sum(terms) <= max(0, ctx.lecturers_by_id[lec_id].max_periods_per_day - booked))
+        weekly = {}
+        for (b_id, d_idx, p_start, r_id), var in ctx.x.items():
+            block = ctx.blocks[b_id]
+            if self.lecturer_week_load.get(block["lecturer"]) and block["lecturer"] in ctx.lecturers_by_id:
+                weekly.setdefault(block["lecturer"], []).append(var * block["duration"])
+        for lec_id, terms in weekly.items():
+            ctx.model.Add(sum(terms) <= max(0, ctx.lecturers_by_id[lec_id].max_periods_per_week - self.lecturer_week_load[lec_id]))
+
+    def check(self, state, block):
+        day_added = {}
+        week_added = {}
+        for slot in block:
+            if (slot.lecturer, slot.day, slot.period) in self.lecturer_cells:
+                return f"Lecturer {slot.lecturer} is already booked elsewhere on {slot.day} Period {slot.period}"
+            if (slot.room, slot.day, slot.period) in self.room_cells:
+                return f"Room {slot.room} is already booked elsewhere on {slot.day} Period {slot.period}"
+            # Booked periods count towards the lecturer's caps, as in encode()
+            lec = state.lecturers_by_id.get(slot.lecturer)
+            if not lec:
+                continue
+            key = (slot.lecturer, slot.day)
+            day_added[key] = day_added.get(key, 0) + 1
+            booked = self.lecturer_day_load.get(key, 0)
+            if booked and state.lecturer_day_load.get(key, 0) + day_added[key] + booked > lec.max_periods_per_day:
+                return f"Lecturer {slot.lecturer} exceeds {lec.max_periods_per_day} periods on {slot.day} ({booked} booked elsewhere)"
+            week_added[slot.lecturer] = week_added.get(slot.lecturer, 0) + 1
+            booked = self.lecturer_week_load.get(slot.lecturer, 0)
+            if booked and state.lecturer_week_load.get(slot.lecturer, 0) + week_added[slot.lecturer] + booked > lec.max_periods_per_week:
+                return f"Lecturer {slot.lecturer} exceeds {lec.max_periods_per_week} periods per week ({booked} booked elsewhere)"
+        return None
+
+    def check_batch(self, columns, request):
+        stride = request.metadata.periods_per_day + 2
+        period = np.clip(columns.period, 0, stride - 1)
+        for cells, ids, codes in (
+            (self.lecturer_cells, columns.lecturer_ids, columns.lecturer),
+            (self.room_cells, columns.room_ids, columns.room),
+        ):
+            keys = [
+                (ids[name] * columns.num_working_days + columns.day_ids[day]) * stride + p
+                for name, day, p in cells
+                if name in ids and day in columns.day_ids and 0 <= p < stride
+            ]
+            if keys and np.isin((codes * columns.num_working_days + columns.day) * stride + period, keys).any():
+                return True
+
+        # Daily and weekly loads including the booked periods
+        num_days = len(columns.day_ids)
+        num_lecturers = len(columns.lecturer_ids)
+        booked_day = np.zeros((num_lecturers, num_days), dtype=np.int64)
+        for (lec_id, day), count in self.lecturer_day_load.items():
+            if lec_id in columns.lecturer_ids and day in columns.day_ids:
+                booked_day[columns.lecturer_ids[lec_id], columns.day_ids[day]] = count
+        booked_week = np.zeros(num_lecturers, dtype=np.int64)
+        for lec_id, count in self.lecturer_week_load.items():
+            if lec_id in columns.lecturer_ids:
+                booked_week[columns.lecturer_ids[lec_id]] = count
+        if not booked_week.any():
+            return False
+        # Only cells / lecturers this timetable uses can be pushed over their caps by it
+        day_counts = np.bincount(columns.lecturer * num_days + columns.day, minlength=num_lecturers * num_days).reshape(num_lecturers, num_days)
+        week_counts = day_counts.sum(axis=1)
+        max_per_day = _per_lecturer(columns, columns.problem.max_periods_per_day)
+        max_per_week = _per_lecturer(columns, columns.problem.max_periods_per_week)
+        over_day = (day_counts + booked_day > max_per_day[:, None]) & (day_counts > 0)
+        over_week = (week_counts + booked_week > max_per_week) & (week_counts > 0)
+        return bool(over_day.any() or over_week.any())
+
+
+def request_rules(request: TimetableRequest, booked_slots: list = None) -> list:
+    """
+    HARD_CONSTRAINTS plus the request's compiled DSL constraints (free-text
+    lines are left to the LLM) and its blocked calendar / externally booked slots.
+    """
+    rules = list(HARD_CONSTRAINTS)
+    user_rules, _ = compile_constraints(request.constraints, request)
+    if user_rules:
+        rules.append(UserConstraints(user_rules))
+    if request.blocked or booked_slots:
+        rules.append(ExternalBookings.from_request(request, booked_slots))
+    return rules
+
+
+def replay_constraint_errors(slots: list, request: TimetableRequest, rules: list = None, problem: CompiledProblem = None) -> List[str]:
+    """
+    Validates slots by placing them one by one into a ScheduleState with the
+    incremental checkers, then running whole-state checks. Errors are grouped
+    per rule, in registry order.
+    """
+    rules = rules if rules is not None else HARD_CONSTRAINTS
+    state = ScheduleState(request, problem=problem)
+    errors_by_rule = [[] for _ in rules]
+    for slot in slots:
+        block = [slot]
+        for idx, rule in enumerate(rules):
+            error = rule.check(state, block)
+            if error:
+                errors_by_rule[idx].append(error)
+        state.add(slot)
+
+    errors = []
+    for idx, rule in enumerate(rules):
+        errors.extend(errors_by_rule[idx])
+        errors.extend(rule.finalize(state))
+    return errors
@@ -0,0 +1,94 @@
+import threading
+import time
+from typing import Callable, Optional
+from app.core.config import settings
+
+# Remaining time budget the caller (the Node proxy) grants this request, in milliseconds
+DEADLINE_HEADER = "X-Request-Timeout-Ms"
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Deadline:
+    """
+    End-to-end deadline of one request, on the monotonic clock, plus
+    cancellation when the client goes away. Work that cannot be interrupted
+    through asyncio (e.g. a CP-SAT search in a worker thread) registers a stop
+    callback with on_cancel().
+    """
+
+    def __init__(self, timeout_seconds: Optional[float] = None):
+        self.expires_at = time.monotonic() + timeout_seconds if timeout_seconds is not None else None
+        self.cancelled = False
+        self.reason = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left (never negative), or None without a deadline."""
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
+
+    def clamp(self, seconds: Optional[float]) -> Optional[float]:
+        """The smaller of a stage budget and the time left (either may be None)."""
+        remaining = self.remaining()
+        if seconds is None:
+            return remaining
+        if remaining is None:
+            return seconds
+        return min(seconds, remaining)
+
+    def on_cancel(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """Registers a stop callback (run at once if already cancelled); returns an unregister function."""
+        with self._lock:
+            if not self.cancelled:
+                self._callbacks.append(callback)
+                return lambda: self._unregister(callback)
+        callback()
+        return lambda: None
+
+    def _unregister(self, callback) -> None:
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def cancel(self, reason: str = "cancelled") -> None:
+        with self._lock:
+            if self.cancelled:
+                return
+            self.cancelled = True
+            self.reason = reason
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Deadline stop callback failed: {e}")
+
+    def check(self) -> None:
+        """Raises DeadlineExceeded once cancelled (client disconnect)."""
+        if self.cancelled:
+            raise DeadlineExceeded(self.reason)
+
+
+def deadline_from_header(value: Optional[str]) -> Deadline:
+    """
+    Deadline from the caller's remaining budget header, minus
+    REQUEST_DEADLINE_MARGIN_SECONDS so the response gets back in time.
+    A missing or malformed header means no deadline beyond the stage budgets.
+    """
+    try:
+        timeout_ms = float(value) if value else None
+    except ValueError:
+        print(f"Ignoring malformed {DEADLINE_HEADER} header: {value!r}")
+        timeout_ms = None
+    if timeout_ms is None:
+        return Deadline()
+    return Deadline(max(0.0, timeout_ms / 1000.0 - settings.REQUEST_DEADLINE_MARGIN_SECONDS))
@@ -0,0 +1,136 @@
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+from app.services.llm_cache import llm_cache
+from app.services.llm_service import generate_conflict_explanation
+
+# (substring of a solver diagnostic, suggested action) in the order they are listed
+CONFLICT_SUGGESTIONS = [
+    ("Under-capacity", "Add more classrooms or reduce the weekly periods of some subjects."),
+    ("is over-assigned", "Raise the lecturer's max periods per week or reassign some of their subjects to other staff."),
+    ("absolute maximum weekly slots", "Split the lecturer's subjects across more staff; one person cannot teach more periods than the week has."),
+    ("Missing Lab rooms", "Add at least one laboratory (room type 'Lab') or mark the lab subjects as Theory."),
+    ("is over-constrained", "Reduce the division's subject periods or add working days / periods per day."),
+    ("Resource bottleneck", "Spread subjects across more lecturers, add rooms, or relax lecturer availability."),
+]
+
+# A pending entry older than this lost its background thread (worker restart) and is retried
+PENDING_TIMEOUT_SECONDS = 300.0
+
+_executor = None
+_executor_lock = threading.Lock()
+# Explanations live in the llm_cache SQLite table so every worker (and a restarted
+# one) can serve them; the lock makes this process's read-modify-writes atomic
+_store_lock = threading.Lock()
+
+
+def normalize_conflicts(conflicts: List[str]) -> List[str]:
+    return sorted({clash.strip() for clash in conflicts if clash and clash.strip()})
+
+
+def conflict_set_id(conflicts: List[str]) -> str:
+    """Deterministic id of a conflict set: the same clashes always map to the same explanation."""
+    payload = "\n".join(normalize_conflicts(conflicts))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:24]
+
+
+def template_explanation(conflicts: List[str]) -> str:
+    """Deterministic explanation built from the solver diagnostics, returned without waiting on the LLM."""
+    clashes = normalize_conflicts(conflicts)
+    message = "Timetable generation is mathematically impossible due to the following clashes:\n"
+    for clash in clashes:
+        message += f"- {clash}\n"
+
+    suggestions = [suggestion for marker, suggestion in CONFLICT_SUGGESTIONS if any(marker in clash for clash in clashes)]
+    if suggestions:
+        message += "\nSuggested actions:\n"
+        for suggestion in suggestions:
+            message += f"- {suggestion}\n"
+    else:
+        message += "\nPlease adjust your staff workloads or classroom resources to resolve these clashes."
+    return message.strip()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="explain")
+        return _executor
+
+
+def _store_key(explanation_id: str) -> str:
+    return f"explanation:{explanation_id}"
+
+
+def _load(explanation_id: str) -> Optional[dict]:
+    return llm_cache.get(_store_key(explanation_id), record_stats=False)
+
+
+def _save(entry: dict) -> None:
+    llm_cache.set(_store_key(entry["explanation_id"]), entry)
+
+
+def _new_entry(explanation_id: str, clashes: List[str]) -> dict:
+    return {
+        "explanation_id": explanation_id,
+        "status": "pending",
+        "conflicts": clashes,
+        "explanation": template_explanation(clashes),
+        "source": "template",
+        "requested_at": time.time(),
+    }
+
+
+def _run_llm_explanation(explanation_id: str, conflicts: List[str]) -> None:
+    try:
+        explanation = generate_conflict_explanation(conflicts)
+    except Exception as e:
+        print(f"Background conflict explanation crashed: {e}")
+        explanation = None
+    with _store_lock:
+        entry = _load(explanation_id) or _new_entry(explanation_id, conflicts)
+        if explanation:
+            entry["status"] = "ready"
+            entry["explanation"] = explanation
+            entry["source"] = "llm"
+        else:
+            entry["status"] = "failed"
+        _save(entry)
+
+
+def request_conflict_explanation(conflicts: List[str]) -> dict:
+    """
+    Registers an infeasibility report and returns it immediately with the
+    template explanation. The LLM explanation is produced on a background
+    thread (at most once per conflict set) and fetched later via
+    get_conflict_explanation. A failed attempt is retried on the next request,
+    as is one left pending longer than PENDING_TIMEOUT_SECONDS.
+    Entries are kept in the llm_cache table (same TTL and LRU limit).
+    Does SQLite I/O: call it off the event loop.
+    """
+    clashes = normalize_conflicts(conflicts)
+    explanation_id = conflict_set_id(clashes)
+    with _store_lock:
+        entry = _load(explanation_id)
+        if entry is None:
+            entry = _new_entry(explanation_id, clashes)
+            schedule = True
+        else:
+            stale = entry["status"] == "pending" and time.time() - entry.get("requested_at", 0) > PENDING_TIMEOUT_SECONDS
+            schedule = entry["status"] == "failed" or stale
+            if schedule:
+                entry["status"] = "pending"
+                entry["requested_at"] = time.time()
+        # Saved on a hit too, so the conflict set counts as recently used
+        _save(entry)
+
+    if schedule:
+        _get_executor().submit(_run_llm_explanation, explanation_id, clashes)
+    return entry
+
+
+def get_conflict_explanation(explanation_id: str) -> Optional[dict]:
+    return _load(explanation_id)
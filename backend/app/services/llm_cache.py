@@ -0,0 +1,124 @@
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Optional
+from app.core.config import settings
+
+
+def normalize_prompt_text(text: str) -> str:
+    """Collapses whitespace runs and trims every line so cosmetic prompt changes hash the same."""
+    lines = [re.sub(r"[ \t]+", " ", line).strip() for line in text.strip().splitlines()]
+    return "\n".join(line for line in lines if line)
+
+
+def make_cache_key(messages: list, **params) -> str:
+    """
+    Model-independent key: sha256 over the normalized messages and the sampling
+    parameters. The model id is deliberately left out so a reply from any model
+    in HF_MODELS answers the same prompt.
+    """
+    normalized = {
+        "messages": [{"role": m["role"], "content": normalize_prompt_text(m["content"])} for m in messages],
+        "params": params,
+    }
+    payload = json.dumps(normalized, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """
+    Disk-backed (SQLite) cache of parsed LLM replies with TTL expiry and LRU
+    eviction once more than max_entries are stored. Values are stored as JSON.
+    Hit / miss counters are per process.
+    """
+
+    def __init__(self, path: str, ttl_seconds: float, max_entries: int):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL, last_access REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_last_access ON llm_cache (last_access)")
+            self._conn.commit()
+        return self._conn
+
+    def get(self, key: str, record_stats: bool = True) -> Optional[Any]:
+        """Cached value or None. record_stats=False keeps lookups that are not LLM calls out of the hit rate."""
+        now = time.time()
+        with self._lock:
+            try:
+                conn = self._connection()
+                row = conn.execute("SELECT value, created_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+                if row is not None and now - row[1] > self.ttl_seconds:
+                    conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                    conn.commit()
+                    row = None
+                if row is None:
+                    self.misses += record_stats
+                    return None
+                conn.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (now, key))
+                conn.commit()
+                self.hits += record_stats
+                return json.loads(row[0])
+            except sqlite3.Error as e:
+                print(f"LLM cache read failed: {e}")
+                self.misses += record_stats
+                return None
+
+    def set(self, key: str, value: Any) -> None:
+        now = time.time()
+        with self._lock:
+            try:
+                conn = self._connection()
+                conn.execute(
+                    "INSERT OR REPLACE INTO llm_cache (key, value, created_at, last_access) VALUES (?, ?, ?, ?)",
+                    (key, json.dumps(value), now, now)
+                )
+                # Drop expired entries, then the least recently used beyond max_entries
+                conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl_seconds,))
+                conn.execute(
+                    "DELETE FROM llm_cache WHERE key IN ("
+                    "SELECT key FROM llm_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,)
+                )
+                conn.commit()
+            except sqlite3.Error as e:
+                print(f"LLM cache write failed: {e}")
+
+    def clear(self) -> None:
+        with self._lock:
+            conn = self._connection()
+            conn.execute("DELETE FROM llm_cache")
+            conn.commit()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            try:
+                entries = self._connection().execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+            except sqlite3.Error:
+                entries = None
+            lookups = self.hits + self.misses
+            return {
+                "entries": entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+
+llm_cache = LLMResponseCache(settings.LLM_CACHE_PATH, settings.LLM_CACHE_TTL_SECONDS, settings.LLM_CACHE_MAX_ENTRIES)
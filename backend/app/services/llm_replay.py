@@ -0,0 +1,189 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from types import SimpleNamespace
+from app.services.llm_cache import make_cache_key
+
+
+def _message_response(text: str):
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(role="assistant", content=text))])
+
+
+def _stream_chunk(text: str):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(role="assistant", content=text))])
+
+
+class Cassette:
+    """
+    JSONL file of recorded chat completions, one line per call:
+    {key, model, text | error (+ status), latency, truncated?}. The key is the
+    model-independent prompt hash from llm_cache plus whether the call streamed
+    and asked for structured output. A stream the reader closed early (aborted,
+    a lost hedge, a timeout) is marked `truncated`: it is only replayed for the
+    model it was recorded from, and a complete reply replaces it. Complete
+    replies also answer the same prompt for models without a recording.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    if line.strip():
+                        self._index(json.loads(line))
+
+    def _index(self, entry: dict) -> None:
+        own = (entry["key"], entry["model"])
+        current = self._entries.get(own)
+        if current is None or (current.get("truncated") and not entry.get("truncated")):
+            self._entries[own] = entry
+        if "text" in entry and not entry.get("truncated"):
+            self._entries.setdefault((entry["key"], None), entry)
+
+    def lookup(self, key: str, model: str):
+        return self._entries.get((key, model)) or self._entries.get((key, None))
+
+    def append(self, entry: dict) -> None:
+        with self._lock:
+            self._index(entry)
+            with open(self.path, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+
+
+class ReplayedError(RuntimeError):
+    """A recorded error, re-raised with its HTTP status (as `response.status_code`) when there was one."""
+
+    def __init__(self, message: str, status: int = None):
+        super().__init__(message)
+        self.response = SimpleNamespace(status_code=status) if status is not None else None
+
+
+def _call_key(messages: list, stream: bool, params: dict) -> str:
+    # Only whether a schema was sent matters: a backend may reject response_format
+    params = dict(params)
+    structured = params.pop("response_format", None) is not None
+    return make_cache_key(messages, stream=stream, structured=structured, **params)
+
+
+class _ReplayBase:
+    def __init__(self, client, cassette: Cassette, mode: str, replay_latency: bool):
+        self.client = client
+        self.cassette = cassette
+        self.mode = mode
+        self.replay_latency = replay_latency
+
+    def _replayed(self, messages, model, stream, params) -> dict:
+        entry = self.cassette.lookup(_call_key(messages, stream, params), model)
+        if entry is None:
+            raise RuntimeError(f"No recorded LLM response for this prompt ({model}); record it first with LLM_RECORD_REPLAY=record")
+        return entry
+
+    def _record(self, messages, model, stream, params, started, text=None, error=None, truncated=False) -> None:
+        entry = {"key": _call_key(messages, stream, params), "model": model, "latency": round(time.monotonic() - started, 4)}
+        if error is not None:
+            entry["error"] = str(error)
+            status = getattr(getattr(error, "response", None), "status_code", None)
+            if isinstance(status, int):
+                entry["status"] = status
+        else:
+            entry["text"] = text
+        if truncated:
+            entry["truncated"] = True
+        self.cassette.append(entry)
+
+
+class RecordReplayClient(_ReplayBase):
+    """
+    Wraps the sync InferenceClient. `record` forwards calls and appends each
+    reply (or error) to the cassette; `replay` serves them from it offline,
+    re-raising recorded errors such as 402s.
+    """
+
+    def chat_completion(self, messages, model=None, stream=False, **params):
+        if self.mode == "replay":
+            entry = self._replayed(messages, model, stream, params)
+            if self.replay_latency:
+                time.sleep(entry.get("latency", 0.0))
+            if "error" in entry:
+                raise ReplayedError(entry["error"], entry.get("status"))
+            return iter([_stream_chunk(entry["text"])]) if stream else _message_response(entry["text"])
+
+        started = time.monotonic()
+        try:
+            response = self.client.chat_completion(messages=messages, model=model, stream=stream, **params)
+        except Exception as e:
+            self._record(messages, model, stream, params, started, error=e)
+            raise
+        if stream:
+            return self._record_stream(response, messages, model, params, started)
+        self._record(messages, model, stream, params, started, text=response.choices[0].message.content)
+        return response
+
+    def _record_stream(self, response, messages, model, params, started):
+        parts = []
+        try:
+            for chunk in response:
+                if chunk.choices:
+                    parts.append(chunk.choices[0].delta.content or "")
+                yield chunk
+        except Exception as e:
+            self._record(messages, model, True, params, started, error=e)
+            raise
+        except BaseException:
+            # Closed by the reader before the end
+            self._record(messages, model, True, params, started, text="".join(parts), truncated=True)
+            raise
+        self._record(messages, model, True, params, started, text="".join(parts))
+
+
+class AsyncRecordReplayClient(_ReplayBase):
+    """Async counterpart of RecordReplayClient for AsyncInferenceClient (streams are async generators)."""
+
+    async def chat_completion(self, messages, model=None, stream=False, **params):
+        if self.mode == "replay":
+            entry = self._replayed(messages, model, stream, params)
+            if self.replay_latency:
+                await asyncio.sleep(entry.get("latency", 0.0))
+            if "error" in entry:
+                raise ReplayedError(entry["error"], entry.get("status"))
+            if not stream:
+                return _message_response(entry["text"])
+
+            async def replay_stream():
+                yield _stream_chunk(entry["text"])
+            return replay_stream()
+
+        started = time.monotonic()
+        try:
+            response = await self.client.chat_completion(messages=messages, model=model, stream=stream, **params)
+        except Exception as e:
+            self._record(messages, model, stream, params, started, error=e)
+            raise
+        if stream:
+            return self._record_stream(response, messages, model, params, started)
+        self._record(messages, model, stream, params, started, text=response.choices[0].message.content)
+        return response
+
+    async def _record_stream(self, response, messages, model, params, started):
+        parts = []
+        try:
+            async for chunk in response:
+                if chunk.choices:
+                    parts.append(chunk.choices[0].delta.content or "")
+                yield chunk
+        except Exception as e:
+            self._record(messages, model, True, params, started, error=e)
+            raise
+        except BaseException:
+            # Closed by the reader before the end (aborted, lost hedge, cancelled)
+            self._record(messages, model, True, params, started, text="".join(parts), truncated=True)
+            raise
+        else:
+            self._record(messages, model, True, params, started, text="".join(parts))
+        finally:
+            if hasattr(response, "aclose"):
+                await response.aclose()
@@ -1,11 +1,25 @@
 import os
 import json
-from huggingface_hub import InferenceClient
+import asyncio
+import time
+from typing import Optional
+from huggingface_hub import InferenceClient, AsyncInferenceClient
+from fastapi.concurrency import run_in_threadpool
 from app.core.config import settings
+from app.services.model_health import model_health
+from app.services.llm_cache import llm_cache, make_cache_key
+from app.services.slot_stream import SlotStreamParser
+from app.services.slot_schema import json_schema_response_format
+from app.services.llm_replay import Cassette, RecordReplayClient, AsyncRecordReplayClient
+from app.services.constraint_dsl import DSL_HELP, parse_constraint, ConstraintSyntaxError
 
 # Initialize HuggingFace client
 try:
-    hf_client = InferenceClient(api_key=settings.HF_API_KEY)
+    # LLM_BASE_URL points both clients at any OpenAI-compatible server (e.g. a local stub);
+    # the model id is then only sent in the payload
+    client_kwargs = {"base_url": settings.LLM_BASE_URL} if settings.LLM_BASE_URL else {}
+    hf_client = InferenceClient(api_key=settings.HF_API_KEY, timeout=settings.LLM_TIMEOUT_SECONDS, **client_kwargs)
+    hf_async_client = AsyncInferenceClient(api_key=settings.HF_API_KEY, timeout=settings.LLM_TIMEOUT_SECONDS, **client_kwargs)
     # List of models: free serverless tier models first, then paid models
     HF_MODELS = [
         "google/gemma-3-4b-it",                 # Free Tier (Gemma 3 4B - suggested & verified)
@@ -20,63 +34,217 @@ try:
 except Exception as e:
     print(f"HF Client Init Failed: {e}")
     hf_client = None
+    hf_async_client = None
 
+# Record / replay HF calls to a JSONL cassette for deterministic offline runs
+if settings.LLM_RECORD_REPLAY in ("record", "replay"):
+    cassette = Cassette(settings.LLM_CASSETTE_PATH)
+    print(f"LLM {settings.LLM_RECORD_REPLAY} mode using cassette {settings.LLM_CASSETTE_PATH}")
+    hf_client = RecordReplayClient(hf_client, cassette, settings.LLM_RECORD_REPLAY, settings.LLM_REPLAY_LATENCY)
+    hf_async_client = AsyncRecordReplayClient(hf_async_client, cassette, settings.LLM_RECORD_REPLAY, settings.LLM_REPLAY_LATENCY)
 
-def generate_timetable_with_llm(prompt: str) -> dict:
-    # Try Hugging Face first
-    if hf_client:
-        for model_id in HF_MODELS:
+TIMETABLE_SYSTEM_PROMPT = "You are a highly intelligent timetable generation engine. Your goal is to create a conflict-free academic timetable based on the provided constraints. output ONLY valid JSON containing a 'slots' array. Do not output conversational text outside JSON block."
+
+
+def extract_json_block(response_content: str) -> dict:
+    """Strips code fences and surrounding text from an LLM reply and parses the JSON object."""
+    # Extract JSON block
+    if "```json" in response_content:
+        response_content = response_content.split("```json")[1].split("```")[0].strip()
+    elif "```" in response_content:
+        response_content = response_content.split("```")[1].split("```")[0].strip()
+    
+    # Strip outer brackets if needed
+    start = response_content.find('{')
+    end = response_content.rfind('}') + 1
+    if start != -1 and end != -1:
+        response_content = response_content[start:end]
+    
+    return json.loads(response_content)
+
+
+def cache_lookup(key: str):
+    return llm_cache.get(key) if settings.LLM_CACHE_ENABLED else None
+
+
+def cache_store(key: str, value) -> None:
+    if settings.LLM_CACHE_ENABLED:
+        llm_cache.set(key, value)
+
+
+def is_credit_error(e: Exception) -> bool:
+    return "402" in str(e) or "Payment Required" in str(e) or "credits" in str(e).lower()
+
+
+# Models whose backend rejected `response_format`; they get the plain parsing path from then on
+structured_output_unsupported = set()
+# 4xx statuses that say nothing about `response_format` support
+_NOT_A_FORMAT_REJECTION = {401, 402, 403, 408, 429}
+
+
+def is_response_format_rejection(e: Exception) -> bool:
+    """A 4xx answer to a schema-constrained request that is not about auth, credits, timeouts or rate limits."""
+    status = getattr(getattr(e, "response", None), "status_code", None)
+    return isinstance(status, int) and 400 <= status < 500 and status not in _NOT_A_FORMAT_REJECTION and not is_credit_error(e)
+
+
+async def _stream_slots_once(model_id: str, messages: list, checker, response_schema: dict = None, timeout: float = None, **params) -> dict:
+    """
+    Streams one chat completion through SlotStreamParser, checking each slot
+    with `checker` as it arrives. Stops early once more than
+    LLM_STREAM_MAX_INVALID_SLOTS slots were rejected; on a timeout or a broken
+    stream the slots accepted so far are kept. Never raises except on cancellation.
+    With response_schema, the backend is asked for schema-constrained output;
+    if it rejects that request with a 4xx (see is_response_format_rejection)
+    it is retried on the plain parsing path and the model is not sent a schema
+    again. Timeouts, connection errors and 5xx fail the attempt as usual.
+    """
+    parser = SlotStreamParser()
+    result = {"model": model_id, "slots": [], "rejected": 0, "complete": False, "aborted": False, "exception": None, "structured": False}
+    if not model_health.try_start(model_id):
+        print(f"Skipping {model_id}: its circuit is open or already being probed.")
+        return result
+    started = time.monotonic()
+
+    async def open_stream():
+        if response_schema is not None and settings.LLM_STRUCTURED_OUTPUT and model_id not in structured_output_unsupported:
             try:
-                print(f"Attempting generation with HuggingFace API ({model_id})...")
-                messages = [
-                    {
-                        "role": "system", 
-                        "content": "You are a highly intelligent timetable generation engine. Your goal is to create a conflict-free academic timetable based on the provided constraints. output ONLY valid JSON containing a 'slots' array. Do not output conversational text outside JSON block."
-                    },
-                    {"role": "user", "content": prompt}
-                ]
-                
-                response = hf_client.chat_completion(
-                    messages=messages,
-                    model=model_id,
-                    max_tokens=2500,
-                    temperature=0.1,
-                    top_p=0.9,
-                    timeout=10
+                stream = await hf_async_client.chat_completion(
+                    messages=messages, model=model_id, stream=True,
+                    response_format=json_schema_response_format(response_schema), **params
                 )
-                
-                response_content = response.choices[0].message.content
-                print("HF Response received. Post-processing content...")
-                
-                # Extract JSON block
-                if "```json" in response_content:
-                    response_content = response_content.split("```json")[1].split("```")[0].strip()
-                elif "```" in response_content:
-                    response_content = response_content.split("```")[1].split("```")[0].strip()
-                
-                # Strip outer brackets if needed
-                start = response_content.find('{')
-                end = response_content.rfind('}') + 1
-                if start != -1 and end != -1:
-                    response_content = response_content[start:end]
-                
-                parsed_json = json.loads(response_content)
-                if "slots" in parsed_json:
-                    return parsed_json
-                else:
-                    print(f"Parsed JSON does not contain 'slots' key. Retrying with next model...")
-                    
+                result["structured"] = True
+                return stream
             except Exception as e:
-                print(f"HF Generation Failed for model {model_id}: {e}")
-                if "402" in str(e) or "Payment Required" in str(e) or "credits" in str(e).lower():
-                    print("Payment Required / Credits exhausted on HuggingFace. Skipping paid models.")
-                    break
-                continue # Try fallback model
+                if not is_response_format_rejection(e):
+                    raise
+                print(f"Model {model_id} refused structured output ({e}); using plain JSON parsing.")
+                structured_output_unsupported.add(model_id)
+                return await hf_async_client.chat_completion(messages=messages, model=model_id, stream=True, **params)
+        return await hf_async_client.chat_completion(messages=messages, model=model_id, stream=True, **params)
+
+    async def consume():
+        stream = await open_stream()
+        try:
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                content = chunk.choices[0].delta.content or ""
+                if parser.done:
+                    # Cut off trailing chatter, but let a stream that ends with the reply finish (and be recorded) normally
+                    if content.strip():
+                        break
+                    continue
+                for raw in parser.feed(content):
+                    if checker.check(raw) is None:
+                        result["slots"].append(checker.slots[-1])
+                    else:
+                        result["rejected"] += 1
+                        if result["rejected"] > settings.LLM_STREAM_MAX_INVALID_SLOTS:
+                            result["aborted"] = True
+                            return
+            result["complete"] = parser.done
+        finally:
+            # Stop the server generating tokens we no longer read
+            if hasattr(stream, "aclose"):
+                await stream.aclose()
+
+    try:
+        print(f"Attempting streamed generation with HuggingFace API ({model_id})...")
+        await asyncio.wait_for(consume(), timeout=settings.LLM_TIMEOUT_SECONDS if timeout is None else timeout)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        print(f"HF Streamed Generation Failed for model {model_id}: {e}")
+        result["exception"] = e
+
+    latency = time.monotonic() - started
+    if result["complete"]:
+        model_health.record_success(model_id, latency)
+    elif isinstance(result["exception"], asyncio.TimeoutError) and timeout is not None and timeout < settings.LLM_TIMEOUT_SECONDS:
+        # Cut short by the request deadline, not the model's fault
+        pass
+    else:
+        if result["aborted"]:
+            print(f"Aborted stream from {model_id} after {result['rejected']} invalid slots ({len(result['slots'])} accepted).")
+        model_health.record_failure(model_id, latency, credit_error=result["exception"] is not None and is_credit_error(result["exception"]))
+    return result
+
 
+async def stream_division_slots_with_llm(prompt: str, checker_factory, response_schema: dict = None, timeout: float = None) -> dict:
+    """
+    Generates one division's slots, checking every slot against occupancy as
+    it streams in. checker_factory() builds a fresh StreamingSlotChecker per
+    stream. response_schema (see slot_schema.build_division_slot_schema) enables
+    structured output where supported. Healthy models are raced in waves of LLM_HEDGE_TOP_K; the first
+    complete stream wins. If none completes, the stream with the most accepted
+    slots is returned with complete=False so its slots can be salvaged by repair.
+    `timeout` bounds the whole call: streams get min(LLM_TIMEOUT_SECONDS, time left)
+    and no new wave starts once it is spent.
+    Returns {"slots": [Slot], "complete", "rejected", ...} or {"error": ...}. A
+    complete stream also carries "cache_key"; pass the accepted slots to
+    cache_store under it only after they validate.
+    """
+    messages = [
+        {"role": "system", "content": TIMETABLE_SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ]
+    params = {"max_tokens": 2500, "temperature": 0.1, "top_p": 0.9}
+    cache_key = make_cache_key(messages, **params)
+    # The cache is sqlite: keep its I/O off the event loop
+    cached = await run_in_threadpool(cache_lookup, cache_key)
+    if cached is not None:
+        print("LLM cache hit for timetable prompt.")
+        checker = checker_factory()
+        rejected = sum(1 for raw in cached.get("slots", []) if checker.check(raw) is not None)
+        return {"slots": checker.slots, "complete": True, "rejected": rejected, "aborted": False}
+
+    if not hf_async_client:
+        return {"error": "HuggingFace client is not available."}
+
+    best_partial = None
+    top_k = max(1, settings.LLM_HEDGE_TOP_K)
+    model_ids = model_health.ordered(HF_MODELS)
+    ends_at = time.monotonic() + timeout if timeout is not None else None
+    for start in range(0, len(model_ids), top_k):
+        stream_timeout = settings.LLM_TIMEOUT_SECONDS
+        if ends_at is not None:
+            stream_timeout = min(stream_timeout, ends_at - time.monotonic())
+            if stream_timeout <= 0:
+                print("LLM time budget spent; not starting another wave of models.")
+                break
+        wave = [asyncio.create_task(_stream_slots_once(model_id, messages, checker_factory(), response_schema, stream_timeout, **params)) for model_id in model_ids[start:start + top_k]]
+        credits_exhausted = False
+        try:
+            for next_done in asyncio.as_completed(wave):
+                result = await next_done
+                if result["complete"]:
+                    # Not cached here: the caller stores it once the division validates
+                    result["cache_key"] = cache_key
+                    return result
+                if result["exception"] is not None and is_credit_error(result["exception"]):
+                    credits_exhausted = True
+                if result["slots"] and (best_partial is None or len(result["slots"]) > len(best_partial["slots"])):
+                    best_partial = result
+        finally:
+            for task in wave:
+                task.cancel()
+        if credits_exhausted:
+            print("Payment Required / Credits exhausted on HuggingFace. Skipping paid models.")
+            break
+
+    if best_partial is not None:
+        print(f"No complete stream; salvaging {len(best_partial['slots'])} slots from {best_partial['model']}.")
+        return best_partial
     return {"error": "Failed to generate timetable with HuggingFace. All models returned parsing errors or timed out."}
 
 
-def allocate_subjects_with_llm(department: str, semester: int, divisions: list, subjects: list, lecturers: list) -> dict:
+def suggest_allocation_with_llm(department: str, semester: int, divisions: list, subjects: list, lecturers: list) -> Optional[dict]:
+    """
+    Asks the LLM for a subject-to-lecturer allocation in the AutoAllocateResponse
+    shape. Only a tie-breaking hint for app/services/allocation.py, which
+    enforces capacities and ignores invented ids. None if no model answers.
+    """
     # Build prompt
     prompt = f"Auto-Allocate and Workload-Balance subjects to academic divisions.\n\n"
     prompt += f"Context:\n"
@@ -129,174 +297,167 @@ Rules:
 Ensure all divisions from the input are present. Ensure the output is strictly valid JSON only. Do not write any conversational text.
 """
 
+    messages = [
+        {
+            "role": "system", 
+            "content": "You are a highly intelligent timetable assistant. Your goal is to auto-allocate subjects to divisions and balance workloads equally. output ONLY valid JSON containing a 'divisions' array. Do not output conversational text or explanation."
+        },
+        {"role": "user", "content": prompt}
+    ]
+    params = {"max_tokens": 2500, "temperature": 0.1, "top_p": 0.9}
+    cache_key = make_cache_key(messages, **params)
+    cached = cache_lookup(cache_key)
+    if cached is not None:
+        print("LLM cache hit for subject allocation prompt.")
+        return cached
+
     # Try Hugging Face first
     if hf_client:
-        for model_id in HF_MODELS:
+        for model_id in model_health.ordered(HF_MODELS):
+            if not model_health.try_start(model_id):
+                continue
+            started = time.monotonic()
             try:
                 print(f"Attempting subject allocation with HuggingFace API ({model_id})...")
-                messages = [
-                    {
-                        "role": "system", 
-                        "content": "You are a highly intelligent timetable assistant. Your goal is to auto-allocate subjects to divisions and balance workloads equally. output ONLY valid JSON containing a 'divisions' array. Do not output conversational text or explanation."
-                    },
-                    {"role": "user", "content": prompt}
-                ]
-                
                 response = hf_client.chat_completion(
                     messages=messages,
                     model=model_id,
-                    max_tokens=2500,
-                    temperature=0.1,
-                    top_p=0.9,
-                    timeout=10
+                    **params
                 )
                 
-                response_content = response.choices[0].message.content
-                
-                # Extract JSON block
-                if "```json" in response_content:
-                    response_content = response_content.split("```json")[1].split("```")[0].strip()
-                elif "```" in response_content:
-                    response_content = response_content.split("```")[1].split("```")[0].strip()
-                
-                start = response_content.find('{')
-                end = response_content.rfind('}') + 1
-                if start != -1 and end != -1:
-                    response_content = response_content[start:end]
-                
-                parsed_json = json.loads(response_content)
+                parsed_json = extract_json_block(response.choices[0].message.content)
                 if "divisions" in parsed_json:
+                    model_health.record_success(model_id, time.monotonic() - started)
+                    cache_store(cache_key, parsed_json)
                     return parsed_json
                 else:
                     print(f"Parsed JSON does not contain 'divisions' key. Retrying with next model...")
+                    model_health.record_failure(model_id, time.monotonic() - started)
                     
             except Exception as e:
                 print(f"HF Subject Allocation Failed for model {model_id}: {e}")
-                if "402" in str(e) or "Payment Required" in str(e) or "credits" in str(e).lower():
+                model_health.record_failure(model_id, time.monotonic() - started, credit_error=is_credit_error(e))
+                if is_credit_error(e):
                     print("Payment Required / Credits exhausted on HuggingFace. Skipping paid models.")
                     break
                 continue # Try fallback model
 
-    # Fallback to local heuristic allocator when HuggingFace fails
-    print("Hugging Face API failed or credits exhausted. Running local heuristic subject allocation fallback...")
-    try:
-        return local_heuristic_allocation(department, semester, divisions, subjects, lecturers)
-    except Exception as fallback_err:
-        print(f"Local heuristic fallback failed: {fallback_err}")
-        return {"error": f"Failed to auto-allocate subjects. HuggingFace failed and local fallback crashed: {fallback_err}"}
+    print("No LLM allocation suggestion available.")
+    return None
 
 
-def local_heuristic_allocation(department: str, semester: int, divisions: list, subjects: list, lecturers: list) -> dict:
-    print("Running local heuristic subject allocation fallback...")
-    
-    # Map lecturers workload (periods assigned to each)
-    lec_workload = {}
-    for lec in lecturers:
-        lec_id = lec.id
-        lec_workload[lec_id] = 0
-        
-    allocated_divisions = []
-    
-    for div in divisions:
-        div_subjects = []
-        for sub in subjects:
-            assigned_id = None
-            
-            # First choice: Default lecturer of the subject if they exist and have capacity
-            default_id = sub.assigned_lecturer_id
-            if default_id:
-                # Find the default lecturer in our pool
-                lec_obj = next((l for l in lecturers if l.id == default_id), None)
-                if lec_obj:
-                    if lec_workload[lec_obj.id] + sub.periods_per_week <= lec_obj.max_periods_per_week:
-                        assigned_id = lec_obj.id
-                        lec_workload[lec_obj.id] += sub.periods_per_week
-            
-            # Second choice: Any active lecturer who lists this subject in preferred subjects and has capacity
-            if not assigned_id:
-                eligible_lecturers = []
-                for lec in lecturers:
-                    if sub.code in lec.subjects or sub.name in lec.subjects:
-                        if lec_workload[lec.id] + sub.periods_per_week <= lec.max_periods_per_week:
-                            eligible_lecturers.append(lec)
-                
-                if eligible_lecturers:
-                    # Choose the one with the lowest current workload to balance load
-                    eligible_lecturers.sort(key=lambda l: lec_workload[l.id])
-                    chosen_lec = eligible_lecturers[0]
-                    assigned_id = chosen_lec.id
-                    lec_workload[chosen_lec.id] += sub.periods_per_week
-            
-            # Third choice: Any lecturer who has capacity
-            if not assigned_id:
-                eligible_lecturers = [l for l in lecturers if lec_workload[l.id] + sub.periods_per_week <= l.max_periods_per_week]
-                if eligible_lecturers:
-                    eligible_lecturers.sort(key=lambda l: lec_workload[l.id])
-                    chosen_lec = eligible_lecturers[0]
-                    assigned_id = chosen_lec.id
-                    lec_workload[chosen_lec.id] += sub.periods_per_week
-            
-            # Fallback: Just assign the default lecturer ID or the first lecturer even if it exceeds max workload
-            if not assigned_id:
-                assigned_id = default_id or (lecturers[0].id if lecturers else "TBD")
-                if assigned_id and assigned_id in lec_workload:
-                    lec_workload[assigned_id] += sub.periods_per_week
-            
-            # Convert to dict representing the Pydantic Subject schema
-            div_subjects.append({
-                "code": sub.code,
-                "name": sub.name,
-                "type": sub.type,
-                "periods_per_week": sub.periods_per_week,
-                "assigned_lecturer_id": assigned_id,
-                "semester": sub.semester,
-                "department": sub.department,
-                "credits": sub.credits,
-                "lab_requirement": sub.lab_requirement
-            })
-            
-        allocated_divisions.append({
-            "name": div.name,
-            "strength": div.strength,
-            "subjects": div_subjects
-        })
-        
-    return {"divisions": allocated_divisions}
-
-
-def explain_conflicts_with_llm(conflicts: list) -> str:
+async def translate_constraints_with_llm(texts: list, request, timeout: float = None) -> list:
+    """
+    Translates free-text scheduling constraints into DSL rules (see
+    app/services/constraint_dsl.py) so the solver can enforce them. Replies are
+    cached, so each phrasing is translated once per resource set. Models are
+    tried in turn within `timeout` (the caller's LLM budget / deadline): each
+    call gets min(LLM_TIMEOUT_SECONDS, time left) and no model is tried once it
+    is spent. Returns one list of valid DSL lines per input text (empty if untranslatable).
+    """
+    prompt = "Translate each scheduling constraint below into rules of this constraint language.\n\n"
+    prompt += DSL_HELP + "\n\n"
+    prompt += f"Working days: {', '.join(request.metadata.working_days)}. Periods per day: {request.metadata.periods_per_day}.\n"
+    prompt += "Lecturers: " + ", ".join(f"{l.id} ({l.name})" for l in request.lecturers) + "\n"
+    subjects = {s.code: s.name for d in request.divisions for s in d.subjects}
+    prompt += "Subjects: " + ", ".join(f"{code} ({name})" for code, name in subjects.items()) + "\n"
+    prompt += "Divisions: " + ", ".join(d.name for d in request.divisions) + "\n\n"
+    prompt += "Constraints:\n" + "\n".join(f"{i + 1}. {text}" for i, text in enumerate(texts)) + "\n\n"
+    prompt += 'Return JSON only: {"translations": [["rule", ...], ...]} with one list per constraint, in order. Use an empty list for a constraint that cannot be expressed. Use exact ids from the lists above.'
+
+    messages = [
+        {"role": "system", "content": "You translate timetable constraints into a small rule language. output ONLY valid JSON containing a 'translations' array."},
+        {"role": "user", "content": prompt}
+    ]
+    params = {"max_tokens": 600, "temperature": 0.0}
+    cache_key = make_cache_key(messages, **params)
+    parsed_json = await run_in_threadpool(cache_lookup, cache_key)
+
+    if parsed_json is None and hf_async_client:
+        ends_at = time.monotonic() + timeout if timeout is not None else None
+        for model_id in model_health.ordered(HF_MODELS):
+            call_timeout = settings.LLM_TIMEOUT_SECONDS
+            if ends_at is not None:
+                call_timeout = min(call_timeout, ends_at - time.monotonic())
+                if call_timeout <= 0:
+                    print("LLM time budget spent; leaving the remaining constraints untranslated.")
+                    break
+            if not model_health.try_start(model_id):
+                continue
+            started = time.monotonic()
+            try:
+                print(f"Attempting constraint translation with HuggingFace ({model_id})...")
+                response = await asyncio.wait_for(hf_async_client.chat_completion(messages=messages, model=model_id, **params), call_timeout)
+                candidate = extract_json_block(response.choices[0].message.content)
+                if not isinstance(candidate.get("translations"), list):
+                    raise ValueError("Parsed JSON does not contain a 'translations' list")
+                model_health.record_success(model_id, time.monotonic() - started)
+                parsed_json = candidate
+                await run_in_threadpool(cache_store, cache_key, parsed_json)
+                break
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Constraint translation model {model_id} failed: {e}")
+                model_health.record_failure(model_id, time.monotonic() - started, credit_error=is_credit_error(e))
+                if is_credit_error(e):
+                    break
+
+    translations = (parsed_json or {}).get("translations", [])
+    results = []
+    for i in range(len(texts)):
+        lines = translations[i] if i < len(translations) and isinstance(translations[i], list) else []
+        valid = []
+        for line in lines:
+            try:
+                parse_constraint(str(line), request)
+                valid.append(str(line))
+            except ConstraintSyntaxError as e:
+                print(f"Discarding translated rule '{line}': {e}")
+        results.append(valid)
+    return results
+
+
+def generate_conflict_explanation(conflicts: list) -> Optional[str]:
     """
     Asks the LLM to explain scheduling resource conflicts politely and suggest solutions.
+    The conflict set is de-duplicated and sorted so the same clashes always share a cache entry.
+    Returns None if no model answered.
     """
     prompt = f"The college scheduling engine failed to generate a timetable due to the following resource clashes:\n"
-    for clash in conflicts:
+    for clash in sorted(set(conflicts)):
         prompt += f"- {clash}\n"
     prompt += "\nExplain in a very polite, helpful, and clear manner to the administrator which constraints are clashing, why this makes scheduling mathematically impossible, and suggest specific actions to resolve it (e.g. adding more rooms, reducing subject hours, or updating teacher workloads). Keep the response concise (max 3 short paragraphs). Do not output JSON, write plain text only."
     
+    messages = [
+        {"role": "system", "content": "You are a helpful college administrator assistant. Your job is to explain scheduling conflicts clearly and politely in plain text."},
+        {"role": "user", "content": prompt}
+    ]
+    params = {"max_tokens": 800, "temperature": 0.7}
+    cache_key = make_cache_key(messages, **params)
+    cached = cache_lookup(cache_key)
+    if cached is not None:
+        print("LLM cache hit for conflict explanation.")
+        return cached
+
     if hf_client:
-        for model_id in HF_MODELS:
+        for model_id in model_health.ordered(HF_MODELS):
+            if not model_health.try_start(model_id):
+                continue
+            started = time.monotonic()
             try:
                 print(f"Attempting conflict explanation with HuggingFace ({model_id})...")
-                messages = [
-                    {"role": "system", "content": "You are a helpful college administrator assistant. Your job is to explain scheduling conflicts clearly and politely in plain text."},
-                    {"role": "user", "content": prompt}
-                ]
                 response = hf_client.chat_completion(
                     messages=messages,
                     model=model_id,
-                    max_tokens=800,
-                    temperature=0.7,
-                    timeout=10
+                    **params
                 )
-                return response.choices[0].message.content.strip()
+                model_health.record_success(model_id, time.monotonic() - started)
+                explanation = response.choices[0].message.content.strip()
+                cache_store(cache_key, explanation)
+                return explanation
             except Exception as e:
                 print(f"Explanation model {model_id} failed: {e}")
+                model_health.record_failure(model_id, time.monotonic() - started, credit_error=is_credit_error(e))
                 continue
-                
-    # Fallback if AI fails to respond
-    fallback_msg = "Timetable generation is mathematically impossible due to the following clashes:\n"
-    for clash in conflicts:
-        fallback_msg += f"- {clash}\n"
-    fallback_msg += "\nPlease adjust your staff workloads or classroom resources to resolve these clashes."
-    return fallback_msg
-
+    return None
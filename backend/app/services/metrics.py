@@ -0,0 +1,162 @@
+"""
+In-process generation metrics, served by GET /metrics in the Prometheus text
+exposition format (version 0.0.4). Counters and histograms live in this
+worker process; with several uvicorn workers each one is scraped separately.
+"""
+import math
+import threading
+from typing import Dict, Optional, Sequence, Tuple
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf"
+    return repr(float(value))
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self):
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                yield f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: Sequence[float], labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # Key: label values -> [per-bucket counts (non-cumulative), sum, count]
+        self._values: Dict[Tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with self._lock:
+            entry = self._values.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            for idx, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][idx] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self):
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    labels = _format_labels(self.labels, key, f'le="{_format_value(bound)}"')
+                    yield f"{self.name}_bucket{labels} {cumulative}"
+                yield f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total)}"
+                yield f"{self.name}_count{_format_labels(self.labels, key)} {count}"
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+SECONDS_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 15, 30, 60, 120, 300)
+SIZE_BUCKETS = (100, 1_000, 10_000, 50_000, 100_000, 500_000, 1_000_000)
+
+generations_total = registry.register(Counter(
+    "timetable_generations_total", "Generation requests by endpoint, outcome and the stage that produced the result.",
+    ["endpoint", "outcome", "source"]
+))
+generation_seconds = registry.register(Histogram(
+    "timetable_generation_seconds", "Wall time of a generation request.", SECONDS_BUCKETS, ["endpoint", "source"]
+))
+solver_runs_total = registry.register(Counter(
+    "timetable_solver_runs_total", "CP-SAT runs by final solver status.", ["status"]
+))
+solver_build_seconds = registry.register(Histogram(
+    "timetable_solver_build_seconds", "CP-SAT model build time.", SECONDS_BUCKETS
+))
+solver_solve_seconds = registry.register(Histogram(
+    "timetable_solver_solve_seconds", "CP-SAT search wall time.", SECONDS_BUCKETS, ["status"]
+))
+solver_first_solution_seconds = registry.register(Histogram(
+    "timetable_solver_first_solution_seconds", "CP-SAT time to the first feasible solution.", SECONDS_BUCKETS
+))
+solver_variables = registry.register(Histogram(
+    "timetable_solver_variables", "Variables in the CP-SAT model.", SIZE_BUCKETS
+))
+solver_constraints = registry.register(Histogram(
+    "timetable_solver_constraints", "Constraints in the CP-SAT model.", SIZE_BUCKETS
+))
+solver_gap = registry.register(Histogram(
+    "timetable_solver_gap", "Relative gap between objective and best bound of solved models.", (0, 0.01, 0.05, 0.1, 0.25, 0.5, 1)
+))
+division_llm_attempts = registry.register(Histogram(
+    "timetable_division_llm_attempts", "LLM attempts per division in the sequential stage.", (0, 1, 2, 3, 4, 5), ["source"]
+))
+
+
+def record_generation(endpoint: str, outcome: str, seconds: float, diagnostics: Optional[dict] = None) -> None:
+    """
+    Records one /generate or /regenerate run. `outcome` is success, infeasible,
+    error, timeout or cancelled; `diagnostics` is PipelineContext.diagnostics().
+    """
+    diagnostics = diagnostics or {}
+    source = diagnostics.get("source") or "none"
+    generations_total.inc(endpoint=endpoint, outcome=outcome, source=source)
+    generation_seconds.observe(seconds, endpoint=endpoint, source=source)
+
+    stats = diagnostics.get("solver")
+    if stats:
+        solver_runs_total.inc(status=stats["solver_status"])
+        solver_build_seconds.observe(stats["build_seconds"])
+        solver_solve_seconds.observe(stats["solve_seconds"], status=stats["solver_status"])
+        solver_variables.observe(stats["variables"])
+        solver_constraints.observe(stats["constraints"])
+        if stats.get("first_solution_seconds") is not None:
+            solver_first_solution_seconds.observe(stats["first_solution_seconds"])
+        if stats.get("gap") is not None:
+            solver_gap.observe(stats["gap"])
+
+    for run in diagnostics.get("divisions") or []:
+        division_llm_attempts.observe(run["llm_attempts"], source=run["source"])
@@ -0,0 +1,133 @@
+import threading
+import time
+from typing import Dict, List, Optional
+from app.core.config import settings
+
+
+class ModelHealth:
+    """Observed behaviour of one model: latency EWMA, error-rate EWMA and circuit state."""
+
+    def __init__(self):
+        self.latency_ewma: Optional[float] = None
+        self.error_rate: float = 0.0
+        self.calls: int = 0
+        self.consecutive_failures: int = 0
+        self.last_402_at: Optional[float] = None
+        self.open_until: float = 0.0
+        # Half-open: while a probe call holds the slot, nobody else gets the model
+        self.probe_until: float = 0.0
+
+    def to_dict(self, now: float) -> dict:
+        return {
+            "latency_ewma": self.latency_ewma,
+            "error_rate": round(self.error_rate, 3),
+            "calls": self.calls,
+            "consecutive_failures": self.consecutive_failures,
+            "last_402_at": self.last_402_at,
+            "circuit_open": self.open_until > now,
+            "probing": self.probe_until > now,
+        }
+
+
+class ModelHealthRegistry:
+    """
+    Process-wide health registry shared by every LLM call path.
+    A model's circuit opens after repeated failures (or a 402 / credits error)
+    and it is skipped until the TTL expires. It is then half-open: ordered()
+    lists it while its probe slot is free, and the first call that actually
+    starts (try_start()) takes the slot. Every other caller keeps skipping it
+    until the probe's outcome is recorded (success closes the circuit, failure
+    re-opens it) or LLM_TIMEOUT_SECONDS pass, which frees the slot of a probe
+    that never reported back. Available models are ordered by
+    observed latency (penalized by error rate), with untried models first so
+    they get measured.
+    """
+
+    def __init__(self, alpha: float = 0.3):
+        self.alpha = alpha
+        self._models: Dict[str, ModelHealth] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, model_id: str) -> ModelHealth:
+        if model_id not in self._models:
+            self._models[model_id] = ModelHealth()
+        return self._models[model_id]
+
+    def record_success(self, model_id: str, latency: float) -> None:
+        with self._lock:
+            health = self._get(model_id)
+            health.calls += 1
+            health.consecutive_failures = 0
+            health.open_until = 0.0
+            health.probe_until = 0.0
+            health.latency_ewma = latency if health.latency_ewma is None else self.alpha * latency + (1 - self.alpha) * health.latency_ewma
+            health.error_rate = (1 - self.alpha) * health.error_rate
+
+    def record_failure(self, model_id: str, latency: float, credit_error: bool = False) -> None:
+        now = time.monotonic()
+        with self._lock:
+            health = self._get(model_id)
+            health.calls += 1
+            health.consecutive_failures += 1
+            health.probe_until = 0.0
+            health.error_rate = self.alpha + (1 - self.alpha) * health.error_rate
+            # Failures still cost latency (timeouts especially), so they feed the ordering too
+            health.latency_ewma = latency if health.latency_ewma is None else self.alpha * latency + (1 - self.alpha) * health.latency_ewma
+
+            if credit_error:
+                health.last_402_at = now
+                health.open_until = now + settings.LLM_CREDIT_COOLDOWN_SECONDS
+            elif health.consecutive_failures >= settings.LLM_CIRCUIT_FAILURE_THRESHOLD:
+                health.open_until = now + settings.LLM_CIRCUIT_TTL_SECONDS
+
+    def _available(self, model_id: str, now: float) -> bool:
+        """Circuit closed, or half-open with its probe slot free."""
+        health = self._models.get(model_id)
+        if health is None or health.open_until == 0.0:
+            return True
+        return health.open_until <= now and health.probe_until <= now
+
+    def try_start(self, model_id: str) -> bool:
+        """
+        Called right before a request to the model is sent. False if its circuit
+        is open or another call already holds the half-open probe; otherwise the
+        call goes ahead, taking the probe slot of a half-open circuit.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if not self._available(model_id, now):
+                return False
+            health = self._models.get(model_id)
+            if health is not None and health.open_until != 0.0:
+                health.probe_until = now + settings.LLM_TIMEOUT_SECONDS
+            return True
+
+    def _expected_cost(self, model_id: str) -> float:
+        # Observed latency plus the timeout we expect to waste on errors; untried models cost 0
+        health = self._models.get(model_id)
+        if health is None or health.latency_ewma is None:
+            return 0.0
+        return health.latency_ewma + health.error_rate * settings.LLM_TIMEOUT_SECONDS
+
+    def ordered(self, model_ids: List[str]) -> List[str]:
+        """
+        Models whose circuit is closed, plus half-open ones whose probe slot is
+        free, cheapest first (untried models keep their listed order up front).
+        Nothing is claimed: call try_start() when a request to the model starts.
+        """
+        now = time.monotonic()
+        with self._lock:
+            available = [m for m in model_ids if self._available(m, now)]
+            return sorted(available, key=self._expected_cost)
+
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            return {model_id: health.to_dict(now) for model_id, health in self._models.items()}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._models.clear()
+
+
+model_health = ModelHealthRegistry()
@@ -0,0 +1,344 @@
+import time
+from contextlib import contextmanager
+from typing import List, Optional
+from fastapi.concurrency import run_in_threadpool
+from app.core.config import settings
+from app.models.schemas import TimetableRequest
+from app.services.slots import Slot
+from app.services.constraint_dsl import compile_constraints
+from app.services.llm_service import stream_division_slots_with_llm, translate_constraints_with_llm, cache_store
+from app.services.problem import CompiledProblem, merged_rooms
+from app.services.prompt_builder import build_single_division_prompt, count_prompt_tokens, fit_prompt_feedback
+from app.services.repair import repair_division_slots_full
+from app.services.slot_schema import build_division_slot_schema
+from app.services.slot_stream import StreamingSlotChecker
+from app.services.solver import schedule_with_ortools
+from app.services.validator import IncrementalValidator
+from app.services.deadline import Deadline
+
+
+class PipelineError(RuntimeError):
+    pass
+
+
+class StageTimings:
+    """
+    Wall time spent per stage, accumulated across calls (the LLM, repair and
+    validate stages run once per division attempt), with optional budgets.
+    """
+
+    def __init__(self, budgets: dict):
+        self.budgets = budgets
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        record = self.stages.setdefault(name, {"seconds": 0.0, "calls": 0})
+        started = time.monotonic()
+        try:
+            yield record
+        finally:
+            record["seconds"] += time.monotonic() - started
+            record["calls"] += 1
+
+    def skip(self, name: str, reason: str) -> None:
+        self.stages.setdefault(name, {"seconds": 0.0, "calls": 0})["skipped"] = reason
+
+    def remaining(self, name: str) -> Optional[float]:
+        budget = self.budgets.get(name)
+        if budget is None:
+            return None
+        return budget - self.stages.get(name, {}).get("seconds", 0.0)
+
+    def report(self) -> dict:
+        stages = []
+        for name, record in self.stages.items():
+            entry = {"name": name, "seconds": round(record["seconds"], 4), "calls": record["calls"]}
+            if self.budgets.get(name) is not None:
+                entry["budget_seconds"] = self.budgets[name]
+            if "skipped" in record:
+                entry["skipped"] = record["skipped"]
+            stages.append(entry)
+        return {"stages": stages, "total_seconds": round(sum(r["seconds"] for r in self.stages.values()), 4)}
+
+
+class PipelineContext:
+    """
+    State shared by the stages of one generation run. `problem` is the
+    request's CompiledProblem, built once by the presolve stage. A stage finishes the run
+    by setting `slots` (a timetable) or `conflicts` (an infeasibility report).
+    Stages get the smaller of their own budget and the request deadline.
+    """
+
+    def __init__(self, request: TimetableRequest, solver_with_free_text: bool = True, deadline: Deadline = None):
+        self.request = request
+        self.deadline = deadline or Deadline()
+        self.solver_with_free_text = solver_with_free_text
+        self.leftover_constraints: List[str] = []
+        self.slots: Optional[List[Slot]] = None
+        self.conflicts: Optional[List[str]] = None
+        self.source = None
+        self.problem: Optional[CompiledProblem] = None
+        # Telemetry: CP-SAT stats (see schedule_with_ortools) and, per division
+        # of the LLM stage, the attempts made and which generator produced it
+        self.solver_stats: Optional[dict] = None
+        # Free-text constraint lines and how many the LLM translated to DSL
+        self.constraint_translation: Optional[dict] = None
+        self.division_runs: List[dict] = []
+        self.timings = StageTimings({
+            "cp_sat": settings.SOLVER_TIME_LIMIT_SECONDS,
+            "llm": settings.LLM_STAGE_BUDGET_SECONDS,
+        })
+
+    def remaining(self, stage: str) -> Optional[float]:
+        return self.deadline.clamp(self.timings.remaining(stage))
+
+    @property
+    def done(self) -> bool:
+        return self.slots is not None or self.conflicts is not None
+
+    def report(self) -> dict:
+        report = self.timings.report()
+        report["source"] = self.source
+        return report
+
+    def diagnostics(self) -> dict:
+        """Solver telemetry of the run, for the optional `diagnostics` response block."""
+        return {
+            "source": self.source,
+            "solver": self.solver_stats,
+            "constraints": self.constraint_translation,
+            "divisions": self.division_runs,
+        }
+
+
+def merge_labs_into_classrooms(request: TimetableRequest) -> None:
+    """Adds request.labs to the classroom pool as Lab rooms (once, skipping ids already present)."""
+    request.classrooms = merged_rooms(request)
+
+
+async def compile_request_constraints(ctx: PipelineContext) -> List[str]:
+    """
+    Rewrites request.constraints into DSL rules the solver enforces directly.
+    Lines that are not DSL are translated once by the LLM, within the LLM stage
+    budget and the request deadline (timed as the "llm" stage); whatever still
+    cannot be expressed is kept as free text and returned, so the caller can
+    fall back to the LLM pipeline for it.
+    """
+    request = ctx.request
+    rules, unparsed = compile_constraints(request.constraints, request)
+    dsl_lines = [rule.text for rule in rules]
+    leftovers = []
+    if unparsed:
+        ctx.deadline.check()
+        remaining = ctx.remaining("llm")
+        translations = [[] for _ in unparsed]
+        if remaining is None or remaining > 0:
+            with ctx.timings.stage("llm"):
+                translations = await translate_constraints_with_llm(unparsed, request, timeout=remaining)
+        for text, translated in zip(unparsed, translations):
+            if translated:
+                dsl_lines.extend(translated)
+            else:
+                leftovers.append(text)
+        ctx.constraint_translation = {"free_text": len(unparsed), "translated": len(unparsed) - len(leftovers)}
+    request.constraints = dsl_lines + leftovers
+    return leftovers
+
+
+# ---------------- Stages ----------------
+
+async def presolve_stage(ctx: PipelineContext) -> None:
+    with ctx.timings.stage("presolve"):
+        merge_labs_into_classrooms(ctx.request)
+        ctx.problem = CompiledProblem(ctx.request)
+    ctx.leftover_constraints = await compile_request_constraints(ctx)
+    if ctx.leftover_constraints:
+        print(f"{len(ctx.leftover_constraints)} constraint(s) the solver cannot enforce are passed to the LLM prompt only.")
+
+
+def slot_lecturer_assignments(slots: List[Slot]) -> List[dict]:
+    """(division, subject, lecturer) of generated slots, for apply_lecturer_assignments."""
+    return [{"division": slot.division, "subject": slot.subject, "lecturer": slot.lecturer} for slot in slots]
+
+
+def apply_lecturer_assignments(request: TimetableRequest, assignments: List[dict]) -> None:
+    """
+    Records the lecturers the solver (or repair) chose as the subjects' assigned
+    lecturers, in place. Subjects are replaced rather than mutated; build a new
+    CompiledProblem before scheduling the request again.
+    """
+    chosen = {(a["division"], a["subject"]): a["lecturer"] for a in assignments}
+    if not chosen:
+        return
+    for division in request.divisions:
+        division.subjects = [
+            subject.model_copy(update={"assigned_lecturer_id": chosen[division.name, subject.code]})
+            if (division.name, subject.code) in chosen else subject
+            for subject in division.subjects
+        ]
+
+
+async def solver_stage(ctx: PipelineContext) -> None:
+    if ctx.leftover_constraints and not ctx.solver_with_free_text:
+        ctx.timings.skip("cp_sat", "free-text constraints")
+        return
+    with ctx.timings.stage("cp_sat"):
+        try:
+            print("Running Google OR-Tools CP-SAT constraint scheduler...")
+            solver_result = await run_in_threadpool(schedule_with_ortools, ctx.request, ctx.remaining("cp_sat"), ctx.deadline, problem=ctx.problem)
+        except Exception as e:
+            print(f"CP-SAT Solver failed or crashed: {e}. Falling back to sequential LLM/Heuristic pipeline...")
+            return
+
+    ctx.solver_stats = solver_result.get("stats")
+    if solver_result["status"] == "SUCCESS":
+        print("CP-SAT Solver successfully generated optimal timetable.")
+        ctx.slots = solver_result["slots"]
+        apply_lecturer_assignments(ctx.request, solver_result.get("lecturer_assignments", []))
+        ctx.source = "cp_sat"
+    elif solver_result["status"] == "INFEASIBLE":
+        # Early returns (no rooms, an unschedulable subject) carry only an error message
+        ctx.conflicts = solver_result.get("conflicts") or [solver_result.get("error", "No feasible schedule.")]
+        ctx.source = "cp_sat"
+        print(f"CP-SAT Solver reported INFEASIBLE. Conflicts: {ctx.conflicts}")
+    else:
+        print(f"CP-SAT Solver stopped ({solver_result['status']}). Falling back to sequential LLM/Heuristic pipeline...")
+
+
+async def division_stage(ctx: PipelineContext) -> None:
+    """
+    Sequential per-division generation: LLM proposal, repair and validation,
+    with feedback on failure, then the local heuristic scheduler when retries,
+    the LLM budget or the request deadline run out.
+    """
+    request = ctx.request
+    problem = ctx.problem or CompiledProblem(request)
+    timings = ctx.timings
+    all_generated_slots: List[Slot] = []
+    validator = IncrementalValidator(request, problem=problem)
+
+    for division in request.divisions:
+        print(f"Generating Timetable for Division: {division.name}")
+
+        # Build prompt for THIS division, passing already occupied slots
+        base_prompt = build_single_division_prompt(request, division, all_generated_slots, problem=problem)
+        # Feedback from failed attempts, re-fitted into the token budget on every retry
+        feedback: List[str] = []
+        response_schema = build_division_slot_schema(request, division)
+
+        max_retries = 5 if base_prompt is not None else 0
+        last_error = None if base_prompt is not None else "Prompt over the token budget"
+        division_slots = []
+        success = False
+        run = {"division": division.name, "llm_attempts": 0, "source": "llm"}
+        ctx.division_runs.append(run)
+
+        for attempt in range(max_retries):
+            ctx.deadline.check()
+            remaining = ctx.remaining("llm")
+            if remaining is not None and remaining <= 0:
+                print(f"  LLM budget or request deadline reached; skipping to the heuristic scheduler")
+                break
+            current_prompt = fit_prompt_feedback(base_prompt, feedback)
+            print(f"  Attempt {attempt + 1}/{max_retries} for Div {division.name} (~{count_prompt_tokens(current_prompt)} prompt tokens)")
+            run["llm_attempts"] += 1
+
+            # Call LLM (streamed; each slot is checked against occupancy as it arrives)
+            with timings.stage("llm"):
+                llm_response = await stream_division_slots_with_llm(
+                    current_prompt, lambda: StreamingSlotChecker(request, all_generated_slots, division.name, problem=problem),
+                    response_schema=response_schema, timeout=remaining
+                )
+            if "error" in llm_response:
+                print(f"  LLM Error: {llm_response['error']}")
+                last_error = f"LLM Error: {llm_response['error']}"
+                continue
+
+            try:
+                # Accepted slots; a partial stream is salvaged and completed by repair
+                division_slots = llm_response["slots"]
+                if not llm_response["complete"]:
+                    print(f"  Salvaging {len(division_slots)} streamed slots for Div {division.name}")
+                cache_entry = {"slots": [slot.to_dict() for slot in division_slots]} if "cache_key" in llm_response else None
+
+                # CPU-bound: run off the event loop, like the solver stage
+                with timings.stage("repair"):
+                    division_slots = await run_in_threadpool(repair_division_slots_full, division_slots, all_generated_slots, request, division.name, problem=problem)
+
+                with timings.stage("validate"):
+                    validation_result = await run_in_threadpool(validator.validate_delta, division_slots, specific_divisions=[division.name])
+
+                if validation_result["valid"]:
+                    print(f"  Division {division.name} valid!")
+                    if cache_entry is not None:
+                        await run_in_threadpool(cache_store, llm_response["cache_key"], cache_entry)
+                    success = True
+                    break
+                else:
+                    print(f"  Validation Failed: {validation_result['errors']}")
+                    last_error = str(validation_result['errors'])
+                    validator.rollback()
+
+                    # Refine Prompt
+                    violations = "\n".join([f"- {e}" for e in validation_result["errors"] if division.name in e or "double-booked" in e])
+                    feedback.append(f"\n\nCRITICAL: The previous generation was INVALID. Please try again using UNUSED time slots. Violations:\n{violations}")
+
+            except Exception as e:
+                print(f"  Parsing Error: {e}")
+                last_error = f"Parsing Error: {e}"
+                feedback.append(f"\n\nJSON Parsing Error: {e}. Output valid JSON only.")
+
+        if not success:
+            print(f"HuggingFace failed to generate timetable for Division {division.name}. Falling back to local heuristic scheduler...")
+            run["source"] = "heuristic"
+            try:
+                with timings.stage("repair"):
+                    division_slots = await run_in_threadpool(repair_division_slots_full, [], all_generated_slots, request, division.name, problem=problem)
+                with timings.stage("validate"):
+                    validation_result = await run_in_threadpool(validator.validate_delta, division_slots, specific_divisions=[division.name])
+                if validation_result["valid"]:
+                    print(f"  Local heuristic scheduler succeeded for Div {division.name}!")
+                else:
+                    # If still not fully valid, we use it anyway rather than failing the request
+                    print(f"  Local heuristic scheduler validation warnings: {validation_result['errors']}")
+            except Exception as fallback_err:
+                print(f"Local heuristic scheduler fallback failed: {fallback_err}")
+                raise PipelineError(f"Failed to generate valid schedule for Division {division.name} after retries. Errors: {last_error}. Heuristic fallback failed: {fallback_err}")
+
+        # Add these slots to the global list
+        all_generated_slots.extend(division_slots)
+        validator.commit()
+
+    ctx.slots = all_generated_slots
+    ctx.source = division_source(ctx.division_runs)
+    apply_lecturer_assignments(request, slot_lecturer_assignments(all_generated_slots))
+
+
+def division_source(division_runs: List[dict]) -> str:
+    """Overall source of the sequential stage: llm, heuristic, or mixed when the divisions differ."""
+    sources = {run["source"] for run in division_runs}
+    if len(sources) == 1:
+        return sources.pop()
+    return "mixed" if sources else "llm"
+
+
+DEFAULT_STAGES = [presolve_stage, solver_stage, division_stage]
+
+
+async def run_generation_pipeline(request: TimetableRequest, solver_with_free_text: bool = True, stages: list = None, deadline: Deadline = None, ctx: PipelineContext = None) -> PipelineContext:
+    """
+    Runs the stages in order until one of them produces a timetable or an
+    infeasibility report. Shared by /generate and /regenerate; per-stage timings
+    and budgets are available from ctx.report(). Raises DeadlineExceeded if
+    the deadline is cancelled (client disconnect). A caller that passes its own
+    `ctx` keeps the telemetry collected so far when the run fails.
+    """
+    ctx = ctx or PipelineContext(request, solver_with_free_text=solver_with_free_text, deadline=deadline)
+    for stage in stages or DEFAULT_STAGES:
+        ctx.deadline.check()
+        await stage(ctx)
+        if ctx.done:
+            break
+    print(f"Generation pipeline finished via {ctx.source}: {ctx.timings.report()}")
+    return ctx
@@ -0,0 +1,107 @@
+"""
+CompiledProblem: the lookups every stage derives from a TimetableRequest,
+built once per request. Days, lecturers, rooms and divisions are interned to
+integer ids (in request order), lecturer availability is a NumPy mask, and
+rooms by type, subject eligibility and lab windows are precomputed.
+The solver, repair, validators and prompt builder accept one through a
+`problem` argument and build their own when none is given; none of them
+modifies the request. Build a new one after changing the request's
+lecturers, rooms or subjects (e.g. apply_lecturer_assignments).
+"""
+from typing import Dict, List, Tuple
+import numpy as np
+from app.models.schemas import TimetableRequest, Classroom
+
+ROOM_TYPES = ["Classroom", "Lab"]
+
+
+def merged_rooms(request: TimetableRequest) -> List[Classroom]:
+    """request.classrooms plus request.labs as Lab rooms, skipping lab ids already present."""
+    rooms = list(request.classrooms)
+    known = {room.id for room in rooms}
+    for lab in request.labs or []:
+        if lab.id not in known:
+            known.add(lab.id)
+            rooms.append(
+                Classroom(
+                    id=lab.id,
+                    name=lab.name,
+                    capacity=lab.capacity,
+                    building=lab.department,
+                    floor=0,
+                    type="Lab",
+                    status=lab.status
+                )
+            )
+    return rooms
+
+
+def lab_windows(periods_per_day: int) -> List[Tuple[int, int]]:
+    """Double periods a lab may take: 1-2, 3-4, 5-6, plus the last two periods when the count is odd."""
+    windows = [(p, p + 1) for p in range(1, periods_per_day, 2)]
+    if periods_per_day % 2 and periods_per_day >= 2:
+        windows.append((periods_per_day - 1, periods_per_day))
+    return windows
+
+
+class CompiledProblem:
+    def __init__(self, request: TimetableRequest):
+        self.request = request
+        self.working_days = list(request.metadata.working_days)
+        self.periods_per_day = request.metadata.periods_per_day
+        self.day_ids = {day: idx for idx, day in enumerate(self.working_days)}
+
+        # Lecturers: id -> index, availability (lecturer x day) and load caps
+        self.lecturers = list(request.lecturers)
+        self.lecturer_ids = {}
+        for lec in self.lecturers:
+            self.lecturer_ids.setdefault(lec.id, len(self.lecturer_ids))
+        self.lecturers_by_id = {lec.id: lec for lec in self.lecturers}
+        self.lecturer_available = np.zeros((len(self.lecturer_ids), len(self.working_days)), dtype=bool)
+        self.max_periods_per_day = np.zeros(len(self.lecturer_ids), dtype=np.int64)
+        self.max_periods_per_week = np.zeros(len(self.lecturer_ids), dtype=np.int64)
+        for lec_id, idx in self.lecturer_ids.items():
+            lec = self.lecturers_by_id[lec_id]
+            available_days = set(lec.available_days)
+            self.lecturer_available[idx] = [day in available_days for day in self.working_days]
+            self.max_periods_per_day[idx] = lec.max_periods_per_day
+            self.max_periods_per_week[idx] = lec.max_periods_per_week
+
+        # Rooms (labs merged in once): id -> index, and the available ones by type
+        self.rooms = merged_rooms(request)
+        self.room_ids = {}
+        for room in self.rooms:
+            self.room_ids.setdefault(room.id, len(self.room_ids))
+        self.available_rooms = [room for room in self.rooms if room.status == "Available"]
+        self.rooms_by_type = {t: [room for room in self.available_rooms if room.type == t] for t in ROOM_TYPES}
+
+        # Divisions and their subjects, and who may teach each subject
+        self.division_ids = {}
+        for div in request.divisions:
+            self.division_ids.setdefault(div.name, len(self.division_ids))
+        self.subjects: Dict[Tuple[str, str], object] = {}
+        listing = {}
+        for lec in self.lecturers:
+            for name in lec.subjects:
+                listing.setdefault(name, []).append(lec.id)
+        self.eligible_lecturers: Dict[Tuple[str, str], List[str]] = {}
+        for div in request.divisions:
+            for sub in div.subjects:
+                self.subjects[div.name, sub.code] = sub
+                if sub.assigned_lecturer_id and sub.assigned_lecturer_id != "None":
+                    eligible = [sub.assigned_lecturer_id]
+                else:
+                    listed = set(listing.get(sub.code, ())) | set(listing.get(sub.name, ()))
+                    eligible = [lec_id for lec_id in self.lecturer_ids if lec_id in listed]
+                self.eligible_lecturers[div.name, sub.code] = eligible
+
+        self.lab_windows = lab_windows(self.periods_per_day)
+
+    def room_candidates(self, room_type: str) -> List[Classroom]:
+        """Available rooms of a type, or every available room when there are none of it."""
+        return self.rooms_by_type.get(room_type) or self.available_rooms
+
+    def is_available(self, lecturer_id: str, d_idx: int) -> bool:
+        """False only for a known lecturer outside their available_days."""
+        idx = self.lecturer_ids.get(lecturer_id)
+        return idx is None or bool(self.lecturer_available[idx, d_idx])
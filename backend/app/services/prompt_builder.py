@@ -1,70 +1,188 @@
-from app.models.schemas import TimetableRequest, Division, TimetableSlot
-import json
-from typing import List
+from app.models.schemas import TimetableRequest, Division, TimetableSlot, Classroom
+from app.core.config import settings
+from app.services.problem import CompiledProblem
+import re
+from typing import List, Optional
 
-def build_single_division_prompt(request: TimetableRequest, current_division: Division, occupied_slots: List[TimetableSlot]) -> str:
+# Rough BPE-style split: words, runs of up to 3 digits, single punctuation marks
+_TOKEN_PATTERN = re.compile(r"[A-Za-z]+|\d{1,3}|[^\sA-Za-z\d]")
+
+
+def count_prompt_tokens(text: str) -> int:
+    """Approximate token count of a prompt (no tokenizer dependency; errs on the high side for JSON-ish text)."""
+    return len(_TOKEN_PATTERN.findall(text))
+
+
+def subject_lecturers(request: TimetableRequest, subject) -> List[str]:
+    """Lecturer ids that may teach a subject: the assigned one, else everyone listing it."""
+    if subject.assigned_lecturer_id and subject.assigned_lecturer_id != "None":
+        return [subject.assigned_lecturer_id]
+    return [l.id for l in request.lecturers if subject.code in l.subjects or subject.name in l.subjects]
+
+
+def _free_grid(busy: set, working_days: List[str], periods_per_day: int, available_days=None) -> str:
+    """One string per working day; character i is '1' if period i+1 is free, '0' if busy or unavailable."""
+    rows = []
+    for day in working_days:
+        if available_days is not None and day not in available_days:
+            rows.append("0" * periods_per_day)
+        else:
+            rows.append("".join("0" if (day, p) in busy else "1" for p in range(1, periods_per_day + 1)))
+    return " ".join(rows)
+
+
+def build_single_division_prompt(request: TimetableRequest, current_division: Division, occupied_slots: List[TimetableSlot], token_budget: int = None, problem: CompiledProblem = None) -> Optional[str]:
     """
     Builds a prompt to generate a timetable for ONE specific division,
     considering already occupied slots from other divisions as HARD CONSTRAINTS.
+
+    Only the lecturers and rooms this division can use are included, each as a
+    free-slot grid, so the prompt no longer grows with everything already
+    scheduled. If the prompt exceeds the token budget (LLM_PROMPT_TOKEN_BUDGET),
+    rooms with the fewest free periods are dropped, keeping at least one room
+    per needed type; subjects, lecturers and user constraints are never dropped.
+    Returns None if even that prompt is over the budget: the caller should use
+    the heuristic scheduler instead of sending it.
     """
-    
-    # 1. Format Division Requirements
-    req_list = "\n".join([f"      - {s.code} ({s.type}): {s.periods_per_week} periods" for s in current_division.subjects])
-    division_reqs = f"    DIVISION {current_division.name}:\n{req_list}\n"
-
-    # 2. Format Occupied Slots (Constraints)
-    # We need to list which Lecturers and Rooms are BUSY at specific times.
-    # Format: "Monday Period 1: Lecturer L1 is BUSY, Room R1 is BUSY"
-    blocked_times_desc = ""
-    if occupied_slots:
-        blocked_map = {} # Key: (Day, Period) -> List of strings like "L1 BUSY", "R1 BUSY"
-        for slot in occupied_slots:
-            key = (slot.day, slot.period)
-            if key not in blocked_map:
-                blocked_map[key] = []
-            blocked_map[key].append(f"Lecturer {slot.lecturer} (Div {slot.division})")
-            blocked_map[key].append(f"Room {slot.room} (Div {slot.division})")
-        
-        blocked_times_desc = "    ALREADY OCCUPIED RESOURCES (HARD CONSTRAINTS):\n"
-        for (day, period), conflicts in blocked_map.items():
-            blocked_times_desc += f"    - {day} Period {period}: {', '.join(conflicts)}\n"
-    else:
-        blocked_times_desc = "    (No other divisions scheduled yet - all resources free)"
-
-    # 3. Construct Prompt
-    prompt = f"""
-    Generate a conflict-free timetable for DIVISION {current_division.name}.
-    
-    METADATA:
-    - Institution: {request.metadata.institution_name}
-    - Department: {request.metadata.department}
-    - Semester: {request.metadata.semester}
-    - Working Days: {', '.join(request.metadata.working_days)}
-    - Periods per Day: {request.metadata.periods_per_day}
-    
-    GLOBAL RESOURCES:
-    - Lecturers: {json.dumps([l.dict() for l in request.lecturers], indent=2)}
-    - Classrooms: {json.dumps([c.dict() for c in request.classrooms], indent=2)}
-    
-    REQUIREMENTS FOR DIVISION {current_division.name}:
-    {division_reqs}
-    
-    {blocked_times_desc}
-    
-    CONSTRAINTS:
-    1. **NO DOUBLE BOOKING**: You MUST NOT assign a Lecturer or Room listed in "ALREADY OCCUPIED RESOURCES" for that specific Day/Period.
-    2. **Lecturer Availability**: Respect the `available_days` for each lecturer.
-    3. **Labs**: A Lab session MUST always be 2 consecutive periods on the same day (e.g., Period 1-2, 3-4, 5-6). A single isolated 1-hour Lab slot is strictly prohibited.
-    4. **Subject Load**: You MUST assign exactly the number of periods specified for each subject for this division.
-    5. **Output**: Generate slots ONLY for Division {current_division.name}.
-    6. **DISTRIBUTION**: SPREAD subjects across the week. Do NOT schedule more than 2 periods of the same Theory subject on the same day unless unavoidable.
-    
-    OUTPUT FORMAT (JSON ONLY, NO EXPLANATION):
-    {{
-        "slots": [
-            {{ "division": "{current_division.name}", "day": "Monday", "period": 1, "subject": "SUB1", "lecturer": "L1", "room": "R1", "type": "Theory" }},
-            ...
-        ]
-    }}
-    """
+    if token_budget is None:
+        token_budget = settings.LLM_PROMPT_TOKEN_BUDGET
+    problem = problem or CompiledProblem(request)
+    working_days = problem.working_days
+    periods_per_day = problem.periods_per_day
+
+    # 1. Subjects and the lecturers allowed to teach them
+    subject_lines = []
+    lecturer_ids = []
+    needs_lab = needs_theory = False
+    for s in current_division.subjects:
+        candidates = problem.eligible_lecturers.get((current_division.name, s.code)) or subject_lecturers(request, s)
+        for lec_id in candidates:
+            if lec_id not in lecturer_ids:
+                lecturer_ids.append(lec_id)
+        is_lab = s.type == "Lab" or s.lab_requirement
+        needs_lab = needs_lab or is_lab
+        needs_theory = needs_theory or not is_lab
+        lecturer_desc = "|".join(candidates) if candidates else "any"
+        subject_lines.append(f"- {s.code} {'Lab' if is_lab else 'Theory'} {s.periods_per_week} {lecturer_desc}")
+
+    # 2. Busy (day, period) per lecturer / room from the request's blocked calendar and the other divisions
+    busy_lecturer = {}
+    busy_room = {}
+    for blocked in request.blocked or []:
+        if blocked.lecturer:
+            busy_lecturer.setdefault(blocked.lecturer, set()).add((blocked.day, blocked.period))
+        if blocked.room:
+            busy_room.setdefault(blocked.room, set()).add((blocked.day, blocked.period))
+    for slot in occupied_slots:
+        busy_lecturer.setdefault(slot.lecturer, set()).add((slot.day, slot.period))
+        busy_room.setdefault(slot.room, set()).add((slot.day, slot.period))
+
+    lecturer_lines = []
+    for lec_id in lecturer_ids:
+        lec = problem.lecturers_by_id.get(lec_id)
+        available_days = lec.available_days if lec else None
+        max_per_day = f" max{lec.max_periods_per_day}/day" if lec else ""
+        grid = _free_grid(busy_lecturer.get(lec_id, set()), working_days, periods_per_day, available_days)
+        lecturer_lines.append(f"{lec_id}{max_per_day}: {grid}")
+
+    # 3. Rooms of the types this division needs, freest first
+    rooms: List[Classroom] = problem.available_rooms
+    lab_rooms = problem.rooms_by_type["Lab"]
+    theory_rooms = problem.rooms_by_type["Classroom"]
+    room_groups = []
+    if needs_theory:
+        room_groups.append(("Theory rooms", theory_rooms or rooms))
+    if needs_lab:
+        room_groups.append(("Lab rooms", lab_rooms or rooms))
+    room_groups = [
+        (label, sorted(group, key=lambda r: len(busy_room.get(r.id, ()))))
+        for label, group in room_groups
+    ]
+
+    user_constraints = ""
+    if request.constraints:
+        user_constraints = "\nADDITIONAL USER CONSTRAINTS:\n" + "\n".join(f"- {c}" for c in request.constraints) + "\n"
+
+    def render(room_limit: int) -> str:
+        room_text = ""
+        for label, group in room_groups:
+            room_text += f"{label}:\n"
+            for r in group[:room_limit]:
+                room_text += f"{r.id}: {_free_grid(busy_room.get(r.id, set()), working_days, periods_per_day)}\n"
+        return _PROMPT_TEMPLATE.format(
+            division=current_division.name,
+            department=request.metadata.department,
+            semester=request.metadata.semester,
+            days=", ".join(working_days),
+            periods_per_day=periods_per_day,
+            subjects="\n".join(subject_lines),
+            lecturers="\n".join(lecturer_lines) or "(none listed)",
+            rooms=room_text.rstrip() or "(none listed)",
+        ) + user_constraints
+
+    room_limit = max((len(group) for _, group in room_groups), default=0)
+    prompt = render(room_limit)
+    tokens = count_prompt_tokens(prompt)
+    while tokens > token_budget and room_limit > 1:
+        room_limit = max(1, room_limit // 2)
+        prompt = render(room_limit)
+        tokens = count_prompt_tokens(prompt)
+    if tokens > token_budget:
+        print(f"Prompt for Division {current_division.name} is {tokens} tokens, over the {token_budget} budget even with one room per type.")
+        return None
     return prompt
+
+
+def fit_prompt_feedback(prompt: str, feedback: List[str], token_budget: int = None) -> str:
+    """
+    Appends retry feedback blocks to a prompt built within the token budget,
+    newest first: older blocks are dropped, then the trailing lines of the
+    newest one, so the result never exceeds the budget.
+    """
+    if token_budget is None:
+        token_budget = settings.LLM_PROMPT_TOKEN_BUDGET
+    # Token counts are subadditive under concatenation, so summing parts is an upper bound
+    room = token_budget - count_prompt_tokens(prompt)
+    kept = []
+    for block in reversed(feedback):
+        tokens = count_prompt_tokens(block)
+        if tokens <= room:
+            kept.append(block)
+            room -= tokens
+            continue
+        if not kept:
+            lines = []
+            for line in block.split("\n"):
+                tokens = count_prompt_tokens(line)
+                if tokens > room:
+                    break
+                lines.append(line)
+                room -= tokens
+            kept.append("\n".join(lines))
+        break
+    return prompt + "".join(reversed(kept))
+
+
+_PROMPT_TEMPLATE = """Generate a conflict-free timetable for DIVISION {division}.
+Department: {department}, Semester {semester}. Working days (in grid order): {days}. Periods 1-{periods_per_day} per day.
+
+SUBJECTS (code type periods/week lecturer[|alternatives]):
+{subjects}
+
+FREE-SLOT GRIDS: one string per working day, character i = period i, 1 = free, 0 = busy or unavailable.
+LECTURERS:
+{lecturers}
+ROOMS:
+{rooms}
+
+CONSTRAINTS:
+1. NO DOUBLE BOOKING: only use a lecturer or room in a period where its grid bit is 1.
+2. Labs: 2 consecutive periods on the same day in a Lab room (e.g. Period 1-2, 3-4, 5-6); no isolated 1-hour Lab slot.
+3. Subject Load: exactly the listed periods/week for each subject.
+4. Theory subjects in Theory rooms; a lecturer must not exceed their max periods per day.
+5. DISTRIBUTION: spread subjects across the week; at most 2 periods of the same Theory subject per day unless unavoidable.
+6. Output slots ONLY for Division {division}.
+
+OUTPUT FORMAT (JSON ONLY, NO EXPLANATION):
+{{"slots": [{{"division": "{division}", "day": "Monday", "period": 1, "subject": "SUB1", "lecturer": "L1", "room": "R1", "type": "Theory"}}, ...]}}
+"""
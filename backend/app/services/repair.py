@@ -1,4 +1,7 @@
-from app.models.schemas import TimetableResponse, TimetableRequest, TimetableSlot
+from app.models.schemas import TimetableResponse, TimetableRequest
+from app.services.slots import Slot, to_internal_slots
+from app.services.problem import CompiledProblem
+from app.services.constraints import ScheduleState, RoomClash, TheoryDailyLimit, LecturerAvailability, LecturerDailyLoad, UserConstraints, ExternalBookings, request_rules
 import random
 
 def repair_timetable(timetable: TimetableResponse, request: TimetableRequest) -> TimetableResponse:
@@ -51,129 +54,152 @@ def repair_timetable(timetable: TimetableResponse, request: TimetableRequest) ->
     
     return timetable
 
-def resolve_sequential_conflicts(current_slots: list, occupied_slots: list, request: TimetableRequest) -> list:
+def _build_occupancy_map(slots: list) -> dict:
     """
-    Deterministically resolves conflicts between current_slots and occupied_slots
-    by moving conflicting slots to available free time slots.
+    Indexes slots by (Day, Period) -> {'lecturers': set(), 'rooms': set()}
+    so resource checks are a dict lookup instead of a scan.
     """
-    if not current_slots:
-        return current_slots
+    occupancy_map = {}
+    for slot in slots:
+        _mark_occupied(occupancy_map, slot.day, slot.period, slot)
+    return occupancy_map
+
+
+def _mark_occupied(occupancy_map: dict, day: str, period: int, slot) -> None:
+    key = (day, period)
+    if key not in occupancy_map:
+        occupancy_map[key] = {'lecturers': set(), 'rooms': set()}
+    occupancy_map[key]['lecturers'].add(slot.lecturer)
+    occupancy_map[key]['rooms'].add(slot.room)
 
-    # 1. Map Occupied Resources for fast lookup
-    # Key: (Day, Period) -> {'lecturers': set(), 'rooms': set()}
-    occupied_map = {}
-    for slot in occupied_slots:
-        key = (slot.day, slot.period)
-        if key not in occupied_map:
-            occupied_map[key] = {'lecturers': set(), 'rooms': set()}
-        occupied_map[key]['lecturers'].add(slot.lecturer)
-        occupied_map[key]['rooms'].add(slot.room)
-
-    # 2. Helpers
+
+def _is_busy(occupancy_map: dict, day: str, period: int, slot) -> bool:
+    entry = occupancy_map.get((day, period))
+    if entry is None:
+        return False
+    return slot.lecturer in entry['lecturers'] or slot.room in entry['rooms']
+
+
+def _resolve_with_occupancy(current_slots: list, occupied_map: dict, request: TimetableRequest) -> list:
+    """
+    Core of resolve_sequential_conflicts. Checks each slot against the global
+    occupancy map and an internal map of already-resolved slots, relocating
+    conflicting slots to the first free (day, period).
+    """
     working_days = request.metadata.working_days
     periods = range(1, request.metadata.periods_per_day + 1)
-    
+
+    # Key: (Day, Period) -> {'lecturers': set(), 'rooms': set()} for slots resolved so far
+    internal_map = {}
     resolved_slots = []
-    
+
     for slot in current_slots:
-        # Check for conflict
-        key = (slot.day, slot.period)
-        conflict = False
-        
-        # A. Check against Occupied (Global)
-        if key in occupied_map:
-            if slot.lecturer in occupied_map[key]['lecturers'] or slot.room in occupied_map[key]['rooms']:
-                conflict = True
-                
-        # B. Check against ALREADY PROCESSED current slots (Internal)
-        for processed in resolved_slots:
-            if processed.day == slot.day and processed.period == slot.period:
-                if processed.lecturer == slot.lecturer or processed.room == slot.room:
-                    conflict = True
-                    
-        if not conflict:
+        # A. Check against Occupied (Global)  B. Check against ALREADY PROCESSED current slots (Internal)
+        if not _is_busy(occupied_map, slot.day, slot.period, slot) and not _is_busy(internal_map, slot.day, slot.period, slot):
+            _mark_occupied(internal_map, slot.day, slot.period, slot)
             resolved_slots.append(slot)
             continue
-            
+
         # CONFLICT DETECTED! Find a new spot.
-        # print(f"Conflict detected for {slot.division} {slot.subject} ({slot.day} P{slot.period}). Finding new slot...")
-        
         moved = False
         for day in working_days:
             if moved: break
             for p in periods:
-                new_key = (day, p)
-                
-                # Check Global Occupied
-                is_global_busy = False
-                if new_key in occupied_map:
-                    if slot.lecturer in occupied_map[new_key]['lecturers'] or slot.room in occupied_map[new_key]['rooms']:
-                        is_global_busy = True
-                if is_global_busy: continue
-                
-                # Check Internal (Already Resolved)
-                is_internal_busy = False
-                for processed in resolved_slots:
-                    if processed.day == day and processed.period == p:
-                         # Strictly avoid reusing same slot for same division if possible, or at least resource check
-                         if processed.lecturer == slot.lecturer or processed.room == slot.room:
-                            is_internal_busy = True
-                if is_internal_busy: continue
-                
+                if _is_busy(occupied_map, day, p, slot) or _is_busy(internal_map, day, p, slot):
+                    continue
+
                 # Success! Move here.
                 slot.day = day
                 slot.period = p
-                resolved_slots.append(slot)
                 moved = True
-                # print(f"  -> Moved to {day} P{p}")
                 break
-        
-        if not moved:
-            # print(f"  -> CRITICAL: Could not find free slot for {slot.subject}!")
-            resolved_slots.append(slot)
-            
+
+        _mark_occupied(internal_map, slot.day, slot.period, slot)
+        resolved_slots.append(slot)
+
     return resolved_slots
 
 
-def optimize_distribution(current_slots: list, occupied_slots: list, request: TimetableRequest) -> list:
+def resolve_sequential_conflicts(current_slots: list, occupied_slots: list, request: TimetableRequest) -> list:
+    """
+    Deterministically resolves conflicts between current_slots and occupied_slots
+    by moving conflicting slots to available free time slots.
+    """
+    if not current_slots:
+        return current_slots
+
+    return _resolve_with_occupancy(current_slots, _build_occupancy_map(occupied_slots), request)
+
+
+def optimize_distribution(current_slots: list, occupied_slots: list, request: TimetableRequest, problem: CompiledProblem = None) -> list:
     """
     Heuristic optimization to spread subjects across the week.
     Objective: Avoid >2 periods of same Theory subject per day.
     Method: Move overloaded slots to empty valid slots, or swap with other subjects.
     """
     if not current_slots: return current_slots
+    current_slots = to_internal_slots(current_slots)
+
+    problem = problem or CompiledProblem(request)
+    state = ScheduleState(request, list(occupied_slots) + current_slots, problem)
+    return _optimize_with_state(current_slots, _build_occupancy_map(occupied_slots), state, request_rules(request), problem)
 
-    working_days = request.metadata.working_days
-    periods = range(1, request.metadata.periods_per_day + 1)
+
+def _optimize_with_state(current_slots: list, occupied_map: dict, state: ScheduleState, rules: list, problem: CompiledProblem) -> list:
+    """
+    Core of optimize_distribution. occupied_map indexes the other divisions'
+    slots; state holds those and current_slots, and is kept in step with every move.
+    """
+    working_days = problem.working_days
+    periods = range(1, problem.periods_per_day + 1)
 
     # 1. Build rapid lookup maps
-    occupied_map = {}
-    for slot in occupied_slots:
-        key = (slot.day, slot.period)
-        if key not in occupied_map: occupied_map[key] = {'lecturers': set(), 'rooms': set()}
-        occupied_map[key]['lecturers'].add(slot.lecturer)
-        occupied_map[key]['rooms'].add(slot.room)
-
-    # Helper to check if a slot (day, period) is valid for a specific subject/lecturer/room
-    def is_slot_valid(day, period, subject_slot, current_slots_state):
+    # Key: (Day, Period) -> Number of this division's slots there
+    positions = {}
+    for s in current_slots:
+        positions[(s.day, s.period)] = positions.get((s.day, s.period), 0) + 1
+
+    # Helper to check if a slot (day, period) is free of other resources' bookings and of this division's other slots
+    def is_slot_valid(day, period, subject_slot):
         # 1. Check Global
         key = (day, period)
         if key in occupied_map:
             if subject_slot.lecturer in occupied_map[key]['lecturers'] or subject_slot.room in occupied_map[key]['rooms']:
                 return False
-        
-        # 2. Check Internal (against other slots in current_slots_state)
-        # We need to ensure no OTHER slot in current_slots_state is using this resource at (day, period)
-        # AND no other slot is at (day, period) if we assume single-batch division.
-        for s in current_slots_state:
-            if s is subject_slot: continue # Don't check against self
-            if s.day == day and s.period == period:
-                return False # Slot taken by another subject in this division
-            
-            # If we allowed multi-batch, we'd check resources:
-            # if s.day == day and s.period == period and (s.lecturer == subject_slot.lecturer or s.room == subject_slot.room): return False
-            
-        return True
+        # 2. Check Internal: no OTHER slot of this division at (day, period)
+        own = 1 if (subject_slot.day, subject_slot.period) == key else 0
+        return positions.get(key, 0) - own == 0
+
+    # Lecturer availability, daily workload, the request's DSL constraints and its
+    # blocked calendar (a moved slot keeps its room) come from the shared hard rules,
+    # checked against one ScheduleState of every slot; probes lift the moving slots
+    # out and are rolled back
+    lecturer_rules = [rule for rule in rules if isinstance(rule, (LecturerAvailability, LecturerDailyLoad, UserConstraints, ExternalBookings))]
+
+    def fits_lecturer_rules(moves):
+        """moves: [(slot, day, period)] checked together against the state without those slots."""
+        state.begin()
+        try:
+            for slot, _, _ in moves:
+                state.remove(slot)
+            for slot, day, period in moves:
+                probe = slot.copy(day=day, period=period)
+                if not state.allows([probe], lecturer_rules):
+                    return False
+                state.add(probe)
+            return True
+        finally:
+            state.rollback()
+
+    def apply(moves):
+        """Moves [(slot, day, period)] together, keeping the state and positions in step."""
+        for slot, _, _ in moves:
+            state.remove(slot)
+            positions[(slot.day, slot.period)] -= 1
+        for slot, day, period in moves:
+            slot.day, slot.period = day, period
+            positions[(day, period)] = positions.get((day, period), 0) + 1
+            state.add(slot)
 
     # 2. Iterate to fix overloads
     # We do a few passes
@@ -210,10 +236,9 @@ def optimize_distribution(current_slots: list, occupied_slots: list, request: Ti
             for day in target_days:
                 if moved: break
                 for p in periods:
-                    if is_slot_valid(day, p, slot, current_slots):
+                    if is_slot_valid(day, p, slot) and fits_lecturer_rules([(slot, day, p)]):
                         # Move!
-                        slot.day = day
-                        slot.period = p
+                        apply([(slot, day, p)])
                         day_counts[origin_day][slot.subject] -= 1
                         day_counts[day][slot.subject] = day_counts[day].get(slot.subject, 0) + 1
                         moved = True
@@ -248,11 +273,11 @@ def optimize_distribution(current_slots: list, occupied_slots: list, request: Ti
                                 swap_conflict = True
                                 
                         if not slot_conflict and not swap_conflict:
+                            if not fits_lecturer_rules([(slot, target_day, target_period), (swap_slot, origin_day, origin_period)]):
+                                continue
+
                             # Swap positions!
-                            slot.day = target_day
-                            slot.period = target_period
-                            swap_slot.day = origin_day
-                            swap_slot.period = origin_period
+                            apply([(slot, target_day, target_period), (swap_slot, origin_day, origin_period)])
                             
                             day_counts[origin_day][slot.subject] -= 1
                             day_counts[target_day][slot.subject] = day_counts[target_day].get(slot.subject, 0) + 1
@@ -271,7 +296,8 @@ def repair_division_slots_full(
     division_slots: list,
     all_generated_slots: list,
     request: TimetableRequest,
-    division_name: str
+    division_name: str,
+    problem: CompiledProblem = None
 ) -> list:
     """
     Deterministically repairs the generated slots for a division to ensure:
@@ -280,25 +306,78 @@ def repair_division_slots_full(
     3. No room double-booking.
     4. Lecturer is available on the scheduled days.
     5. At most 2 periods of a Theory subject per day (distribution constraint).
+    6. Lecturer max_periods_per_day and Lab periods in consecutive pairs.
+    Rules 2-6 are the shared hard constraints from app/services/constraints.py.
+    The request is not modified: a subject without an assigned lecturer gets
+    its first eligible one on the returned slots only (see apply_lecturer_assignments).
+    """
+    problem = problem or CompiledProblem(request)
+    state = ScheduleState(request, all_generated_slots, problem)
+    return _repair_with_state(division_slots, state, _build_occupancy_map(all_generated_slots), request_rules(request), request, division_name, problem)
+
+
+def repair_divisions_batch(slots_per_division: dict, occupied_slots: list, request: TimetableRequest, problem: CompiledProblem = None) -> dict:
+    """
+    Repairs many divisions' slot lists in one pass, as repair_division_slots_full
+    would one after another: every division is checked against the request_rules
+    registry and each repaired division becomes occupied state for the ones after
+    it. The ScheduleState and occupancy map are built once and updated in place
+    instead of being rebuilt from all earlier slots per division.
+    slots_per_division maps division name -> slots (empty to schedule from scratch);
+    returns division name -> repaired slots, in the same order.
+    """
+    problem = problem or CompiledProblem(request)
+    state = ScheduleState(request, occupied_slots, problem)
+    occupied_map = _build_occupancy_map(occupied_slots)
+    rules = request_rules(request)
+
+    repaired_per_division = {}
+    for division_name, division_slots in slots_per_division.items():
+        repaired = _repair_with_state(division_slots, state, occupied_map, rules, request, division_name, problem)
+        # Repair leaves the division's slots in the state; index them for the divisions after it
+        for slot in repaired:
+            _mark_occupied(occupied_map, slot.day, slot.period, slot)
+        repaired_per_division[division_name] = repaired
+
+    return repaired_per_division
+
+
+def _repair_with_state(
+    division_slots: list,
+    state: ScheduleState,
+    occupied_map: dict,
+    rules: list,
+    request: TimetableRequest,
+    division_name: str,
+    problem: CompiledProblem
+) -> list:
+    """
+    Core of repair_division_slots_full. state and occupied_map hold the slots
+    already placed; the repaired slots are added to state (not to occupied_map).
     """
     # 1. Find division
     div = next((d for d in request.divisions if d.name == division_name), None)
     if not div:
         return division_slots
 
-    # Pre-sanitize subject lecturers to ensure NO subject has an empty or null assigned_lecturer_id
+    # Lecturer per subject, filling in subjects without an assigned_lecturer_id
+    # (the request is left untouched: it shares the CompiledProblem)
+    lecturer_of = {}
     for sub in div.subjects:
-        if not sub.assigned_lecturer_id:
-            eligible = [l for l in request.lecturers if sub.code in l.subjects or sub.name in l.subjects]
+        if sub.assigned_lecturer_id:
+            lecturer_of[sub.code] = sub.assigned_lecturer_id
+        else:
+            eligible = problem.eligible_lecturers.get((div.name, sub.code))
             if eligible:
-                sub.assigned_lecturer_id = eligible[0].id
+                lecturer_of[sub.code] = eligible[0]
             elif request.lecturers:
-                sub.assigned_lecturer_id = request.lecturers[0].id
+                lecturer_of[sub.code] = request.lecturers[0].id
             else:
-                sub.assigned_lecturer_id = "TBD"
+                lecturer_of[sub.code] = "TBD"
 
     # Map subjects by code
     subjects_by_code = {s.code: s for s in div.subjects}
+    division_slots = to_internal_slots(division_slots)
     
     # 2. Filter out invalid slots and skip Lab slots (so Labs are always scheduled in consecutive pairs)
     cleaned_slots = []
@@ -328,127 +407,76 @@ def repair_division_slots_full(
 
     cleaned_slots = retained_slots
 
-    # Let's map lecturers availability
-    lecturers_by_id = {l.id: l for l in request.lecturers}
-
-    # Helper function to get busy maps
-    def get_busy_maps(current_slots):
-        busy_lecturers = set()
-        busy_rooms = set()
-        for slot in all_generated_slots:
-            busy_lecturers.add((slot.day, slot.period, slot.lecturer))
-            busy_rooms.add((slot.day, slot.period, slot.room))
-        for slot in current_slots:
-            busy_lecturers.add((slot.day, slot.period, slot.lecturer))
-            busy_rooms.add((slot.day, slot.period, slot.room))
-        return busy_lecturers, busy_rooms
-
-    # Helper to check if a day/period is completely free for this division
-    def get_division_occupied(current_slots):
-        return {(slot.day, slot.period) for slot in current_slots}
+    # Shared hard-rule state (see app/services/constraints.py): every other division's
+    # slots plus this division's slots as they are accepted
+    room_rules = [rule for rule in rules if isinstance(rule, (RoomClash, ExternalBookings))]
+    slot_rules = [rule for rule in rules if not isinstance(rule, RoomClash)]
+    # Theory distribution is preferred while searching, but relaxed if nothing fits
+    relaxed_slot_rules = [rule for rule in slot_rules if not isinstance(rule, TheoryDailyLimit)]
+
+    def make_probe(subject_code, day="", period=0, room=""):
+        sub = subjects_by_code[subject_code]
+        return Slot(
+            division=division_name, day=day, period=period, subject=subject_code,
+            lecturer=lecturer_of[subject_code], room=room, type=sub.type
+        )
+
+    # Helper to find a free room of the right type for a block placed at fixed times
+    def find_free_room(block, expected_room_type):
+        original_rooms = [probe.room for probe in block]
+        for room in problem.rooms_by_type.get(expected_room_type, []):
+            for probe in block:
+                probe.room = room.id
+            if state.allows(block, room_rules):
+                return room.id
+        for probe, room_id in zip(block, original_rooms):
+            probe.room = room_id
+        return None
 
     # Helper to find a free slot for a subject
-    def find_free_slot(subject_code, current_slots, exclude_slot=None, strict_dist=True):
+    def find_free_slot(subject_code, strict_dist=True):
         sub = subjects_by_code[subject_code]
-        lecturer_id = sub.assigned_lecturer_id
-        lect = lecturers_by_id.get(lecturer_id)
         
         # Determine target room type
         expected_room_type = "Lab" if sub.type == "Lab" else "Classroom"
-        
-        # Build busy maps excluding the current slot if we are moving it
-        slots_to_consider = [s for s in current_slots if s is not exclude_slot]
-        busy_lecturers, busy_rooms = get_busy_maps(slots_to_consider)
-        division_occupied = get_division_occupied(slots_to_consider)
+        rules = slot_rules if strict_dist else relaxed_slot_rules
 
-        working_days = request.metadata.working_days
-        periods = list(range(1, request.metadata.periods_per_day + 1))
-        
-        # Sort days by how few times this subject is scheduled on them (distribution)
-        day_sub_counts = {day: 0 for day in working_days}
-        for s in slots_to_consider:
-            if s.subject == subject_code:
-                day_sub_counts[s.day] += 1
+        working_days = problem.working_days
+        periods = range(1, problem.periods_per_day + 1)
+        probe = make_probe(subject_code)
 
-        # We try to search days. If strict_dist, we only consider days with counts < 2 for Theory.
         for day in working_days:
-            # Check lecturer availability
-            if lect and day not in lect.available_days:
-                continue
-            
-            # Check Theory distribution count
-            if strict_dist and sub.type == "Theory" and day_sub_counts[day] >= 2:
-                continue
-
             for period in periods:
-                if (day, period) in division_occupied:
-                    continue
-                
-                # Check lecturer conflict
-                if (day, period, lecturer_id) in busy_lecturers:
+                probe.day, probe.period = day, period
+                # Division overlap, lecturer double-booking/availability/daily load, distribution
+                if not state.allows([probe], rules):
                     continue
                 
                 # Find an available room of correct type
-                available_room = None
-                for room in request.classrooms:
-                    if room.type != expected_room_type or room.status != "Available":
-                        continue
-                    if (day, period, room.id) not in busy_rooms:
-                        available_room = room.id
-                        break
-                
+                available_room = find_free_room([probe], expected_room_type)
                 if available_room:
                     return day, period, available_room
                     
         # If we failed with strict distribution, try without it
         if strict_dist and sub.type == "Theory":
-            return find_free_slot(subject_code, current_slots, exclude_slot, strict_dist=False)
+            return find_free_slot(subject_code, strict_dist=False)
             
         return None
 
-    def find_free_consecutive_lab_slots(subject_code, current_slots):
-        sub = subjects_by_code[subject_code]
-        lecturer_id = sub.assigned_lecturer_id
-        lect = lecturers_by_id.get(lecturer_id)
-        
-        busy_lecturers, busy_rooms = get_busy_maps(current_slots)
-        division_occupied = get_division_occupied(current_slots)
-        
-        working_days = request.metadata.working_days
-        # Search pairs: 1-2, 3-4, 5-6, 6-7 (avoiding single hour labs)
-        for day in working_days:
-            if lect and day not in lect.available_days:
-                continue
-                
-            # Iterate pairs of periods (e.g. 1-2, 3-4, 5-6, 6-7)
-            periods_count = request.metadata.periods_per_day
-            pairs = []
-            for p in range(1, periods_count, 2):
-                if p + 1 <= periods_count:
-                    pairs.append((p, p + 1))
-            # If periods count is odd (like 7), let's also allow scheduling in the last two periods (6-7)
-            if periods_count % 2 != 0 and periods_count >= 2:
-                if (periods_count - 1, periods_count) not in pairs:
-                    pairs.append((periods_count - 1, periods_count))
-
-            for p1, p2 in pairs:
-                # Check division occupied for both slots
-                if (day, p1) in division_occupied or (day, p2) in division_occupied:
-                    continue
-                    
-                # Check lecturer conflict for both slots
-                if (day, p1, lecturer_id) in busy_lecturers or (day, p2, lecturer_id) in busy_lecturers:
+    def find_free_consecutive_lab_slots(subject_code):
+        probes = [make_probe(subject_code), make_probe(subject_code)]
+
+        # Search the lab windows: 1-2, 3-4, 5-6, 6-7 (avoiding single hour labs)
+        for day in problem.working_days:
+            for p1, p2 in problem.lab_windows:
+                probes[0].day, probes[0].period = day, p1
+                probes[1].day, probes[1].period = day, p2
+                # Both periods must pass the hard rules as one block
+                if not state.allows(probes, slot_rules):
                     continue
                     
                 # Find a room of type "Lab" free for both periods
-                available_room = None
-                for room in request.classrooms:
-                    if room.type != "Lab" or room.status != "Available":
-                        continue
-                    if (day, p1, room.id) not in busy_rooms and (day, p2, room.id) not in busy_rooms:
-                        available_room = room.id
-                        break
-                        
+                available_room = find_free_room(probes, "Lab")
                 if available_room:
                     return day, p1, p2, available_room
         return None
@@ -457,63 +485,39 @@ def repair_division_slots_full(
     resolved_slots = []
     for slot in cleaned_slots:
         sub = subjects_by_code[slot.subject]
-        lecturer_id = sub.assigned_lecturer_id
-        lect = lecturers_by_id.get(lecturer_id)
+        lecturer_id = lecturer_of[slot.subject]
         
         # Re-verify/enforce correct lecturer in slot just in case the LLM assigned wrong lecturer
         slot.lecturer = lecturer_id
         
-        # Check conflicts
-        busy_lecturers, busy_rooms = get_busy_maps(resolved_slots)
-        division_occupied = get_division_occupied(resolved_slots)
-        
         has_conflict = False
         
-        # A. Check division overlap
-        if (slot.day, slot.period) in division_occupied:
+        # A. Check metadata ranges
+        if slot.day not in problem.day_ids or slot.period < 1 or slot.period > problem.periods_per_day:
             has_conflict = True
-        # B. Check lecturer double-booking
-        elif (slot.day, slot.period, lecturer_id) in busy_lecturers:
+        # B. Check division overlap, lecturer double-booking/availability/daily load, distribution
+        elif not state.allows([slot], slot_rules):
             has_conflict = True
         # C. Check room double-booking
-        elif (slot.day, slot.period, slot.room) in busy_rooms:
+        elif not state.allows([slot], room_rules):
             # Can we fix this room booking by just changing the room?
             expected_room_type = "Lab" if sub.type == "Lab" else "Classroom"
-            new_room = None
-            for room in request.classrooms:
-                if room.type != expected_room_type or room.status != "Available":
-                    continue
-                if (slot.day, slot.period, room.id) not in busy_rooms:
-                    new_room = room.id
-                    break
-            if new_room:
-                slot.room = new_room
-            else:
+            if not find_free_room([slot], expected_room_type):
                 has_conflict = True
-        # D. Check lecturer available day
-        elif lect and slot.day not in lect.available_days:
-            has_conflict = True
-            
-        # E. Check metadata ranges
-        elif slot.day not in request.metadata.working_days or slot.period < 1 or slot.period > request.metadata.periods_per_day:
-            has_conflict = True
             
-        if not has_conflict:
-            resolved_slots.append(slot)
-        else:
+        if has_conflict:
             # Relocate slot!
-            new_pos = find_free_slot(slot.subject, resolved_slots, exclude_slot=slot)
+            new_pos = find_free_slot(slot.subject)
             if new_pos:
                 slot.day, slot.period, slot.room = new_pos
-                resolved_slots.append(slot)
             else:
                 # If we couldn't relocate, keep it to preserve period counts, but try to fix room
                 expected_room_type = "Lab" if sub.type == "Lab" else "Classroom"
-                for room in request.classrooms:
-                    if room.type == expected_room_type and room.status == "Available":
-                        slot.room = room.id
-                        break
-                resolved_slots.append(slot)
+                rooms = problem.rooms_by_type.get(expected_room_type)
+                if rooms:
+                    slot.room = rooms[0].id
+        resolved_slots.append(slot)
+        state.add(slot)
 
     # 5. Fill deficits (missing periods) - prioritize Lab subjects first to find consecutive slots
     sorted_subject_codes = sorted(deficits.keys(), key=lambda code: 0 if subjects_by_code[code].type == "Lab" else 1)
@@ -525,28 +529,30 @@ def repair_division_slots_full(
         if sub.type == "Lab":
             # Schedule in pairs of 2 consecutive periods (2 hours)
             while deficit >= 2:
-                pair = find_free_consecutive_lab_slots(subject_code, resolved_slots)
+                pair = find_free_consecutive_lab_slots(subject_code)
                 if pair:
                     day, p1, p2, room_id = pair
-                    slot1 = TimetableSlot(
+                    slot1 = Slot(
                         division=division_name,
                         day=day,
                         period=p1,
                         subject=subject_code,
-                        lecturer=sub.assigned_lecturer_id,
+                        lecturer=lecturer_of[subject_code],
                         room=room_id,
                         type="Lab"
                     )
-                    slot2 = TimetableSlot(
+                    slot2 = Slot(
                         division=division_name,
                         day=day,
                         period=p2,
                         subject=subject_code,
-                        lecturer=sub.assigned_lecturer_id,
+                        lecturer=lecturer_of[subject_code],
                         room=room_id,
                         type="Lab"
                     )
                     resolved_slots.extend([slot1, slot2])
+                    state.add(slot1)
+                    state.add(slot2)
                     deficit -= 2
                     print(f"Scheduled Lab {subject_code} consecutively on {day} periods {p1}-{p2} in room {room_id}")
                 else:
@@ -555,39 +561,41 @@ def repair_division_slots_full(
             
             # Fallback for remaining odd deficit periods
             for _ in range(deficit):
-                new_pos = find_free_slot(subject_code, resolved_slots)
+                new_pos = find_free_slot(subject_code)
                 if new_pos:
                     day, period, room_id = new_pos
-                    new_slot = TimetableSlot(
+                    new_slot = Slot(
                         division=division_name,
                         day=day,
                         period=period,
                         subject=subject_code,
-                        lecturer=sub.assigned_lecturer_id,
+                        lecturer=lecturer_of[subject_code],
                         room=room_id,
                         type="Lab"
                     )
                     resolved_slots.append(new_slot)
+                    state.add(new_slot)
                     print(f"Scheduled fallback single Lab {subject_code} on {day} period {period}")
         else:
             # Theory subjects: schedule singly
             for _ in range(deficit):
-                new_pos = find_free_slot(subject_code, resolved_slots)
+                new_pos = find_free_slot(subject_code)
                 if new_pos:
                     day, period, room_id = new_pos
-                    new_slot = TimetableSlot(
+                    new_slot = Slot(
                         division=division_name,
                         day=day,
                         period=period,
                         subject=subject_code,
-                        lecturer=sub.assigned_lecturer_id,
+                        lecturer=lecturer_of[subject_code],
                         room=room_id,
                         type="Theory"
                     )
                     resolved_slots.append(new_slot)
+                    state.add(new_slot)
 
     # 6. Optimize distribution to balance the slots
-    resolved_slots = optimize_distribution(resolved_slots, all_generated_slots, request)
+    resolved_slots = _optimize_with_state(resolved_slots, occupied_map, state, rules, problem)
 
     return resolved_slots
 
@@ -0,0 +1,63 @@
+from app.models.schemas import TimetableRequest, Division, TimetableSlot
+from app.services.prompt_builder import subject_lecturers
+
+
+def build_division_slot_schema(request: TimetableRequest, division: Division) -> dict:
+    """
+    JSON schema for one division's `{"slots": [...]}` reply, derived from
+    TimetableSlot and narrowed with enums: the division name, working days,
+    period range, and per subject its type, eligible lecturers and rooms of
+    the matching type. Backends with structured output use it to constrain
+    decoding, so replies always parse and reference known resources.
+    """
+    base = TimetableSlot.model_json_schema()
+    rooms = [r for r in request.classrooms if r.status == "Available"]
+    lab_rooms = [r.id for r in rooms if r.type == "Lab"]
+    theory_rooms = [r.id for r in rooms if r.type != "Lab"]
+
+    common = {
+        "division": {"type": "string", "enum": [division.name]},
+        "day": {"type": "string", "enum": list(request.metadata.working_days)},
+        "period": {"type": "integer", "minimum": 1, "maximum": request.metadata.periods_per_day},
+    }
+
+    variants = []
+    for subject in division.subjects:
+        is_lab = subject.type == "Lab" or subject.lab_requirement
+        slot_type = "Lab" if is_lab else "Theory"
+        room_ids = (lab_rooms if is_lab else theory_rooms) or [r.id for r in rooms]
+        lecturer_ids = subject_lecturers(request, subject)
+
+        properties = dict(common)
+        properties["subject"] = {"type": "string", "enum": [subject.code]}
+        properties["lecturer"] = {"type": "string", "enum": lecturer_ids} if lecturer_ids else {"type": "string"}
+        properties["room"] = {"type": "string", "enum": room_ids} if room_ids else {"type": "string"}
+        properties["type"] = {"type": "string", "enum": [slot_type]}
+        variants.append({
+            "type": "object",
+            "properties": {name: properties[name] for name in base["properties"]},
+            "required": list(base["required"]),
+            "additionalProperties": False,
+        })
+
+    total_periods = sum(s.periods_per_week for s in division.subjects)
+    return {
+        "type": "object",
+        "properties": {
+            "slots": {
+                "type": "array",
+                "items": {"anyOf": variants} if len(variants) > 1 else (variants[0] if variants else {"type": "object"}),
+                "maxItems": total_periods,
+            }
+        },
+        "required": ["slots"],
+        "additionalProperties": False,
+    }
+
+
+def json_schema_response_format(schema: dict, name: str = "division_timetable") -> dict:
+    """OpenAI-style `response_format` accepted by HF chat_completion and OpenAI-compatible servers."""
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": name, "schema": schema, "strict": True},
+    }
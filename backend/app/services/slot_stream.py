@@ -0,0 +1,138 @@
+import json
+from typing import List, Optional
+from pydantic import ValidationError
+from app.models.schemas import TimetableRequest, TimetableSlot
+from app.services.constraints import ScheduleState, request_rules
+from app.services.problem import CompiledProblem
+from app.services.slots import Slot
+
+
+class SlotStreamParser:
+    """
+    Incremental parser for a streamed `{"slots": [...]}` reply.
+    Text is fed chunk by chunk; every slot object is returned as soon as its
+    closing brace arrives, so a malformed tail no longer discards the slots
+    before it. Code fences and chatter around the JSON are skipped.
+    feed() returns parsed dicts, with None for an object that is not valid JSON.
+    `key=None` streams the objects of a top-level JSON array instead.
+    """
+
+    def __init__(self, key: Optional[str] = "slots"):
+        self.key = key
+        self._buffer = ""
+        self._pos = 0
+        self._in_array = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._object_start = None
+        self.done = False
+
+    def feed(self, text: str) -> List[Optional[dict]]:
+        if self.done or not text:
+            return []
+        self._buffer += text
+        objects = []
+
+        if not self._in_array:
+            key = self._buffer.find(f'"{self.key}"') if self.key is not None else 0
+            if key == -1:
+                return objects
+            bracket = self._buffer.find('[', key)
+            if bracket == -1:
+                return objects
+            self._in_array = True
+            self._pos = bracket + 1
+
+        buffer = self._buffer
+        i = self._pos
+        while i < len(buffer):
+            char = buffer[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == '\\':
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char == '{':
+                if self._depth == 0:
+                    self._object_start = i
+                self._depth += 1
+            elif char == '}' and self._depth > 0:
+                self._depth -= 1
+                if self._depth == 0:
+                    try:
+                        objects.append(json.loads(buffer[self._object_start:i + 1]))
+                    except ValueError:
+                        objects.append(None)
+                    self._object_start = None
+            elif char == ']' and self._depth == 0:
+                self.done = True
+                break
+            i += 1
+
+        # Keep only the unfinished object in the buffer
+        keep_from = self._object_start if self._object_start is not None else i
+        self._buffer = buffer[keep_from:]
+        self._pos = i - keep_from
+        if self._object_start is not None:
+            self._object_start = 0
+        return objects
+
+
+class StreamingSlotChecker:
+    """
+    Checks slots for one division as they stream in, against the occupancy of
+    every accepted slot plus the ones it has already let through (see
+    ScheduleState). Returns an error string for a rejected slot, None otherwise.
+    Lab contiguity is left to repair, since a single Lab period cannot be judged
+    until its pair arrives.
+    """
+
+    def __init__(self, request: TimetableRequest, accepted_slots: list, division_name: str, problem: CompiledProblem = None):
+        self.request = request
+        self.division_name = division_name
+        self.rules = request_rules(request)
+        self.state = ScheduleState(request, accepted_slots, problem)
+        division = next((d for d in request.divisions if d.name == division_name), None)
+        self.required = {s.code: s.periods_per_week for s in division.subjects} if division else {}
+        self.placed = {}
+        self.working_days = set(request.metadata.working_days)
+        self.slots = []
+        self.rejected = []
+
+    def check(self, raw) -> Optional[str]:
+        if not isinstance(raw, dict):
+            return self._reject(raw, "Malformed slot JSON")
+        try:
+            # LLM output is untrusted: validated once here, then kept as an internal Slot
+            slot = Slot.coerce(TimetableSlot(**raw))
+        except ValidationError as e:
+            return self._reject(raw, f"Malformed slot: {e.errors()[0]['msg']}")
+
+        if slot.division != self.division_name:
+            return self._reject(raw, f"Slot for Div {slot.division}, expected Div {self.division_name}")
+        if slot.subject not in self.required:
+            return self._reject(raw, f"Unknown subject {slot.subject} for Div {self.division_name}")
+        if slot.day not in self.working_days:
+            return self._reject(raw, f"Invalid day '{slot.day}' in slot for {slot.subject}")
+        if slot.period < 1 or slot.period > self.request.metadata.periods_per_day:
+            return self._reject(raw, f"Invalid period {slot.period} in slot for {slot.subject}")
+        if self.placed.get(slot.subject, 0) >= self.required[slot.subject]:
+            return self._reject(raw, f"Div {self.division_name}: Subject {slot.subject} exceeds {self.required[slot.subject]} periods")
+
+        errors = self.state.violations([slot], self.rules)
+        if errors:
+            return self._reject(raw, errors[0])
+
+        self.state.add(slot)
+        self.placed[slot.subject] = self.placed.get(slot.subject, 0) + 1
+        self.slots.append(slot)
+        return None
+
+    def _reject(self, raw, error: str) -> str:
+        self.rejected.append({"slot": raw, "error": error})
+        return error
@@ -0,0 +1,61 @@
+from typing import Iterable, List
+from app.models.schemas import TimetableSlot
+
+SLOT_FIELDS = ("division", "day", "period", "subject", "lecturer", "room", "type")
+
+
+class Slot:
+    """
+    Internal, unvalidated timetable slot used by the solver, repair and
+    validators. Same attributes as TimetableSlot, but a plain __slots__ object:
+    trusted internal data skips Pydantic validation, and conversion happens
+    only at the API boundary (see to_api_slots).
+    """
+
+    __slots__ = SLOT_FIELDS
+
+    def __init__(self, division: str, day: str, period: int, subject: str, lecturer: str, room: str, type: str):
+        self.division = division
+        self.day = day
+        self.period = period
+        self.subject = subject
+        self.lecturer = lecturer
+        self.room = room
+        self.type = type
+
+    @classmethod
+    def coerce(cls, slot) -> "Slot":
+        """From a Slot (returned as-is), a TimetableSlot or a dict."""
+        if isinstance(slot, Slot):
+            return slot
+        if isinstance(slot, dict):
+            return cls(**{field: slot[field] for field in SLOT_FIELDS})
+        return cls(*(getattr(slot, field) for field in SLOT_FIELDS))
+
+    def copy(self, **changes) -> "Slot":
+        values = {field: getattr(self, field) for field in SLOT_FIELDS}
+        values.update(changes)
+        return Slot(**values)
+
+    def to_dict(self) -> dict:
+        return {field: getattr(self, field) for field in SLOT_FIELDS}
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Slot):
+            return NotImplemented
+        return all(getattr(self, field) == getattr(other, field) for field in SLOT_FIELDS)
+
+    def __repr__(self) -> str:
+        return f"Slot({self.division}, {self.day} P{self.period}, {self.subject}, {self.lecturer}, {self.room}, {self.type})"
+
+
+def to_internal_slots(slots: Iterable) -> List[Slot]:
+    return [Slot.coerce(slot) for slot in slots]
+
+
+def to_api_slots(slots: Iterable) -> List[TimetableSlot]:
+    """TimetableSlots for a response, built without re-validating trusted slots."""
+    return [
+        slot if isinstance(slot, TimetableSlot) else TimetableSlot.model_construct(**Slot.coerce(slot).to_dict())
+        for slot in slots
+    ]
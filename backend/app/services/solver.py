@@ -1,43 +1,58 @@
+import time
 import uuid
 from typing import List, Dict, Any
 from ortools.sat.python import cp_model
-from app.models.schemas import TimetableRequest, TimetableSlot, Classroom
+from app.models.schemas import TimetableRequest
+from app.services.slots import Slot
+from app.services.constraints import SolverContext, request_rules
+from app.core.config import settings
+from app.services.problem import CompiledProblem
+from app.services.deadline import Deadline
 
-def schedule_with_ortools(request: TimetableRequest) -> dict:
+class _FirstSolutionTimer(cp_model.CpSolverSolutionCallback):
+    """Records the solver wall time of the first feasible solution."""
+
+    def __init__(self):
+        super().__init__()
+        self.first_solution_seconds = None
+
+    def on_solution_callback(self):
+        if self.first_solution_seconds is None:
+            self.first_solution_seconds = self.WallTime()
+
+
+def schedule_with_ortools(request: TimetableRequest, time_limit: float = None, deadline: Deadline = None, booked_slots: list = None, joint_lecturers: bool = None, problem: CompiledProblem = None) -> dict:
     """
     Schedules the timetable using Google OR-Tools CP-SAT Solver.
     Guarantees conflict-free allocations matching all hard constraints.
+    `time_limit` caps the search (default SOLVER_TIME_LIMIT_SECONDS); cancelling
+    `deadline` stops it. A search stopped by either before it found a solution
+    or proved there is none returns status CANCELLED (deadline cancelled) or
+    TIMEOUT; INFEASIBLE is only returned for a proven infeasibility.
+    `booked_slots` are lecturer/room bookings made outside this request, e.g.
+    by other departments in a batch; like request.blocked they are applied
+    by ExternalBookings.
+    `joint_lecturers` (default SOLVER_JOINT_LECTURER_ASSIGNMENT) lets the
+    solver pick the lecturer of each unassigned subject among its eligible
+    lecturers; the picks are returned as `lecturer_assignments`.
+    Once the model is solved, results carry `stats`: model size, build and
+    solve times, time to the first feasible solution, objective, best bound and gap.
     """
+    started = time.monotonic()
     model = cp_model.CpModel()
     
-    # 1. Parse Metadata & Setup Indices
-    working_days = request.metadata.working_days
+    # 1. Parse Metadata & Setup Indices: rooms (labs merged in), lecturer
+    # availability and eligibility are compiled once per request
+    problem = problem or CompiledProblem(request)
+    working_days = problem.working_days
     num_days = len(working_days)
-    periods_per_day = request.metadata.periods_per_day
+    periods_per_day = problem.periods_per_day
     
     # Setup lookup helpers
-    day_to_idx = {day: idx for idx, day in enumerate(working_days)}
-    idx_to_day = {idx: day for idx, day in enumerate(working_days)}
+    day_to_idx = problem.day_ids
+    idx_to_day = dict(enumerate(working_days))
     
-    # Merge labs into classrooms pool if provided (matching route behavior)
-    all_rooms = list(request.classrooms)
-    if request.labs:
-        for lab in request.labs:
-            if not any(c.id == lab.id for c in all_rooms):
-                all_rooms.append(
-                    Classroom(
-                        id=lab.id,
-                        name=lab.name,
-                        capacity=lab.capacity,
-                        building=lab.department,
-                        floor=0,
-                        type="Lab",
-                        status=lab.status
-                    )
-                )
-    
-    # Filter active rooms
-    available_rooms = [r for r in all_rooms if r.status == "Available"]
+    available_rooms = problem.available_rooms
     if not available_rooms:
         return {"status": "INFEASIBLE", "error": "No available classrooms or laboratories in the resource pool."}
 
@@ -46,57 +61,51 @@ def schedule_with_ortools(request: TimetableRequest) -> dict:
     blocks = []
     block_counter = 0
     
+    # Subjects without an assigned lecturer either take the first eligible one or,
+    # in joint mode, get one copy of their blocks per eligible lecturer; a choice
+    # variable per (division, subject) activates exactly one lecturer's copies
+    joint = settings.SOLVER_JOINT_LECTURER_ASSIGNMENT if joint_lecturers is None else joint_lecturers
+    lecturer_choices = {}  # (division, subject code) -> {lecturer id: choice var}
+
     for div_idx, div in enumerate(request.divisions):
         for sub_idx, sub in enumerate(div.subjects):
             # Find assigned lecturer
             lecturer_id = sub.assigned_lecturer_id
+            options = [(lecturer_id, None)]
             if not lecturer_id or lecturer_id == "None":
                 # Find eligible lecturer from staff pool
-                eligible = [l.id for l in request.lecturers if sub.code in l.subjects or sub.name in l.subjects]
-                lecturer_id = eligible[0] if eligible else "TBD"
-                
+                eligible = problem.eligible_lecturers[div.name, sub.code]
+                if joint and len(eligible) > 1:
+                    choices = {lec_id: model.NewBoolVar(f"teach_{div.name}_{sub.code}_{lec_id}") for lec_id in eligible}
+                    model.AddExactlyOne(choices.values())
+                    lecturer_choices[div.name, sub.code] = choices
+                    options = list(choices.items())
+                else:
+                    options = [(eligible[0] if eligible else "TBD", None)]
+
             periods_needed = sub.periods_per_week
             is_lab = (sub.type == "Lab" or sub.lab_requirement)
-            
-            # Divide into blocks
+
+            # Divide into blocks: labs as double periods (plus a single for an odd count)
             if is_lab and periods_needed >= 2:
-                # Group as double-period slots
-                num_doubles = periods_needed // 2
-                num_singles = periods_needed % 2
-                
-                for _ in range(num_doubles):
-                    blocks.append({
-                        "id": block_counter,
-                        "division": div.name,
-                        "subject": sub.code,
-                        "lecturer": lecturer_id,
-                        "type": "Lab",
-                        "duration": 2,
-                        "sub_obj": sub
-                    })
-                    block_counter += 1
-                for _ in range(num_singles):
-                    blocks.append({
-                        "id": block_counter,
-                        "division": div.name,
-                        "subject": sub.code,
-                        "lecturer": lecturer_id,
-                        "type": "Lab",
-                        "duration": 1,
-                        "sub_obj": sub
-                    })
-                    block_counter += 1
+                durations = [2] * (periods_needed // 2) + [1] * (periods_needed % 2)
             else:
-                for _ in range(periods_needed):
-                    blocks.append({
+                durations = [1] * periods_needed
+            for alternative, (lecturer_id, choice) in enumerate(options):
+                for duration in durations:
+                    block = {
                         "id": block_counter,
                         "division": div.name,
                         "subject": sub.code,
                         "lecturer": lecturer_id,
-                        "type": sub.type,
-                        "duration": 1,
+                        "type": "Lab" if is_lab and periods_needed >= 2 else sub.type,
+                        "duration": duration,
                         "sub_obj": sub
-                    })
+                    }
+                    if choice is not None:
+                        block["choice"] = choice
+                        block["alternative"] = alternative
+                    blocks.append(block)
                     block_counter += 1
 
     if not blocks:
@@ -104,142 +113,83 @@ def schedule_with_ortools(request: TimetableRequest) -> dict:
 
     # 3. Create Decision Variables
     # x[b, d, p, r] = 1 if block b starts on day d at period p in room r
-    x = {}
-    
-    # Map rooms by type for constraints
-    lab_rooms = [r for r in available_rooms if r.type == "Lab"]
-    classrooms = [r for r in available_rooms if r.type == "Classroom"]
-    
-    # Map lecturer objects
-    lec_map = {l.id: l for l in request.lecturers}
+    # Shared hard rules plus the request's DSL constraints (TimetableRequest.constraints)
+    # and its blocked calendar; blocked lecturer/room cells never get a variable
+    rules = request_rules(request, booked_slots)
+    ctx = SolverContext(model, request, blocks, rules, problem)
+    x = ctx.x
     
     for b in blocks:
         b_id = b["id"]
-        is_lab = (b["type"] == "Lab")
         duration = b["duration"]
-        lec_id = b["lecturer"]
-        lec = lec_map.get(lec_id)
         
-        # Room candidates
-        if is_lab:
-            room_candidates = lab_rooms if lab_rooms else available_rooms
-        else:
-            room_candidates = classrooms if classrooms else available_rooms
+        # Room candidates of the block's type (any available room if there are none)
+        room_candidates = problem.room_candidates("Lab" if b["type"] == "Lab" else "Classroom")
             
         for d_idx, day in enumerate(working_days):
-            # Check lecturer availability for this day
-            if lec and day not in lec.available_days:
-                continue # Lecturer is unavailable on this day
-                
             # Period range: starting period must fit the block duration
             for p in range(1, periods_per_day - duration + 2):
+                # Prune starts ruled out by hard constraints (e.g. lecturer unavailable on this day)
+                if not ctx.allows_start(b, d_idx, p):
+                    continue
                 for r in room_candidates:
+                    if not ctx.allows_room(b, d_idx, p, r.id):
+                        continue
                     var_name = f"x_b{b_id}_d{d_idx}_p{p}_r{r.id}"
                     x[(b_id, d_idx, p, r.id)] = model.NewBoolVar(var_name)
 
     # 4. Enforce Hard Constraints
     
-    # A. Each block must be scheduled exactly once
+    # A. Each block must be scheduled exactly once (a lecturer's copy of a
+    # block: exactly once if that lecturer is chosen, otherwise not at all)
+    block_vars = {b["id"]: [] for b in blocks}
+    for key, var in x.items():
+        block_vars[key[0]].append(var)
+    unschedulable = set()
     for b in blocks:
-        b_id = b["id"]
-        variables = [v for key, v in x.items() if key[0] == b_id]
-        if not variables:
+        variables = block_vars[b["id"]]
+        if "choice" in b:
+            if variables:
+                model.Add(sum(variables) == b["choice"])
+            else:
+                model.Add(b["choice"] == 0)
+                unschedulable.add((b["division"], b["subject"], b["lecturer"]))
+        elif not variables:
+            unschedulable.add((b["division"], b["subject"], b["lecturer"]))
+    for (div_name, sub_code, lec_id) in unschedulable:
+        choices = lecturer_choices.get((div_name, sub_code))
+        if choices is None or all((div_name, sub_code, other) in unschedulable for other in choices):
             return {
                 "status": "INFEASIBLE",
-                "error": f"Cannot schedule subject {b['subject']} for Div {b['division']}. No valid days, periods, or rooms match its lecturer availability/room requirements."
+                "error": f"Cannot schedule subject {sub_code} for Div {div_name}. No valid days, periods, or rooms match its lecturer availability/room requirements."
             }
-        model.Add(sum(variables) == 1)
-        
-    # Helper to check if a block b occupies period p on day d in room r
-    # b occupies (d, p, r) if it starts at (d, p, r) OR (for duration 2) it starts at (d, p-1, r)
-    def get_occupancy_vars_for_slot(d_idx: int, p: int, room_id: str = None, division: str = None, lecturer: str = None):
-        occupying = []
-        for (b_id, d_val, p_start, r_val), var in x.items():
-            if d_val != d_idx:
-                continue
-            
-            # Check duration overlap
-            b_obj = blocks[b_id]
-            dur = b_obj["duration"]
-            is_overlapping = False
-            if p_start == p:
-                is_overlapping = True
-            elif dur == 2 and p_start == p - 1:
-                is_overlapping = True
-                
-            if not is_overlapping:
-                continue
-                
-            # Filter matches
-            if room_id and r_val != room_id:
-                continue
-            if division and b_obj["division"] != division:
-                continue
-            if lecturer and b_obj["lecturer"] != lecturer:
-                continue
-                
-            occupying.append(var)
-        return occupying
-
-    # B. Division Double-booking: At most one lesson per division per (day, period)
-    for div in request.divisions:
-        for d_idx in range(num_days):
-            for p in range(1, periods_per_day + 1):
-                occupying_vars = get_occupancy_vars_for_slot(d_idx, p, division=div.name)
-                if occupying_vars:
-                    model.Add(sum(occupying_vars) <= 1)
-
-    # C. Lecturer Double-booking: At most one class per lecturer per (day, period)
-    for lec in request.lecturers:
-        for d_idx in range(num_days):
-            for p in range(1, periods_per_day + 1):
-                occupying_vars = get_occupancy_vars_for_slot(d_idx, p, lecturer=lec.id)
-                if occupying_vars:
-                    model.Add(sum(occupying_vars) <= 1)
-
-    # D. Room Double-booking: At most one class per room per (day, period)
-    for room in available_rooms:
-        for d_idx in range(num_days):
-            for p in range(1, periods_per_day + 1):
-                occupying_vars = get_occupancy_vars_for_slot(d_idx, p, room_id=room.id)
-                if occupying_vars:
-                    model.Add(sum(occupying_vars) <= 1)
-
-    # E. Lecturer Workload limit per day
-    for lec in request.lecturers:
-        for d_idx in range(num_days):
-            # Sum of block_duration * x_start
-            day_vars = []
-            for (b_id, d_val, p_start, r_val), var in x.items():
-                if d_val == d_idx and blocks[b_id]["lecturer"] == lec.id:
-                    day_vars.append(var * blocks[b_id]["duration"])
-            if day_vars:
-                model.Add(sum(day_vars) <= lec.max_periods_per_day)
+    for b in blocks:
+        if "choice" not in b:
+            model.AddExactlyOne(block_vars[b["id"]])
 
-    # F. Subject Daily Limit: Max 2 periods per day for any Theory subject per division
-    for div in request.divisions:
-        for sub in div.subjects:
-            if sub.type == "Theory":
-                for d_idx in range(num_days):
-                    sub_day_vars = []
-                    for (b_id, d_val, p_start, r_val), var in x.items():
-                        b_obj = blocks[b_id]
-                        if d_val == d_idx and b_obj["division"] == div.name and b_obj["subject"] == sub.code:
-                            sub_day_vars.append(var * b_obj["duration"])
-                    if sub_day_vars:
-                        model.Add(sum(sub_day_vars) <= 2)
+    # B-F. Shared hard rules: division/lecturer/room double-booking, lecturer daily
+    # workload, Theory subject daily limit (see app/services/constraints.py)
+    ctx.index_variables()
+    for rule in ctx.rules:
+        rule.encode(ctx)
 
     # 5. Optimize Schedule (Soft Constraints / Preferences)
     # We want to minimize "gaps" in the daily teaching schedules of lecturers.
     # A gap is an idle period between the lecturer's first and last teaching period on a day.
     gap_penalties = []
     
+    # Key: (Lecturer, Day idx, Period) -> vars of blocks occupying that cell
+    lecturer_occupancy = {}
+    for (d_idx, p), entries in ctx.occupancy.items():
+        for block, room_id, var in entries:
+            lecturer_occupancy.setdefault((block["lecturer"], d_idx, p), []).append(var)
+    
     for lec in request.lecturers:
         for d_idx in range(num_days):
             # Create busy indicators for each period
             busy = {}
             for p in range(1, periods_per_day + 1):
-                occupying_vars = get_occupancy_vars_for_slot(d_idx, p, lecturer=lec.id)
+                occupying_vars = lecturer_occupancy.get((lec.id, d_idx, p), [])
                 is_busy = model.NewBoolVar(f"busy_lec_{lec.id}_d{d_idx}_p{p}")
                 if occupying_vars:
                     model.Add(is_busy == sum(occupying_vars))
@@ -267,14 +217,49 @@ def schedule_with_ortools(request: TimetableRequest) -> dict:
 
     # 6. Run CP-SAT Solver
     solver = cp_model.CpSolver()
-    solver.parameters.max_time_in_seconds = 15.0  # Safe timeout for Render instances
+    time_limit = time_limit if time_limit is not None else settings.SOLVER_TIME_LIMIT_SECONDS
+    if deadline is not None:
+        # Model building above also ate into the deadline
+        time_limit = deadline.clamp(time_limit)
+        if time_limit <= 0:
+            return {"status": "CANCELLED" if deadline.cancelled else "TIMEOUT"}
+    solver.parameters.max_time_in_seconds = time_limit
     
+    build_seconds = time.monotonic() - started
+    timer = _FirstSolutionTimer()
     print("Solving CP-SAT Timetable Constraint model...")
-    status = solver.Solve(model)
+    unregister = deadline.on_cancel(solver.StopSearch) if deadline is not None else None
+    try:
+        status = solver.Solve(model, timer)
+    finally:
+        if unregister is not None:
+            unregister()
     print(f"CP-SAT Solver Finished. Status: {solver.StatusName(status)}")
-    
-    if status in (cp_model.OPTIMAL, cp_model.FEASIBLE):
-        # Translate decisions back to TimetableSlots
+
+    found = status in (cp_model.OPTIMAL, cp_model.FEASIBLE)
+    objective = solver.ObjectiveValue() if found and gap_penalties else None
+    best_bound = solver.BestObjectiveBound() if found and gap_penalties else None
+    stats = {
+        "solver_status": solver.StatusName(status),
+        "variables": len(model.Proto().variables),
+        "constraints": len(model.Proto().constraints),
+        "build_seconds": round(build_seconds, 4),
+        "solve_seconds": round(solver.WallTime(), 4),
+        "first_solution_seconds": round(timer.first_solution_seconds, 4) if timer.first_solution_seconds is not None else None,
+        "objective": objective,
+        "best_bound": best_bound,
+        # Relative gap between the objective and the best bound (0 when proven optimal)
+        "gap": round((objective - best_bound) / max(1.0, abs(objective)), 4) if objective is not None else None,
+    }
+
+    if status == cp_model.UNKNOWN:
+        # Stopped by the time limit or the deadline before finding a solution or
+        # proving there is none: not evidence of infeasibility
+        cancelled = deadline is not None and deadline.cancelled
+        return {"status": "CANCELLED" if cancelled else "TIMEOUT", "stats": stats}
+
+    if found:
+        # Translate decisions back to internal Slots (converted to TimetableSlot only at the API boundary)
         slots_out = []
         for (b_id, d_idx, p_start, r_id), var in x.items():
             if solver.BooleanValue(var):
@@ -284,24 +269,29 @@ def schedule_with_ortools(request: TimetableRequest) -> dict:
                 
                 # Add individual slot entries (e.g. double blocks get split into 2 consecutive slots for db/frontend compatibility)
                 for step in range(duration):
-                    slots_out.append({
-                        "division": b_obj["division"],
-                        "day": day_name,
-                        "period": p_start + step,
-                        "subject": b_obj["subject"],
-                        "lecturer": b_obj["lecturer"],
-                        "room": r_id,
-                        "type": b_obj["type"]
-                    })
+                    slots_out.append(Slot(
+                        division=b_obj["division"],
+                        day=day_name,
+                        period=p_start + step,
+                        subject=b_obj["subject"],
+                        lecturer=b_obj["lecturer"],
+                        room=r_id,
+                        type=b_obj["type"]
+                    ))
         
         # Sort output for clean display
-        slots_out.sort(key=lambda s: (s["division"], day_to_idx[s["day"]], s["period"]))
-        return {"status": "SUCCESS", "slots": slots_out}
+        slots_out.sort(key=lambda s: (s.division, day_to_idx[s.day], s.period))
+        lecturer_assignments = [
+            {"division": div_name, "subject": sub_code, "lecturer": lec_id}
+            for (div_name, sub_code), choices in lecturer_choices.items()
+            for lec_id, choice in choices.items() if solver.BooleanValue(choice)
+        ]
+        return {"status": "SUCCESS", "slots": slots_out, "lecturer_assignments": lecturer_assignments, "stats": stats}
         
     else:
         # Generate conflict diagnostics to help explain infeasibility
         diagnostics = generate_infeasibility_diagnostics(request, blocks, available_rooms)
-        return {"status": "INFEASIBLE", "conflicts": diagnostics}
+        return {"status": "INFEASIBLE", "conflicts": diagnostics, "stats": stats}
 
 
 def generate_infeasibility_diagnostics(request: TimetableRequest, blocks: list, rooms: list) -> List[str]:
@@ -310,9 +300,13 @@ def generate_infeasibility_diagnostics(request: TimetableRequest, blocks: list,
     Helps the LLM explain to the user exactly why scheduling failed.
     """
     clashes = []
+    # Subjects whose lecturer the solver chooses have one copy of their blocks
+    # per eligible lecturer: count the demand once and no lecturer's load
+    required = [b for b in blocks if b.get("alternative", 0) == 0]
+    fixed = [b for b in blocks if "choice" not in b]
     
     # 1. Total requested periods vs total classroom capacity
-    total_slots_requested = sum(b["duration"] for b in blocks)
+    total_slots_requested = sum(b["duration"] for b in required)
     total_capacity = len(rooms) * len(request.metadata.working_days) * request.metadata.periods_per_day
     if total_slots_requested > total_capacity:
         clashes.append(
@@ -322,7 +316,7 @@ def generate_infeasibility_diagnostics(request: TimetableRequest, blocks: list,
     # 2. Check for over-allocated lecturers (total teaching periods exceed available slots)
     max_weekly_slots = len(request.metadata.working_days) * request.metadata.periods_per_day
     for lec in request.lecturers:
-        lec_periods = sum(b["duration"] for b in blocks if b["lecturer"] == lec.id)
+        lec_periods = sum(b["duration"] for b in fixed if b["lecturer"] == lec.id)
         if lec_periods > lec.max_periods_per_week:
             clashes.append(
                 f"Lecturer {lec.name} ({lec.id}) is over-assigned: Needs to teach {lec_periods} periods, but max workload is {lec.max_periods_per_week}."
@@ -333,7 +327,7 @@ def generate_infeasibility_diagnostics(request: TimetableRequest, blocks: list,
             )
             
     # 3. Check for specific room type deficits
-    lab_blocks = [b for b in blocks if b["type"] == "Lab"]
+    lab_blocks = [b for b in required if b["type"] == "Lab"]
     lab_rooms = [r for r in rooms if r.type == "Lab"]
     if lab_blocks and not lab_rooms:
         clashes.append("Missing Lab rooms: You have Lab subjects scheduled, but there are no laboratories (type 'Lab') available.")
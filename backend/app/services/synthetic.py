@@ -0,0 +1,131 @@
+"""
+Seeded synthetic TimetableRequests for benchmarks and load tests. The same
+parameters and seed always give the same request. Instances are built to be
+feasible in aggregate (lecturer, room and division capacity cover the demand),
+so their difficulty comes from the shape parameters rather than from
+impossible inputs; very dense or sparse settings can still be infeasible.
+"""
+import math
+import random
+from typing import List
+from app.models.schemas import TimetableRequest, TimetableMetadata, Division, Subject, Lecturer, Classroom
+
+ALL_DAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday"]
+LECTURER_MAX_PER_DAY = 4
+LECTURER_MAX_PER_WEEK = 18
+# Share of a lecturer's / room's weekly periods the generator plans to use
+TARGET_UTILISATION = 0.8
+
+
+def _subject_periods(rng: random.Random, num_subjects: int, lab_flags: List[bool], target: int, max_theory: int) -> List[int]:
+    """Splits a division's weekly periods over its subjects: labs in pairs, Theory within the daily limit."""
+    periods = []
+    remaining = target
+    for idx, is_lab in enumerate(lab_flags):
+        share = max(1, round(remaining / (num_subjects - idx)))
+        if is_lab:
+            count = max(2, min(4, share - share % 2))
+        else:
+            count = max(1, min(max_theory, share + rng.choice([-1, 0, 0, 1])))
+        periods.append(count)
+        remaining = max(0, remaining - count)
+    return periods
+
+
+def synthetic_request(
+    seed: int = 0,
+    divisions: int = 4,
+    subjects: int = 6,
+    lecturers: int = None,
+    classrooms: int = None,
+    labs: int = None,
+    lab_share: float = 0.2,
+    availability: float = 1.0,
+    load_density: float = 0.7,
+    working_days: int = 5,
+    periods_per_day: int = 7,
+    unassigned_share: float = 0.0,
+) -> TimetableRequest:
+    """
+    A TimetableRequest with `divisions` divisions taking the same `subjects`
+    subjects (a `lab_share` of them Labs). Each division fills about
+    `load_density` of its weekly periods. `availability` is the share of
+    working days each lecturer is available (never fewer than their load needs).
+    Lecturer and room counts default to what the demand needs at
+    TARGET_UTILISATION. A `unassigned_share` of subjects is left without an
+    assigned lecturer for the solver to choose among those listing it.
+    """
+    rng = random.Random(seed)
+    days = ALL_DAYS[:working_days]
+    week = working_days * periods_per_day
+
+    lab_flags = [rng.random() < lab_share for _ in range(subjects)]
+    if lab_share > 0 and not any(lab_flags):
+        lab_flags[rng.randrange(subjects)] = True
+    periods = _subject_periods(rng, subjects, lab_flags, round(load_density * week), 2 * working_days)
+    subject_specs = [
+        {"code": f"SUB-{idx + 1:03d}", "name": f"Subject {idx + 1}", "lab": lab_flags[idx], "periods": periods[idx]}
+        for idx in range(subjects)
+    ]
+
+    # Lecturers: enough weekly capacity for the demand, each teaching a few subjects
+    demand = divisions * sum(periods)
+    num_lecturers = lecturers or max(1, math.ceil(demand / (LECTURER_MAX_PER_WEEK * TARGET_UTILISATION)))
+    lecturer_ids = [f"LEC-{idx + 1:03d}" for idx in range(num_lecturers)]
+    load = {lec_id: 0 for lec_id in lecturer_ids}
+    teaches = {lec_id: set() for lec_id in lecturer_ids}
+
+    division_list = []
+    for div_idx in range(divisions):
+        div_subjects = []
+        for spec in subject_specs:
+            # Least loaded lecturer, preferring one who already teaches the subject
+            lec_id = min(lecturer_ids, key=lambda l: (load[l] + spec["periods"] > LECTURER_MAX_PER_WEEK, spec["code"] not in teaches[l], load[l], rng.random()))
+            load[lec_id] += spec["periods"]
+            teaches[lec_id].add(spec["code"])
+            assigned = None if rng.random() < unassigned_share else lec_id
+            div_subjects.append(Subject(
+                code=spec["code"],
+                name=spec["name"],
+                type="Lab" if spec["lab"] else "Theory",
+                periods_per_week=spec["periods"],
+                assigned_lecturer_id=assigned,
+                lab_requirement=spec["lab"]
+            ))
+        division_list.append(Division(name=f"Div {div_idx + 1}", strength=60, subjects=div_subjects))
+
+    lecturer_list = []
+    for lec_id in lecturer_ids:
+        needed_days = math.ceil(load[lec_id] / LECTURER_MAX_PER_DAY)
+        available = max(1, needed_days, round(availability * working_days))
+        available_days = sorted(rng.sample(days, min(available, working_days)), key=days.index)
+        lecturer_list.append(Lecturer(
+            id=lec_id,
+            name=f"Lecturer {lec_id[4:]}",
+            subjects=sorted(teaches[lec_id]),
+            max_periods_per_day=LECTURER_MAX_PER_DAY,
+            max_periods_per_week=max(LECTURER_MAX_PER_WEEK, load[lec_id]),
+            available_days=available_days
+        ))
+
+    # Rooms: enough periods for each room type's demand
+    lab_demand = divisions * sum(spec["periods"] for spec in subject_specs if spec["lab"])
+    theory_demand = demand - lab_demand
+    num_classrooms = classrooms or max(1, math.ceil(theory_demand / (week * TARGET_UTILISATION)))
+    num_labs = labs if labs is not None else (math.ceil(lab_demand / (week * TARGET_UTILISATION)) if lab_demand else 0)
+    rooms = [Classroom(id=f"CR-{idx + 1:03d}", name=f"Room {idx + 1}", capacity=60) for idx in range(num_classrooms)]
+    rooms += [Classroom(id=f"LB-{idx + 1:03d}", name=f"Lab {idx + 1}", capacity=60, type="Lab") for idx in range(num_labs)]
+
+    return TimetableRequest(
+        metadata=TimetableMetadata(
+            institution_name="Synthetic College",
+            department="Benchmark",
+            semester=1,
+            academic_year="2026",
+            working_days=days,
+            periods_per_day=periods_per_day
+        ),
+        divisions=division_list,
+        lecturers=lecturer_list,
+        classrooms=rooms
+    )
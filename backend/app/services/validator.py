@@ -1,29 +1,13 @@
 from app.models.schemas import TimetableResponse, TimetableRequest
+from app.services.constraints import ScheduleState, replay_constraint_errors, request_rules
+from app.services.problem import CompiledProblem
 
-def validate_timetable(timetable: TimetableResponse, request: TimetableRequest, specific_divisions: list[str] = None) -> dict:
-    errors = []
-    
-    # 1. Check for GLOBAL lecturer conflicts (across all divisions)
-    lecturer_schedule = {}
-    for slot in timetable.slots:
-        # Key: (Day, Period, Lecturer) -> must be unique globally
-        key = (slot.day, slot.period, slot.lecturer)
-        if key in lecturer_schedule:
-            prev_slot = lecturer_schedule[key]
-            errors.append(f"Lecturer {slot.lecturer} double-booked on {slot.day} P{slot.period} (Div {slot.division} & Div {prev_slot.division})")
-        lecturer_schedule[key] = slot
-
-    # 2. Check for GLOBAL room conflicts
-    room_schedule = {}
-    for slot in timetable.slots:
-        # Key: (Day, Period, Room) -> must be unique globally
-        key = (slot.day, slot.period, slot.room)
-        if key in room_schedule:
-            prev_slot = room_schedule[key]
-            errors.append(f"Room {slot.room} double-booked on {slot.day} P{slot.period} (Div {slot.division} & Div {prev_slot.division})")
-        room_schedule[key] = slot
-
-    # 3. Check Subject Period Counts PER DIVISION
+def validate_timetable(timetable: TimetableResponse, request: TimetableRequest, specific_divisions: list[str] = None, problem: CompiledProblem = None) -> dict:
+    # 1. Hard rules shared with the solver and repair (double-booking, availability,
+    #    daily lecturer load, Theory distribution, lab contiguity) plus the request's DSL constraints
+    errors = replay_constraint_errors(timetable.slots, request, request_rules(request), problem)
+
+    # 2. Check Subject Period Counts PER DIVISION
     # Map: Division -> Subject -> Count
     div_subject_counts = {d.name: {s.code: 0 for s in d.subjects} for d in request.divisions}
     
@@ -48,7 +32,7 @@ def validate_timetable(timetable: TimetableResponse, request: TimetableRequest,
             if count != subject.periods_per_week:
                 errors.append(f"Div {div.name}: Subject {subject.code} has {count} periods, expected {subject.periods_per_week}")
 
-    # 4. Check Metadata Validity (Days and Periods)
+    # 3. Check Metadata Validity (Days and Periods)
     valid_days = set(request.metadata.working_days)
     max_period = request.metadata.periods_per_day
     
@@ -58,22 +42,107 @@ def validate_timetable(timetable: TimetableResponse, request: TimetableRequest,
         if slot.period < 1 or slot.period > max_period:
             errors.append(f"Invalid period {slot.period} in slot for {slot.subject}")
 
-    # 5. Check Distribution (Max 2 periods per day for Theory)
-    # Map: Division -> Day -> Subject -> Count
-    div_day_counts = {}
-    for slot in timetable.slots:
-        if slot.type == 'Lab': continue # Labs can exceed 2 periods
-        
-        if slot.division not in div_day_counts: div_day_counts[slot.division] = {}
-        if slot.day not in div_day_counts[slot.division]: div_day_counts[slot.division][slot.day] = {}
-        
-        current = div_day_counts[slot.division][slot.day].get(slot.subject, 0)
-        div_day_counts[slot.division][slot.day][slot.subject] = current + 1
-        
-        if current + 1 > 2:
-            errors.append(f"Div {slot.division}: Subject {slot.subject} exceeds 2 periods on {slot.day}")
-
     return {
         "valid": len(errors) == 0,
         "errors": errors
     }
+
+
+class IncrementalValidator:
+    """
+    Stateful validator for the sequential per-division pipeline.
+    Holds the shared ScheduleState plus subject-count counters for accepted
+    slots, so each candidate division is validated as a delta.
+    Usage: validate_delta(candidate) -> commit() to accept, rollback() to discard.
+    """
+
+    def __init__(self, request: TimetableRequest, accepted_slots: list = None, problem: CompiledProblem = None):
+        self.request = request
+        self.valid_days = set(request.metadata.working_days)
+        self.max_period = request.metadata.periods_per_day
+        self.required_periods = {d.name: {s.code: s.periods_per_week for s in d.subjects} for d in request.divisions}
+
+        self.rules = request_rules(request)
+        self.state = ScheduleState(request, problem=problem)
+        # Key: (Division, Subject) -> Count
+        self.subject_counts = {}
+
+        self._pending_counts = None
+        if accepted_slots:
+            self.validate_delta(accepted_slots)
+            self.commit()
+
+    def validate_delta(self, slots: list, specific_divisions: list[str] = None) -> dict:
+        """
+        Validates candidate slots on top of the accepted state. The delta stays
+        pending until commit() or rollback(); a new call rolls back any pending delta.
+        Subject counts are checked for specific_divisions (default: divisions in the delta).
+        Returns the same {"valid", "errors"} shape as validate_timetable.
+        """
+        self.rollback()
+        self.state.begin()
+
+        errors_by_rule = [[] for _ in self.rules]
+        count_delta = {}
+        unknown_errors = []
+        metadata_errors = []
+
+        for slot in slots:
+            block = [slot]
+            for idx, rule in enumerate(self.rules):
+                error = rule.check(self.state, block)
+                if error:
+                    errors_by_rule[idx].append(error)
+            self.state.add(slot)
+
+            if slot.division in self.required_periods:
+                key = (slot.division, slot.subject)
+                count_delta[key] = count_delta.get(key, 0) + 1
+            else:
+                unknown_errors.append(f"Unknown division '{slot.division}' in slot")
+
+            if slot.day not in self.valid_days:
+                metadata_errors.append(f"Invalid day '{slot.day}' in slot for {slot.subject}")
+            if slot.period < 1 or slot.period > self.max_period:
+                metadata_errors.append(f"Invalid period {slot.period} in slot for {slot.subject}")
+
+        delta_divisions = {slot.division for slot in slots}
+        if specific_divisions is None:
+            specific_divisions = delta_divisions
+
+        errors = []
+        for idx, rule in enumerate(self.rules):
+            errors.extend(errors_by_rule[idx])
+            errors.extend(rule.finalize(self.state, divisions=delta_divisions))
+
+        count_errors = []
+        for div in self.request.divisions:
+            if div.name not in specific_divisions:
+                continue
+            for subject in div.subjects:
+                key = (div.name, subject.code)
+                count = self.subject_counts.get(key, 0) + count_delta.get(key, 0)
+                if count != subject.periods_per_week:
+                    count_errors.append(f"Div {div.name}: Subject {subject.code} has {count} periods, expected {subject.periods_per_week}")
+
+        self._pending_counts = count_delta
+
+        errors += unknown_errors + count_errors + metadata_errors
+        return {
+            "valid": len(errors) == 0,
+            "errors": errors
+        }
+
+    def commit(self) -> None:
+        """Accepts the last validated delta into the accepted state."""
+        if self._pending_counts is None:
+            return
+        self.state.commit()
+        for key, count in self._pending_counts.items():
+            self.subject_counts[key] = self.subject_counts.get(key, 0) + count
+        self._pending_counts = None
+
+    def rollback(self) -> None:
+        """Discards the last validated delta."""
+        self.state.rollback()
+        self._pending_counts = None
@@ -0,0 +1,218 @@
+"""
+Performance benchmark over seeded synthetic requests (app/services/synthetic.py).
+For each instance shape, seed and solver mode it records CP-SAT model build
+and solve time, time to the first feasible solution, objective, best bound
+and gap, plus heuristic repair and validator throughput, and writes them as
+JSON so runs can be compared.
+
+    python benchmark.py                                  # default suite -> benchmark-results.json
+    python benchmark.py --instances small,medium --seeds 1,2,3 --time-limit 5
+    python benchmark.py --modes joint,first_eligible --output modes.json
+    python benchmark.py --baseline benchmark-results.json   # exit 1 on regressions
+
+Modes: `joint` lets the solver choose lecturers for unassigned subjects,
+`first_eligible` gives each the first lecturer listing it (see
+SOLVER_JOINT_LECTURER_ASSIGNMENT).
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import ortools
+from app.models.schemas import TimetableResponse
+from app.services.columnar_validator import validate_timetable_columnar
+from app.services.problem import CompiledProblem
+from app.services.repair import repair_divisions_batch
+from app.services.slots import to_api_slots
+from app.services.solver import schedule_with_ortools
+from app.services.synthetic import synthetic_request
+from app.services.validator import validate_timetable
+
+# Instance shapes: keyword arguments for synthetic_request (seed comes from --seeds)
+INSTANCES = {
+    "small": {"divisions": 2, "subjects": 5, "load_density": 0.5},
+    "medium": {"divisions": 4, "subjects": 6, "load_density": 0.6},
+    "large": {"divisions": 8, "subjects": 7, "lab_share": 0.3, "load_density": 0.6},
+    "sparse": {"divisions": 4, "subjects": 6, "availability": 0.6, "load_density": 0.5},
+    "unassigned": {"divisions": 4, "subjects": 6, "load_density": 0.5, "unassigned_share": 0.3},
+}
+MODES = {"joint": True, "first_eligible": False}
+# Repair and validators repeat until this much time has passed, so small instances still measure
+MIN_MEASURE_SECONDS = 0.2
+# A metric regresses when it is this much worse than the baseline (and by more than the noise floor)
+REGRESSION_RATIO = 1.25
+NOISE_FLOOR_SECONDS = 0.05
+
+
+def _timed(fn, *args, **kwargs):
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+
+def _throughput(fn, slots: int) -> dict:
+    """Runs fn until MIN_MEASURE_SECONDS have passed; slots handled per second."""
+    rounds = 0
+    started = time.perf_counter()
+    while True:
+        fn()
+        rounds += 1
+        seconds = time.perf_counter() - started
+        if seconds >= MIN_MEASURE_SECONDS:
+            return {"rounds": rounds, "slots_per_second": round(slots * rounds / seconds, 1)}
+
+
+def _seconds(value) -> str:
+    return "-" if value is None else f"{value}s"
+
+
+def _heuristic_timetable(request, problem) -> list:
+    repaired = repair_divisions_batch({division.name: [] for division in request.divisions}, [], request, problem=problem)
+    return [slot for slots in repaired.values() for slot in slots]
+
+
+def run_case(instance: str, seed: int, mode: str, time_limit: float) -> dict:
+    request, generate_seconds = _timed(synthetic_request, seed=seed, **INSTANCES[instance])
+    problem, compile_seconds = _timed(CompiledProblem, request)
+    case = {
+        "instance": instance,
+        "params": INSTANCES[instance],
+        "seed": seed,
+        "mode": mode,
+        "size": {
+            "divisions": len(request.divisions),
+            "subjects": sum(len(d.subjects) for d in request.divisions),
+            "lecturers": len(request.lecturers),
+            "rooms": len(problem.rooms),
+            "periods": sum(s.periods_per_week for d in request.divisions for s in d.subjects),
+        },
+        "generate_seconds": round(generate_seconds, 4),
+        "compile_seconds": round(compile_seconds, 4),
+    }
+
+    # CP-SAT: build and solve times come from the solver's own stats
+    result, wall_seconds = _timed(
+        schedule_with_ortools, request, time_limit, joint_lecturers=MODES[mode], problem=problem
+    )
+    case["solver"] = {
+        "status": result["status"],
+        **result.get("stats", {}),
+        "wall_seconds": round(wall_seconds, 4),
+        "slots": len(result.get("slots", [])),
+    }
+
+    # Heuristic scheduler (repair from scratch, division by division), on a copy
+    # so the unassigned subjects it fills in do not leak into the next stage
+    heuristic_request = request.model_copy(deep=True)
+    heuristic_problem = CompiledProblem(heuristic_request)
+    heuristic_slots, repair_seconds = _timed(_heuristic_timetable, heuristic_request, heuristic_problem)
+    case["repair"] = {
+        "seconds": round(repair_seconds, 4),
+        "slots": len(heuristic_slots),
+        **_throughput(lambda: _heuristic_timetable(heuristic_request, heuristic_problem), len(heuristic_slots)),
+        "valid": validate_timetable_columnar(heuristic_slots, heuristic_request).valid,
+    }
+
+    # Validators on the solver's timetable (the heuristic one when the solver found none)
+    slots = result.get("slots") or heuristic_slots
+    validation_request = request if result.get("slots") else heuristic_request
+    timetable = TimetableResponse(
+        timetable_id="benchmark",
+        metadata=validation_request.metadata,
+        divisions=validation_request.divisions,
+        lecturers=validation_request.lecturers,
+        classrooms=validation_request.classrooms,
+        slots=to_api_slots(slots)
+    )
+    validation_problem = CompiledProblem(validation_request)
+    full = _throughput(lambda: validate_timetable(timetable, validation_request, problem=validation_problem), len(slots))
+    columnar = _throughput(lambda: validate_timetable_columnar(slots, validation_request, problem=validation_problem).errors, len(slots))
+    case["validator"] = {
+        "slots": len(slots),
+        "full_slots_per_second": full["slots_per_second"],
+        "columnar_slots_per_second": columnar["slots_per_second"],
+    }
+    return case
+
+
+def find_regressions(results: dict, baseline: dict) -> list:
+    """Cases slower or worse than the same (instance, seed, mode) in the baseline."""
+    previous = {(c["instance"], c["seed"], c["mode"]): c for c in baseline.get("cases", [])}
+    regressions = []
+    for case in results["cases"]:
+        key = (case["instance"], case["seed"], case["mode"])
+        old = previous.get(key)
+        if old is None:
+            continue
+        label = f"{case['instance']} seed={case['seed']} mode={case['mode']}"
+        if old["solver"]["status"] == "SUCCESS" and case["solver"]["status"] != "SUCCESS":
+            regressions.append(f"{label}: solver status {old['solver']['status']} -> {case['solver']['status']}")
+        for metric in ("build_seconds", "first_solution_seconds", "solve_seconds"):
+            before, after = old["solver"].get(metric), case["solver"].get(metric)
+            if before is not None and after is not None and after > before * REGRESSION_RATIO and after - before > NOISE_FLOOR_SECONDS:
+                regressions.append(f"{label}: {metric} {before}s -> {after}s")
+        before, after = old["solver"].get("objective"), case["solver"].get("objective")
+        if before is not None and after is not None and after > before:
+            regressions.append(f"{label}: objective {before} -> {after}")
+        for section, metric in (("repair", "slots_per_second"), ("validator", "full_slots_per_second"), ("validator", "columnar_slots_per_second")):
+            before, after = old[section].get(metric), case[section].get(metric)
+            if before and after and after * REGRESSION_RATIO < before:
+                regressions.append(f"{label}: {section} {metric} {before} -> {after}")
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--instances", default=",".join(INSTANCES), help=f"comma-separated, from: {', '.join(INSTANCES)}")
+    parser.add_argument("--seeds", default="1", help="comma-separated generator seeds")
+    parser.add_argument("--modes", default="joint", help=f"comma-separated, from: {', '.join(MODES)}")
+    parser.add_argument("--time-limit", type=float, default=10.0, help="CP-SAT time limit per case, seconds")
+    parser.add_argument("--output", default="benchmark-results.json")
+    parser.add_argument("--baseline", help="earlier results file to check for regressions")
+    args = parser.parse_args(argv)
+
+    instances = args.instances.split(",")
+    modes = args.modes.split(",")
+    unknown = [name for name in instances if name not in INSTANCES] + [name for name in modes if name not in MODES]
+    if unknown:
+        parser.error(f"unknown instance or mode: {', '.join(unknown)}")
+
+    results = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "ortools": ortools.__version__,
+        "time_limit": args.time_limit,
+        "cases": [],
+    }
+    for instance in instances:
+        for seed in (int(s) for s in args.seeds.split(",")):
+            for mode in modes:
+                case = run_case(instance, seed, mode, args.time_limit)
+                results["cases"].append(case)
+                solver = case["solver"]
+                print(
+                    f"{instance:>10} seed={seed} {mode:<14} {solver['status']:<10} build={_seconds(solver.get('build_seconds'))} "
+                    f"first={_seconds(solver.get('first_solution_seconds'))} solve={_seconds(solver.get('solve_seconds'))} "
+                    f"objective={solver.get('objective')} repair={case['repair']['slots_per_second']} slots/s "
+                    f"validate={case['validator']['columnar_slots_per_second']} slots/s"
+                )
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Wrote {len(results['cases'])} cases to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(results, json.load(f))
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
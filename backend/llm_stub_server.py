@@ -0,0 +1,198 @@
+"""
+Offline OpenAI/HuggingFace-compatible chat completion stub for load-testing the
+LLM path without network access.
+
+    STUB_PROFILE=ok STUB_LATENCY_SECONDS=0.5 uvicorn llm_stub_server:app --port 8081
+    LLM_BASE_URL=http://127.0.0.1:8081/v1 uvicorn app.main:app --port 8000
+
+Environment:
+- STUB_LATENCY_SECONDS / STUB_JITTER_SECONDS: delay before the first byte (seeded jitter).
+- STUB_CHUNK_DELAY_SECONDS: delay between streamed chunks.
+- STUB_PROFILE: ok | 402 | timeout | malformed | no_structured | mixed.
+  `mixed` picks a failure per request with STUB_ERROR_RATE (seeded by STUB_SEED).
+- STUB_MODEL_PROFILES: JSON object of model id -> profile, overriding STUB_PROFILE.
+- STUB_CANNED_FILE: JSON file with a canned reply (object or string) used instead of
+  the heuristic generator.
+"""
+import asyncio
+import json
+import os
+import random
+import re
+import time
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+LATENCY_SECONDS = float(os.getenv("STUB_LATENCY_SECONDS", "0.2"))
+JITTER_SECONDS = float(os.getenv("STUB_JITTER_SECONDS", "0.0"))
+CHUNK_DELAY_SECONDS = float(os.getenv("STUB_CHUNK_DELAY_SECONDS", "0.0"))
+PROFILE = os.getenv("STUB_PROFILE", "ok")
+MODEL_PROFILES = json.loads(os.getenv("STUB_MODEL_PROFILES", "{}"))
+ERROR_RATE = float(os.getenv("STUB_ERROR_RATE", "0.3"))
+CANNED_FILE = os.getenv("STUB_CANNED_FILE", "")
+TIMEOUT_SLEEP_SECONDS = 3600.0
+
+rng = random.Random(int(os.getenv("STUB_SEED", "42")))
+stats = {"requests": 0, "by_outcome": {}}
+
+app = FastAPI(title="LLM Stub Server")
+
+
+# ---------------- Heuristic replies ----------------
+
+def heuristic_timetable(prompt: str) -> dict:
+    """
+    Greedy slot placement read back from the compact division prompt
+    (see app/services/prompt_builder.py): subjects, lecturer and room free-slot grids.
+    """
+    division = re.search(r"DIVISION (\S+?)\.", prompt)
+    days = re.search(r"Working days \(in grid order\): (.+?)\. Periods 1-(\d+)", prompt)
+    if not division or not days:
+        return {"slots": []}
+    division = division.group(1)
+    working_days = [d.strip() for d in days.group(1).split(",")]
+    periods_per_day = int(days.group(2))
+
+    def grids(section: str) -> dict:
+        return {
+            m.group(1): {
+                (day, p + 1)
+                for day, bits in zip(working_days, m.group(2).split())
+                for p, bit in enumerate(bits) if bit == "1"
+            }
+            for m in re.finditer(r"^(\S+?)(?: max\d+/day)?: ([01 ]+)$", section, re.MULTILINE)
+        }
+
+    lecturer_section = prompt.split("LECTURERS:", 1)[-1].split("ROOMS:", 1)[0]
+    room_section = prompt.split("ROOMS:", 1)[-1].split("CONSTRAINTS:", 1)[0]
+    lecturer_free = grids(lecturer_section)
+    theory_rooms = grids(room_section.split("Lab rooms:", 1)[0])
+    lab_rooms = grids(room_section.split("Lab rooms:", 1)[1]) if "Lab rooms:" in room_section else theory_rooms
+
+    slots = []
+    division_busy = set()
+    theory_per_day = {}
+    for m in re.finditer(r"^- (\S+) (Theory|Lab) (\d+) (\S+)$", prompt, re.MULTILINE):
+        code, slot_type, periods = m.group(1), m.group(2), int(m.group(3))
+        lecturers = [l for l in m.group(4).split("|") if l in lecturer_free] or m.group(4).split("|")
+        rooms = lab_rooms if slot_type == "Lab" else theory_rooms
+        length = 2 if slot_type == "Lab" else 1
+        remaining = periods
+        for day in working_days:
+            for start in range(1, periods_per_day - length + 2):
+                if remaining <= 0:
+                    break
+                size = min(length, remaining)
+                times = [(day, start + k) for k in range(size)]
+                if any(t in division_busy for t in times):
+                    continue
+                if slot_type == "Theory" and theory_per_day.get((code, day), 0) >= 2:
+                    continue
+                lecturer = next((l for l in lecturers if all(t in lecturer_free.get(l, set()) for t in times)), None)
+                room = next((r for r, free in rooms.items() if all(t in free for t in times)), None)
+                if lecturer is None or room is None:
+                    continue
+                for t in times:
+                    division_busy.add(t)
+                    lecturer_free[lecturer].discard(t)
+                    rooms[room].discard(t)
+                    slots.append({"division": division, "day": t[0], "period": t[1], "subject": code,
+                                  "lecturer": lecturer, "room": room, "type": slot_type})
+                if slot_type == "Theory":
+                    theory_per_day[(code, day)] = theory_per_day.get((code, day), 0) + 1
+                remaining -= size
+    return {"slots": slots}
+
+
+def heuristic_allocation(prompt: str) -> dict:
+    """Assigns every listed subject to every listed division with its default lecturer."""
+    names = re.search(r"- Divisions: \[(.*?)\]", prompt)
+    division_names = re.findall(r"'([^']*)'", names.group(1)) if names else []
+    subjects = [
+        {"code": m.group(1), "name": m.group(2), "type": m.group(3), "periods_per_week": int(m.group(4)),
+         "assigned_lecturer_id": None if m.group(5) == "None" else m.group(5)}
+        for m in re.finditer(r"- Code: (.+?), Name: (.+?), Type: (\w+), Periods/Week: (\d+), Default Lecturer ID: (\S+)", prompt)
+    ]
+    return {"divisions": [{"name": name, "strength": 60, "subjects": subjects} for name in division_names]}
+
+
+def reply_text(messages: list) -> str:
+    if CANNED_FILE:
+        with open(CANNED_FILE) as f:
+            canned = json.load(f)
+        return canned if isinstance(canned, str) else json.dumps(canned)
+    system = messages[0]["content"] if messages else ""
+    prompt = messages[-1]["content"] if messages else ""
+    if "'slots'" in system:
+        return json.dumps(heuristic_timetable(prompt))
+    if "'divisions'" in system:
+        return json.dumps(heuristic_allocation(prompt))
+    return "These clashes leave no conflict-free assignment. Add rooms, reduce subject hours or rebalance lecturer workloads."
+
+
+# ---------------- OpenAI-compatible endpoint ----------------
+
+def pick_outcome(model: str, structured: bool) -> str:
+    profile = MODEL_PROFILES.get(model, PROFILE)
+    if profile == "no_structured":
+        return "422" if structured else "ok"
+    if profile == "mixed":
+        roll = rng.random()
+        if roll >= ERROR_RATE:
+            return "ok"
+        return rng.choice(["402", "timeout", "malformed"])
+    return profile
+
+
+@app.get("/stats")
+def get_stats():
+    return stats
+
+
+@app.post("/v1/chat/completions")
+@app.post("/chat/completions")
+@app.post("/models/{model_path:path}/v1/chat/completions")
+async def chat_completions(request: Request, model_path: str = None):
+    body = await request.json()
+    model = body.get("model") or model_path or "stub"
+    outcome = pick_outcome(model, "response_format" in body)
+    stats["requests"] += 1
+    stats["by_outcome"][outcome] = stats["by_outcome"].get(outcome, 0) + 1
+
+    await asyncio.sleep(LATENCY_SECONDS + (rng.uniform(0, JITTER_SECONDS) if JITTER_SECONDS else 0.0))
+    if outcome == "402":
+        return JSONResponse(status_code=402, content={"error": "Payment Required: You have exceeded your monthly included credits."})
+    if outcome == "422":
+        return JSONResponse(status_code=422, content={"error": "response_format json_schema is not supported by this model."})
+    if outcome == "timeout":
+        await asyncio.sleep(TIMEOUT_SLEEP_SECONDS)
+
+    text = reply_text(body.get("messages", []))
+    if outcome == "malformed":
+        text = text[: max(1, int(len(text) * 0.6))] + ' ,,"slots": oops'
+
+    created = int(time.time())
+    if not body.get("stream"):
+        return {
+            "id": "stub", "object": "chat.completion", "created": created, "model": model, "system_fingerprint": "stub",
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop", "logprobs": None}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        }
+
+    async def events():
+        for i in range(0, len(text), 16):
+            chunk = {
+                "id": "stub", "object": "chat.completion.chunk", "created": created, "model": model, "system_fingerprint": "stub",
+                "choices": [{"index": 0, "delta": {"role": "assistant", "content": text[i:i + 16]}, "finish_reason": None, "logprobs": None}],
+            }
+            yield f"data: {json.dumps(chunk)}\n\n"
+            if CHUNK_DELAY_SECONDS:
+                await asyncio.sleep(CHUNK_DELAY_SECONDS)
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="127.0.0.1", port=int(os.getenv("STUB_PORT", "8081")))
@@ -0,0 +1,402 @@
+import sys
+import os
+import json
+import asyncio
+import socket
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from types import SimpleNamespace
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# The stub server reads its profile at import
+os.environ["STUB_PROFILE"] = "no_structured"
+os.environ["STUB_LATENCY_SECONDS"] = "0"
+import uvicorn
+from huggingface_hub import AsyncInferenceClient
+import llm_stub_server
+
+from app.core.config import settings
+from app.models.schemas import TimetableRequest, TimetableMetadata, Division, Subject, Lecturer, Classroom
+from app.services import llm_service
+from app.services.slot_stream import SlotStreamParser, StreamingSlotChecker
+from app.services.slot_schema import build_division_slot_schema
+from app.services.prompt_builder import build_single_division_prompt, count_prompt_tokens, fit_prompt_feedback
+from app.services.llm_replay import Cassette, AsyncRecordReplayClient, ReplayedError
+from app.services.model_health import ModelHealthRegistry
+from app.services.slots import Slot
+from app.services.llm_cache import LLMResponseCache
+from app.services import explanations
+
+settings.LLM_CACHE_ENABLED = False
+
+
+class FakeStream:
+    """Async chat-completion stream yielding the given text chunks; counts what was read."""
+
+    def __init__(self, chunks, fail_after: int = None):
+        self.chunks = chunks
+        self.fail_after = fail_after
+        self.read = 0
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.fail_after is not None and self.read >= self.fail_after:
+            raise ConnectionError("stream reset")
+        if self.read >= len(self.chunks):
+            raise StopAsyncIteration
+        chunk = self.chunks[self.read]
+        self.read += 1
+        await asyncio.sleep(0)
+        return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=chunk))])
+
+    async def aclose(self):
+        self.closed = True
+
+
+class FakeClient:
+    """Stands in for AsyncInferenceClient: model id -> FakeStream."""
+
+    def __init__(self, streams: dict):
+        self.streams = streams
+
+    async def chat_completion(self, messages, model, stream=False, **params):
+        return self.streams[model]
+
+
+def chunked(text: str, size: int) -> list:
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+@contextmanager
+def stub_server(canned: dict):
+    """Runs llm_stub_server on a free local port with a canned reply; yields its base URL."""
+    with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+        json.dump(canned, f)
+    llm_stub_server.CANNED_FILE = f.name
+    llm_stub_server.stats.update({"requests": 0, "by_outcome": {}})
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(llm_stub_server.app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    try:
+        yield f"http://127.0.0.1:{port}/v1"
+    finally:
+        server.should_exit = True
+        thread.join()
+        os.unlink(f.name)
+
+
+def run_test():
+    metadata = TimetableMetadata(
+        institution_name="Test College",
+        department="Computer Science",
+        semester=5,
+        academic_year="2026",
+        working_days=["Monday", "Tuesday", "Wednesday"],
+        periods_per_day=4
+    )
+    request = TimetableRequest(
+        metadata=metadata,
+        divisions=[
+            Division(name="Div A", subjects=[Subject(code="CS-301", name="DBMS", type="Theory", periods_per_week=3, assigned_lecturer_id="ST-01")]),
+            Division(name="Div B", subjects=[Subject(code="CS-301", name="DBMS", type="Theory", periods_per_week=3, assigned_lecturer_id="ST-01")])
+        ],
+        lecturers=[Lecturer(id="ST-01", name="Dr. Sharma")],
+        classrooms=[Classroom(id="CR-101", capacity=60), Classroom(id="CR-102", capacity=60)]
+    )
+
+    def slot(day, period, division="Div A", room="CR-101", subject="CS-301"):
+        return {"division": division, "day": day, "period": period, "subject": subject, "lecturer": "ST-01", "room": room, "type": "Theory"}
+
+    slots = [slot("Monday", 1), slot("Tuesday", 1), slot("Wednesday", 1)]
+
+    print("--- Test 1: Slot stream parser ---")
+    reply = "Here you go:\n```json\n" + json.dumps({"slots": slots}) + "\n```\nTrailing chatter {"
+    for size in (1, 3, 7, len(reply)):
+        parser = SlotStreamParser()
+        parsed = [obj for chunk in chunked(reply, size) for obj in parser.feed(chunk)]
+        assert parsed == slots, (size, parsed)
+        assert parser.done
+        assert parser.feed('{"more": 1}') == []
+
+    # Braces and escaped quotes inside strings do not end an object
+    tricky = {**slots[0], "subject": 'DB {"x": "}"} \\ \\"}'}
+    parser = SlotStreamParser()
+    text = '{"slots": [' + json.dumps(tricky) + ", " + json.dumps(slots[1]) + "]}"
+    assert [obj for chunk in chunked(text, 2) for obj in parser.feed(chunk)] == [tricky, slots[1]]
+
+    # A malformed object yields None and does not lose the ones after it
+    parser = SlotStreamParser()
+    text = '{"slots": [' + json.dumps(slots[0]) + ', {"day": Monday, "period": 2}, ' + json.dumps(slots[1])
+    assert [obj for chunk in chunked(text, 5) for obj in parser.feed(chunk)] == [slots[0], None, slots[1]]
+    assert not parser.done
+
+    # key=None streams a top-level array
+    parser = SlotStreamParser(key=None)
+    assert parser.feed(json.dumps(slots)[:-1]) == slots and parser.feed("]") == [] and parser.done
+    print("Slot stream parser test passed successfully!")
+
+    print("\n--- Test 2: Streaming slot checker ---")
+    accepted = [Slot.coerce(slot("Monday", 1, division="Div B", room="CR-102"))]
+    checker = StreamingSlotChecker(request, accepted, "Div A")
+    assert checker.check(slots[1]) is None
+    assert "double-booked" in checker.check(slots[0])  # ST-01 teaches Div B then
+    assert checker.check(None) == "Malformed slot JSON"
+    assert "Malformed slot" in checker.check({"division": "Div A"})
+    assert "expected" in checker.check(slot("Wednesday", 2, division="Div B"))
+    assert "Unknown subject" in checker.check(slot("Wednesday", 2, subject="CS-999"))
+    assert "Invalid period" in checker.check(slot("Wednesday", 9))
+    assert checker.check(slot("Wednesday", 1)) is None and checker.check(slot("Tuesday", 2)) is None
+    assert "exceeds 3 periods" in checker.check(slot("Wednesday", 3))
+    assert [(s.day, s.period) for s in checker.slots] == [("Tuesday", 1), ("Wednesday", 1), ("Tuesday", 2)]
+    assert len(checker.rejected) == 7
+    print("Streaming slot checker test passed successfully!")
+
+    print("\n--- Test 3: Early abort and salvage ---")
+    original_client, original_models = llm_service.hf_async_client, llm_service.HF_MODELS
+    original_top_k = settings.LLM_HEDGE_TOP_K
+    original_cache = llm_service.llm_cache
+    try:
+        # More than LLM_STREAM_MAX_INVALID_SLOTS rejections stop reading the stream
+        invalid = [slot("Monday", 9)] * (settings.LLM_STREAM_MAX_INVALID_SLOTS + 5)
+        stream = FakeStream(['{"slots": ['] + [json.dumps(s) + "," for s in invalid] + ["]}"])
+        llm_service.hf_async_client = FakeClient({"model-a": stream})
+        result = asyncio.run(llm_service._stream_slots_once("model-a", [], StreamingSlotChecker(request, [], "Div A")))
+        assert result["aborted"] and not result["complete"], result
+        assert result["rejected"] == settings.LLM_STREAM_MAX_INVALID_SLOTS + 1
+        assert stream.read == settings.LLM_STREAM_MAX_INVALID_SLOTS + 2 and stream.closed
+
+        # No stream completes: the one with most accepted slots is salvaged
+        reply = chunked(json.dumps({"slots": slots}), 40)
+        llm_service.hf_async_client = FakeClient({
+            "model-a": FakeStream(reply, fail_after=len(reply) - 2),
+            "model-b": FakeStream(reply[:2], fail_after=2),
+        })
+        llm_service.HF_MODELS = ["model-a", "model-b"]
+        settings.LLM_HEDGE_TOP_K = 2
+        result = asyncio.run(llm_service.stream_division_slots_with_llm("prompt", lambda: StreamingSlotChecker(request, [], "Div A")))
+        assert result["model"] == "model-a" and not result["complete"], result
+        assert len(result["slots"]) == 2 and isinstance(result["exception"], ConnectionError)
+
+        # A complete stream wins over partial ones
+        llm_service.hf_async_client = FakeClient({"model-a": FakeStream(reply[:2], fail_after=2), "model-b": FakeStream(reply)})
+        result = asyncio.run(llm_service.stream_division_slots_with_llm("prompt", lambda: StreamingSlotChecker(request, [], "Div A")))
+        assert result["model"] == "model-b" and result["complete"] and len(result["slots"]) == 3
+
+        # A complete stream is only cached once the caller has validated it
+        with tempfile.TemporaryDirectory() as tmp:
+            llm_service.llm_cache = LLMResponseCache(os.path.join(tmp, "cache.sqlite3"), 60, 10)
+            settings.LLM_CACHE_ENABLED = True
+            llm_service.hf_async_client = FakeClient({"model-a": FakeStream(reply), "model-b": FakeStream(reply)})
+            result = asyncio.run(llm_service.stream_division_slots_with_llm("prompt", lambda: StreamingSlotChecker(request, [], "Div A")))
+            assert result["complete"] and llm_service.cache_lookup(result["cache_key"]) is None
+            llm_service.cache_store(result["cache_key"], {"slots": [s.to_dict() for s in result["slots"]]})
+            cached = asyncio.run(llm_service.stream_division_slots_with_llm("prompt", lambda: StreamingSlotChecker(request, [], "Div A")))
+            assert cached["complete"] and "cache_key" not in cached and len(cached["slots"]) == 3
+    finally:
+        llm_service.hf_async_client, llm_service.HF_MODELS = original_client, original_models
+        llm_service.llm_cache = original_cache
+        settings.LLM_CACHE_ENABLED = False
+        settings.LLM_HEDGE_TOP_K = original_top_k
+    print("Early abort and salvage test passed successfully!")
+
+    print("\n--- Test 4: Structured output fallback (stub server, STUB_PROFILE=no_structured) ---")
+    schema = build_division_slot_schema(request, request.divisions[0])
+    factory = lambda: StreamingSlotChecker(request, [], "Div A")
+    llm_service.structured_output_unsupported.clear()
+    try:
+        llm_service.HF_MODELS = ["stub-model"]
+        # A connection failure is not a rejection of response_format
+        class BrokenClient:
+            async def chat_completion(self, **kwargs):
+                raise ConnectionError("connection reset")
+        llm_service.hf_async_client = BrokenClient()
+        result = asyncio.run(llm_service._stream_slots_once("stub-model", [], factory(), schema))
+        assert isinstance(result["exception"], ConnectionError)
+        assert "stub-model" not in llm_service.structured_output_unsupported
+
+        with stub_server({"slots": slots}) as base_url:
+            llm_service.hf_async_client = AsyncInferenceClient(api_key="stub", base_url=base_url, timeout=5)
+            # The 422 for response_format falls back to plain parsing, once
+            result = asyncio.run(llm_service.stream_division_slots_with_llm("prompt", factory, schema))
+            assert result["complete"] and not result["structured"] and len(result["slots"]) == 3, result
+            assert "stub-model" in llm_service.structured_output_unsupported
+            assert llm_stub_server.stats["by_outcome"] == {"422": 1, "ok": 1}
+            result = asyncio.run(llm_service.stream_division_slots_with_llm("prompt", factory, schema))
+            assert result["complete"] and llm_stub_server.stats["by_outcome"] == {"422": 1, "ok": 2}
+    finally:
+        llm_service.hf_async_client, llm_service.HF_MODELS = original_client, original_models
+        llm_service.structured_output_unsupported.clear()
+    print("Structured output fallback test passed successfully!")
+
+    print("\n--- Test 4b: Constraint translation stays within its budget ---")
+    class SlowClient:
+        def __init__(self):
+            self.calls = []
+
+        async def chat_completion(self, messages, model, **params):
+            self.calls.append(model)
+            await asyncio.sleep(10)
+
+    slow = SlowClient()
+    try:
+        llm_service.hf_async_client = slow
+        llm_service.HF_MODELS = ["slow-1", "slow-2", "slow-3"]
+        started = time.monotonic()
+        translations = asyncio.run(llm_service.translate_constraints_with_llm(["no lectures on Friday", "keep mornings free"], request, timeout=0.3))
+        assert translations == [[], []] and time.monotonic() - started < 1.0, translations
+        assert slow.calls == ["slow-1"], slow.calls
+    finally:
+        llm_service.hf_async_client, llm_service.HF_MODELS = original_client, original_models
+        for model in ("slow-1", "slow-2", "slow-3"):
+            llm_service.model_health._models.pop(model, None)
+    print("Constraint translation budget test passed successfully!")
+
+    print("\n--- Test 5: Prompt token budget ---")
+    division = request.divisions[0]
+    prompt = build_single_division_prompt(request, division, [])
+    tokens = count_prompt_tokens(prompt)
+    assert build_single_division_prompt(request, division, [], token_budget=tokens) == prompt
+    assert build_single_division_prompt(request, division, [], token_budget=tokens // 2) is None
+
+    violations = "\n".join(f"- Lecturer ST-01 double-booked on Monday Period {p}" for p in range(1, 40))
+    feedback = ["\n\nJSON Parsing Error: Expecting value. Output valid JSON only.", f"\n\nCRITICAL: INVALID. Violations:\n{violations}"]
+    for budget in (tokens, tokens + 5, tokens + 30, tokens + 200, tokens + 10_000):
+        fitted = fit_prompt_feedback(prompt, feedback, budget)
+        assert fitted.startswith(prompt) and count_prompt_tokens(fitted) <= budget, budget
+    # Newest feedback is kept first, older blocks only while they fit
+    assert "CRITICAL" in fit_prompt_feedback(prompt, feedback, tokens + 30)
+    assert "Parsing Error" not in fit_prompt_feedback(prompt, feedback, tokens + 200)
+    assert fit_prompt_feedback(prompt, feedback, tokens + 10_000) == prompt + "".join(feedback)
+    print("Prompt token budget test passed successfully!")
+
+    print("\n--- Test 6: Record and replay against the stub's error profiles ---")
+    original_max_invalid = settings.LLM_STREAM_MAX_INVALID_SLOTS
+    original_sleep = llm_stub_server.TIMEOUT_SLEEP_SECONDS
+    messages = lambda prompt: [{"role": "system", "content": llm_service.TIMETABLE_SYSTEM_PROMPT}, {"role": "user", "content": prompt}]
+    params = {"max_tokens": 2500, "temperature": 0.1, "top_p": 0.9}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "cassette.jsonl")
+        llm_service.structured_output_unsupported.clear()
+        llm_stub_server.MODEL_PROFILES.update({"stub-402": "402", "stub-malformed": "malformed", "stub-timeout": "timeout"})
+        llm_stub_server.TIMEOUT_SLEEP_SECONDS = 1.0
+        try:
+            with stub_server({"slots": slots}) as base_url:
+                llm_service.hf_async_client = AsyncRecordReplayClient(AsyncInferenceClient(api_key="stub", base_url=base_url, timeout=5), Cassette(path), "record", False)
+
+                async def record():
+                    # One event loop: the client keeps its HTTP session
+                    llm_service.HF_MODELS = ["stub-model"]
+                    assert (await llm_service.stream_division_slots_with_llm("prompt", factory, schema))["complete"]
+
+                    # An early abort is recorded as truncated
+                    settings.LLM_STREAM_MAX_INVALID_SLOTS = 0
+                    llm_service.HF_MODELS = ["stub-cut"]
+                    assert "error" in await llm_service.stream_division_slots_with_llm("prompt 2", lambda: StreamingSlotChecker(request, [], "Div B"))
+                    settings.LLM_STREAM_MAX_INVALID_SLOTS = original_max_invalid
+
+                    result = await llm_service._stream_slots_once("stub-402", messages("prompt"), factory(), **params)
+                    assert llm_service.is_credit_error(result["exception"]) and result["exception"].response.status_code == 402
+                    result = await llm_service._stream_slots_once("stub-malformed", messages("prompt"), factory(), **params)
+                    assert not result["complete"] and result["exception"] is None and len(result["slots"]) < 3, result
+                    # A timed-out call is not recorded
+                    result = await llm_service._stream_slots_once("stub-timeout", messages("prompt"), factory(), timeout=0.2, **params)
+                    assert isinstance(result["exception"], (asyncio.TimeoutError, TimeoutError)), result
+                asyncio.run(record())
+            assert llm_stub_server.stats["by_outcome"] == {"422": 1, "ok": 2, "402": 1, "malformed": 1, "timeout": 1}
+        finally:
+            settings.LLM_STREAM_MAX_INVALID_SLOTS = original_max_invalid
+            llm_stub_server.TIMEOUT_SLEEP_SECONDS = original_sleep
+            for model in ("stub-402", "stub-malformed", "stub-timeout"):
+                llm_stub_server.MODEL_PROFILES.pop(model)
+
+        with open(path) as f:
+            entries = [json.loads(line) for line in f]
+        assert [(e["model"], e.get("status"), bool(e.get("truncated"))) for e in entries] == [
+            ("stub-model", 422, False), ("stub-model", None, False), ("stub-cut", None, True),
+            ("stub-402", 402, False), ("stub-malformed", None, False)
+        ], entries
+
+        # Replay offline from the file
+        llm_service.structured_output_unsupported.clear()
+        llm_service.hf_async_client = AsyncRecordReplayClient(None, Cassette(path), "replay", False)
+        try:
+            llm_service.HF_MODELS = ["stub-model"]
+            result = asyncio.run(llm_service.stream_division_slots_with_llm("prompt", factory, schema))
+            assert result["complete"] and len(result["slots"]) == 3 and "stub-model" in llm_service.structured_output_unsupported
+            # A complete reply answers the prompt for another model; a truncated one does not
+            llm_service.HF_MODELS = ["other-model"]
+            assert asyncio.run(llm_service.stream_division_slots_with_llm("prompt", factory))["complete"]
+            assert "error" in asyncio.run(llm_service.stream_division_slots_with_llm("prompt 2", factory))
+            llm_service.HF_MODELS = ["stub-cut"]
+            assert not asyncio.run(llm_service.stream_division_slots_with_llm("prompt 2", factory)).get("complete")
+            # Recording opened stub-402's circuit; replay calls it again
+            llm_service.model_health._models.pop("stub-402", None)
+            result = asyncio.run(llm_service._stream_slots_once("stub-402", messages("prompt"), factory(), **params))
+            assert isinstance(result["exception"], ReplayedError) and llm_service.is_credit_error(result["exception"])
+        finally:
+            llm_service.hf_async_client, llm_service.HF_MODELS = original_client, original_models
+            llm_service.structured_output_unsupported.clear()
+    print("Record and replay test passed successfully!")
+
+    print("\n--- Test 7: Circuit breaker probe slot ---")
+    health = ModelHealthRegistry()
+    original_ttl = settings.LLM_CIRCUIT_TTL_SECONDS
+    settings.LLM_CIRCUIT_TTL_SECONDS = 0.05
+    try:
+        for _ in range(settings.LLM_CIRCUIT_FAILURE_THRESHOLD):
+            health.record_failure("model-a", 0.1)
+        assert health.ordered(["model-a", "model-b"]) == ["model-b"]
+        time.sleep(0.06)
+        # Half-open: listing the model claims nothing, so a hedge wave that never starts it leaves it free
+        assert "model-a" in health.ordered(["model-a", "model-b"])
+        assert "model-a" in health.ordered(["model-a", "model-b"])
+        # The first call that starts takes the probe; concurrent ones skip the model
+        assert health.try_start("model-a") and not health.try_start("model-a")
+        assert health.ordered(["model-a", "model-b"]) == ["model-b"]
+        health.record_failure("model-a", 0.1)
+        assert health.ordered(["model-a"]) == [] and not health.try_start("model-a")
+        time.sleep(0.06)
+        assert health.try_start("model-a") and health.ordered(["model-a"]) == []
+        health.record_success("model-a", 0.1)
+        assert health.try_start("model-b") and health.try_start("model-a") and health.try_start("model-a")
+        assert health.ordered(["model-a"]) == ["model-a"]
+    finally:
+        settings.LLM_CIRCUIT_TTL_SECONDS = original_ttl
+    print("Circuit breaker test passed successfully!")
+
+    print("\n--- Test 8: Explanations are shared through the SQLite store ---")
+    original_generate = explanations.generate_conflict_explanation
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "cache.sqlite3")
+        explanations.llm_cache = LLMResponseCache(path, 60, 10)
+        explanations.generate_conflict_explanation = lambda conflicts: "Too few rooms."
+        try:
+            report = explanations.request_conflict_explanation(["Under-capacity: 30 > 25"])
+            assert report["status"] == "pending" and report["source"] == "template"
+            for _ in range(100):
+                if explanations.get_conflict_explanation(report["explanation_id"])["status"] != "pending":
+                    break
+                time.sleep(0.02)
+            # Another worker (or a restarted one) opens the same table
+            explanations.llm_cache = LLMResponseCache(path, 60, 10)
+            stored = explanations.get_conflict_explanation(report["explanation_id"])
+            assert stored["status"] == "ready" and stored["explanation"] == "Too few rooms.", stored
+            assert explanations.llm_cache.stats()["hits"] == 0
+            assert explanations.get_conflict_explanation("unknown") is None
+        finally:
+            explanations.llm_cache = llm_service.llm_cache
+            explanations.generate_conflict_explanation = original_generate
+    print("Explanation store test passed successfully!")
+
+if __name__ == "__main__":
+    run_test()
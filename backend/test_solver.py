@@ -2,8 +2,23 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from app.models.schemas import TimetableRequest, TimetableMetadata, Division, Subject, Lecturer, Classroom, Laboratory
+from app.models.schemas import TimetableRequest, TimetableMetadata, Division, Subject, Lecturer, Classroom, Laboratory, BlockedPeriod
+from app.models.schemas import TimetableResponse, CompactTimetableResponse, AutoAllocateRequest
 from app.services.solver import schedule_with_ortools
+from app.services.validator import validate_timetable
+from app.services.columnar_validator import validate_timetable_columnar
+from app.services.compact_encoding import encode_compact, decode_compact
+from app.services.slots import to_api_slots, Slot
+from app.services.allocation import allocate_subjects
+from app.services.synthetic import synthetic_request
+from app.services.metrics import record_generation, registry
+from app.services.pipeline import run_generation_pipeline, presolve_stage, solver_stage, division_stage, division_source
+from app.services.deadline import Deadline
+from app.services.batch_generation import generate_component, run_batch_generation
+from app.services.repair import repair_division_slots_full, repair_divisions_batch
+from app.services.problem import CompiledProblem
+import asyncio
+import random
 
 def run_test():
     # 1. Setup Feasible Request
@@ -60,11 +75,97 @@ def run_test():
         print("Success! Number of slots scheduled:", len(result["slots"]))
         # Print a sample of scheduled slots
         for slot in result["slots"][:5]:
-            print(f"  Div {slot['division']} | {slot['day']} P{slot['period']} | {slot['subject']} | Lec: {slot['lecturer']} | Room: {slot['room']}")
+            print(f"  Div {slot.division} | {slot.day} P{slot.period} | {slot.subject} | Lec: {slot.lecturer} | Room: {slot.room}")
     else:
         print("Error: Feasible test failed!", result.get("error"))
         assert False, "Feasible timetable failed to schedule!"
 
+    # Solver output must pass the same hard rules the validator enforces
+    timetable = TimetableResponse(
+        timetable_id="test",
+        metadata=metadata,
+        divisions=request_feasible.divisions,
+        lecturers=lecturers,
+        classrooms=rooms,
+        slots=to_api_slots(result["slots"])
+    )
+    validation = validate_timetable(timetable, request_feasible)
+    assert validation["valid"], validation["errors"]
+
+    # Compact encoding round-trips to the same timetable
+    assert TimetableResponse(**decode_compact(encode_compact(timetable))) == timetable
+    # The documented shape of ?format=compact matches what the encoder produces
+    CompactTimetableResponse.model_validate(encode_compact(timetable, include_resources=False))
+
+    # DSL constraints are enforced by the solver and checked by the validator
+    print("\n--- Test 1b: Constraint DSL ---")
+    request_feasible.constraints = ["lecturer ST-01 not before period 3", "no classes on Friday afternoon"]
+    result_dsl = schedule_with_ortools(request_feasible)
+    assert result_dsl.get("status") == "SUCCESS", result_dsl
+    for slot in result_dsl["slots"]:
+        assert not (slot.lecturer == "ST-01" and slot.period < 3), slot
+        assert not (slot.day == "Friday" and slot.period > 4), slot
+    timetable.slots = to_api_slots(result_dsl["slots"])
+    assert validate_timetable(timetable, request_feasible)["valid"]
+    timetable.slots[0] = timetable.slots[0].model_copy(update={"day": "Friday", "period": 7})
+    assert any("no classes on Friday afternoon" in e for e in validate_timetable(timetable, request_feasible)["errors"])
+    print("Constraint DSL test passed successfully!")
+
+    # Slots booked by another department block those lecturer/room cells
+    print("\n--- Test 1c: External bookings ---")
+    request_feasible.constraints = []
+    booked = [slot.copy(division="Other Dept") for slot in result["slots"] if slot.lecturer == "ST-01"][:4]
+    result_ext = schedule_with_ortools(request_feasible, booked_slots=booked)
+    assert result_ext.get("status") == "SUCCESS", result_ext
+    taken = {(s.day, s.period) for s in booked}
+    for slot in result_ext["slots"]:
+        assert not (slot.lecturer == "ST-01" and (slot.day, slot.period) in taken), slot
+        assert (slot.room, slot.day, slot.period) not in {(s.room, s.day, s.period) for s in booked}, slot
+    print("External bookings test passed successfully!")
+
+    # The request's blocked calendar is occupied time for solver and validators
+    print("\n--- Test 1d: Blocked calendar ---")
+    request_feasible.blocked = [
+        BlockedPeriod(lecturer="ST-02", day="Monday", period=period) for period in range(1, 8)
+    ] + [BlockedPeriod(room="LB-101", day="Wednesday", period=period) for period in range(1, 8)]
+    result_blocked = schedule_with_ortools(request_feasible)
+    assert result_blocked.get("status") == "SUCCESS", result_blocked
+    for slot in result_blocked["slots"]:
+        assert not (slot.lecturer == "ST-02" and slot.day == "Monday"), slot
+        assert not (slot.room == "LB-101" and slot.day == "Wednesday"), slot
+    timetable.slots = to_api_slots(result_blocked["slots"])
+    assert validate_timetable(timetable, request_feasible)["valid"]
+    moved = next(i for i, s in enumerate(timetable.slots) if s.lecturer == "ST-02" and s.type == "Theory")
+    timetable.slots[moved] = timetable.slots[moved].model_copy(update={"day": "Monday", "period": 1})
+    errors = validate_timetable(timetable, request_feasible)["errors"]
+    assert any("ST-02 is already booked elsewhere" in e for e in errors), errors
+    assert not validate_timetable_columnar(timetable.slots, request_feasible).valid
+    request_feasible.blocked = []
+    print("Blocked calendar test passed successfully!")
+
+    # Unassigned subjects get their lecturer chosen together with the timetable
+    print("\n--- Test 1e: Joint lecturer assignment ---")
+    request_joint = TimetableRequest(
+        metadata=metadata,
+        divisions=[Division(name="Div A", strength=60, subjects=[
+            Subject(code="CS-301", name="DBMS", type="Theory", periods_per_week=8, assigned_lecturer_id="ST-01"),
+            Subject(code="CS-304", name="Networks", type="Theory", periods_per_week=4)
+        ])],
+        lecturers=[
+            Lecturer(id="ST-01", name="Dr. Sharma", subjects=["CS-304"], max_periods_per_week=10),
+            Lecturer(id="ST-03", name="Dr. Rao", subjects=["Networks"], max_periods_per_week=10)
+        ],
+        classrooms=rooms
+    )
+    # The first eligible lecturer (ST-01) would exceed its weekly load
+    assert schedule_with_ortools(request_joint, joint_lecturers=False)["status"] == "INFEASIBLE"
+    result_joint = schedule_with_ortools(request_joint)
+    assert result_joint.get("status") == "SUCCESS", result_joint
+    assert result_joint["lecturer_assignments"] == [{"division": "Div A", "subject": "CS-304", "lecturer": "ST-03"}]
+    assert all(slot.lecturer == "ST-03" for slot in result_joint["slots"] if slot.subject == "CS-304")
+    assert sum(slot.subject == "CS-304" for slot in result_joint["slots"]) == 4
+    print("Joint lecturer assignment test passed successfully!")
+
     # 2. Setup Infeasible Request (Lecturer ST-01 over-allocated)
     print("\n--- Test 2: Infeasible Timetable (Lecturer Over-allocated) ---")
     div_a_infeasible = Division(
@@ -89,5 +190,109 @@ def run_test():
     assert len(result_inf.get("conflicts", [])) > 0
     print("Infeasible test passed successfully!")
 
+    # An early solver return (no rooms available) still reports why it failed
+    no_rooms = request_infeasible.model_copy(update={
+        "divisions": [div_a],
+        "classrooms": [room.model_copy(update={"status": "Unavailable"}) for room in rooms]
+    })
+    ctx_no_rooms = asyncio.run(run_generation_pipeline(no_rooms, stages=[presolve_stage, solver_stage]))
+    assert ctx_no_rooms.conflicts == ["No available classrooms or laboratories in the resource pool."], ctx_no_rooms.conflicts
+    print("No-rooms conflict test passed successfully!")
+
+    # 3. Subject auto-allocation: capacities, semesters and workload balance
+    print("\n--- Test 3: Subject Auto-allocation ---")
+    pool = lecturers + [
+        Lecturer(id="ST-03", name="Dr. Rao", subjects=["CS-301", "CS-302"], max_periods_per_week=8, semesters=[5]),
+        Lecturer(id="ST-04", name="Dr. Iyer", subjects=["CS-301"], max_periods_per_week=20, semesters=[3])
+    ]
+    allocation = allocate_subjects(AutoAllocateRequest(
+        department="Computer Science", semester=5, divisions=[div_a, div_b, div_a.model_copy(update={"name": "Div C"})],
+        subjects=div_a.subjects, lecturers=pool
+    ))
+    report = allocation["report"]
+    assert report["status"] == "COMPLETE", report
+    loads = {entry["lecturer"]: entry["periods"] for entry in report["lecturer_loads"]}
+    assert "ST-04" not in loads  # teaches semester 3 only
+    assert all(loads[l.id] <= l.max_periods_per_week for l in pool if l.id in loads)
+    assert report["max_load"] == 12, report
+    print("Auto-allocation test passed successfully!")
+
+    # 4. Seeded synthetic instances (benchmark.py) are reproducible and schedulable
+    print("\n--- Test 4: Synthetic instance generator ---")
+    synthetic = synthetic_request(seed=7, divisions=2, subjects=5, load_density=0.5)
+    assert synthetic == synthetic_request(seed=7, divisions=2, subjects=5, load_density=0.5)
+    assert synthetic != synthetic_request(seed=8, divisions=2, subjects=5, load_density=0.5)
+    result_syn = schedule_with_ortools(synthetic)
+    assert result_syn.get("status") == "SUCCESS", result_syn
+    assert result_syn["stats"]["first_solution_seconds"] is not None
+    assert validate_timetable_columnar(result_syn["slots"], synthetic).valid
+    # A search cut off by the time limit is a timeout, not an infeasibility report
+    result_cut = schedule_with_ortools(synthetic_request(seed=1, divisions=8, subjects=7, lab_share=0.3, load_density=0.6), 0.01)
+    assert result_cut["status"] == "TIMEOUT" and result_cut["stats"]["solver_status"] == "UNKNOWN", result_cut
+    print("Synthetic instance test passed successfully!")
+
+    # 5. Solver telemetry is exported on /metrics
+    print("\n--- Test 5: Solver metrics ---")
+    stats = result_syn["stats"]
+    assert stats["variables"] > 0 and stats["constraints"] > 0 and stats["gap"] >= 0, stats
+    record_generation("generate", "success", 1.5, {
+        "source": "cp_sat", "solver": stats, "divisions": [{"division": "Div 1", "llm_attempts": 2, "source": "heuristic"}]
+    })
+    exposition = registry.render()
+    assert 'timetable_generations_total{endpoint="generate",outcome="success",source="cp_sat"} 1.0' in exposition
+    assert 'timetable_generation_seconds_bucket{endpoint="generate",source="cp_sat",le="1.0"} 0' in exposition
+    assert 'timetable_generation_seconds_bucket{endpoint="generate",source="cp_sat",le="2.5"} 1' in exposition
+    assert 'timetable_generation_seconds_bucket{endpoint="generate",source="cp_sat",le="+Inf"} 1' in exposition
+    assert f'timetable_solver_runs_total{{status="{stats["solver_status"]}"}} 1.0' in exposition
+    assert 'timetable_division_llm_attempts_count{source="heuristic"} 1' in exposition
+
+    # The sequential stage reports which generator actually produced the divisions
+    assert division_source([{"source": "llm"}, {"source": "heuristic"}]) == "mixed"
+    assert division_source([{"source": "llm"}, {"source": "llm"}]) == "llm"
+    # An expired deadline leaves no time for the LLM: every division is heuristic
+    unassigned = synthetic_request(seed=3, divisions=2, subjects=3, load_density=0.3, unassigned_share=1.0)
+    before = unassigned.model_dump()
+    repair_division_slots_full([], [], unassigned, "Div 1")
+    assert unassigned.model_dump() == before, "repair must not modify the request"
+    ctx = asyncio.run(run_generation_pipeline(unassigned, stages=[presolve_stage, division_stage], deadline=Deadline(0)))
+    assert ctx.source == "heuristic" and all(run["llm_attempts"] == 0 for run in ctx.division_runs), ctx.diagnostics()
+    # The lecturers repair picked are recorded on the subjects once the stage is done
+    chosen = {(slot.division, slot.subject): slot.lecturer for slot in ctx.slots}
+    assert all(sub.assigned_lecturer_id == chosen[div.name, sub.code] for div in unassigned.divisions for sub in div.subjects if (div.name, sub.code) in chosen)
+    print("Solver metrics test passed successfully!")
+
+    # 6. Batch generation validates heuristic timetables and honours the deadline
+    print("\n--- Test 6: Batch generation fallback and deadline ---")
+    # The batch repair gives the same timetable as repairing division by division
+    dense = synthetic_request(seed=5, divisions=3, subjects=4, load_density=0.7)
+    dense_problem = CompiledProblem(dense)
+    random.seed(7)
+    batched = repair_divisions_batch({d.name: [] for d in dense.divisions}, [], dense, problem=dense_problem)
+    random.seed(7)
+    one_by_one = []
+    for division in dense.divisions:
+        one_by_one.extend(repair_division_slots_full([], one_by_one, dense, division.name, problem=dense_problem))
+    assert [s.to_dict() for slots in batched.values() for s in slots] == [s.to_dict() for s in one_by_one]
+    shared = [(i, synthetic_request(seed=5, divisions=3, subjects=4, load_density=0.7)) for i in range(3)]
+    # A zero time limit skips CP-SAT, so every request goes through the heuristic
+    results = generate_component(shared, time_limit=0)
+    assert all(r["source"] == "heuristic" for r in results), results
+    booked = []
+    for (_, request), result in zip(shared, results):
+        validation = validate_timetable_columnar([Slot.coerce(s) for s in result.get("slots", [])], request, booked_slots=booked)
+        assert result["status"] in ("SUCCESS", "PARTIAL", "INVALID"), result
+        assert result["status"] == "SUCCESS" or result["errors"], result
+        if result["status"] != "INVALID":
+            assert not [name for name, violated in validation.violations.items() if violated and name != "counts"], validation.errors
+            booked.extend(Slot.coerce(s) for s in result["slots"])
+    assert {r["status"] for r in results} != {"SUCCESS"}, "the shared pool should not fit three departments"
+
+    expired = run_batch_generation([request for _, request in shared], workers=1, deadline=Deadline(0))
+    assert [r["status"] for r in expired] == ["TIMEOUT"] * 3, expired
+    cancelled = Deadline()
+    cancelled.cancel("client disconnected")
+    assert [r["status"] for r in generate_component(shared, deadline=cancelled)] == ["CANCELLED"] * 3
+    print("Batch generation test passed successfully!")
+
 if __name__ == "__main__":
     run_test()
@@ -0,0 +1,203 @@
+import sys
+import os
+import json
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from fastapi.testclient import TestClient
+
+from app.models.schemas import TimetableRequest, TimetableResponse, TimetableMetadata, Division, Subject, Lecturer, Classroom, TimetableSlot, BlockedPeriod
+from app.services.validator import validate_timetable, IncrementalValidator
+from app.services.columnar_validator import validate_timetable_columnar
+from app.services.constraints import ScheduleState
+from app.services.repair import optimize_distribution, resolve_sequential_conflicts
+import random
+from app.services.slots import to_internal_slots, to_api_slots
+from app.services import batch_validation
+from app.services.batch_validation import validate_timetable_payload
+from app.main import app
+
+def run_test():
+    metadata = TimetableMetadata(
+        institution_name="Test College",
+        department="Computer Science",
+        semester=5,
+        academic_year="2026",
+        working_days=["Monday", "Tuesday", "Wednesday", "Thursday", "Friday"],
+        periods_per_day=7
+    )
+
+    subjects = [
+        Subject(code="CS-301", name="DBMS", type="Theory", periods_per_week=3, assigned_lecturer_id="ST-01"),
+        Subject(code="CS-303", name="OS Lab", type="Lab", periods_per_week=2, assigned_lecturer_id="ST-02", lab_requirement=True)
+    ]
+    request = TimetableRequest(
+        metadata=metadata,
+        divisions=[Division(name="Div A", subjects=subjects), Division(name="Div B", subjects=subjects)],
+        lecturers=[
+            Lecturer(id="ST-01", name="Dr. Sharma"),
+            Lecturer(id="ST-02", name="Prof. Khan")
+        ],
+        classrooms=[
+            Classroom(id="CR-101", capacity=60, type="Classroom"),
+            Classroom(id="LB-101", capacity=60, type="Lab")
+        ]
+    )
+
+    def slot(div, day, period, subject, lecturer, room, type="Theory"):
+        return TimetableSlot(division=div, day=day, period=period, subject=subject, lecturer=lecturer, room=room, type=type)
+
+    div_a = [
+        slot("Div A", "Monday", 1, "CS-301", "ST-01", "CR-101"),
+        slot("Div A", "Tuesday", 1, "CS-301", "ST-01", "CR-101"),
+        slot("Div A", "Wednesday", 1, "CS-301", "ST-01", "CR-101"),
+        slot("Div A", "Monday", 3, "CS-303", "ST-02", "LB-101", "Lab"),
+        slot("Div A", "Monday", 4, "CS-303", "ST-02", "LB-101", "Lab"),
+    ]
+    # ST-01 and CR-101 clash with Div A on Monday P1, CS-301 is over-scheduled on Friday
+    div_b_invalid = [
+        slot("Div B", "Monday", 1, "CS-301", "ST-01", "CR-101"),
+        slot("Div B", "Friday", 1, "CS-301", "ST-01", "CR-101"),
+        slot("Div B", "Friday", 2, "CS-301", "ST-01", "CR-101"),
+        slot("Div B", "Friday", 3, "CS-301", "ST-01", "CR-101"),
+        slot("Div B", "Friday", 9, "CS-303", "ST-02", "LB-101", "Lab"),
+    ]
+    div_b_valid = [
+        slot("Div B", "Monday", 2, "CS-301", "ST-01", "CR-101"),
+        slot("Div B", "Tuesday", 2, "CS-301", "ST-01", "CR-101"),
+        slot("Div B", "Thursday", 2, "CS-301", "ST-01", "CR-101"),
+        slot("Div B", "Friday", 3, "CS-303", "ST-02", "LB-101", "Lab"),
+        slot("Div B", "Friday", 4, "CS-303", "ST-02", "LB-101", "Lab"),
+    ]
+
+    def full_validation(slots, specific_divisions=None):
+        timetable = TimetableResponse(timetable_id="temp", metadata=metadata, divisions=request.divisions, lecturers=request.lecturers, classrooms=request.classrooms, slots=slots)
+        return validate_timetable(timetable, request, specific_divisions=specific_divisions)
+
+    print("--- Test 1: Incremental validator matches full validation ---")
+    validator = IncrementalValidator(request)
+    result = validator.validate_delta(div_a, specific_divisions=["Div A"])
+    assert result == full_validation(div_a, ["Div A"]) and result["valid"]
+    validator.commit()
+
+    result = validator.validate_delta(div_b_invalid, specific_divisions=["Div B"])
+    expected = full_validation(div_a + div_b_invalid, ["Div B"])
+    print("Errors:", result["errors"])
+    assert not result["valid"]
+    assert sorted(result["errors"]) == sorted(expected["errors"])
+    validator.rollback()
+
+    result = validator.validate_delta(div_b_valid, specific_divisions=["Div B"])
+    assert result["valid"], result["errors"]
+    validator.commit()
+
+    print("\n--- Test 2: Columnar validator matches full validation ---")
+    for slots, divisions in [(div_a + div_b_valid, None), (div_a + div_b_invalid, None), (div_a, ["Div A"]), ([], None)]:
+        result = validate_timetable_columnar(slots, request, specific_divisions=divisions)
+        assert result.to_dict() == full_validation(slots, divisions)
+    assert validate_timetable_columnar(div_a + div_b_valid, request).valid
+
+    print("\n--- Test 3: Blocked periods count towards lecturer load ---")
+    # ST-01 teaches Monday P1 (Div A) and P2 (Div B); four more blocked periods exceed 4 per day
+    request.blocked = [BlockedPeriod(lecturer="ST-01", day="Monday", period=period) for period in range(4, 8)]
+    slots = div_a + div_b_valid
+    expected = full_validation(slots)
+    assert any("exceeds 4 periods on Monday" in e for e in expected["errors"]), expected["errors"]
+    assert validate_timetable_columnar(slots, request).to_dict() == expected
+    validator = IncrementalValidator(request)
+    assert not validator.validate_delta(slots)["valid"]
+    timetable = TimetableResponse(timetable_id="blocked", metadata=metadata, divisions=request.divisions, lecturers=request.lecturers, classrooms=request.classrooms, blocked=request.blocked, slots=slots)
+    assert not validate_timetable_payload(0, timetable.model_dump(mode="json"))["valid"]
+    request.blocked = request.blocked[:2]
+    assert validate_timetable_columnar(slots, request).valid and full_validation(slots)["valid"]
+    request.blocked = []
+
+    print("\n--- Test 4: Incremental state and distribution repair ---")
+    internal = to_internal_slots(div_a + div_b_valid)
+    state = ScheduleState(request, internal)
+    tables = lambda st: [dict(t) for t in (st.lecturer_slots, st.room_slots, st.division_slots, st.lecturer_day_load, st.lecturer_week_load, st.theory_day_count, st.lab_periods)]
+    before = tables(state)
+    state.begin()
+    for s in internal[:4]:
+        state.remove(s)
+    state.rollback()
+    assert tables(state) == before
+    state.remove(internal[0])
+    assert tables(state) == tables(ScheduleState(request, internal[1:]))
+    state.add(internal[0])
+    assert tables(state) == before
+
+    # Three DBMS periods on Monday: one moves, without a clash with Div A
+    crowded = to_internal_slots([
+        slot("Div B", "Monday", 2, "CS-301", "ST-01", "CR-101"),
+        slot("Div B", "Monday", 3, "CS-301", "ST-01", "CR-101"),
+        slot("Div B", "Monday", 4, "CS-301", "ST-01", "CR-101"),
+        slot("Div B", "Friday", 3, "CS-303", "ST-02", "LB-101", "Lab"),
+        slot("Div B", "Friday", 4, "CS-303", "ST-02", "LB-101", "Lab"),
+    ])
+    balanced = optimize_distribution(crowded, to_internal_slots(div_a), request)
+    assert sum(s.day == "Monday" and s.subject == "CS-301" for s in balanced) == 2
+    assert full_validation(div_a + to_api_slots(balanced))["valid"]
+
+    # The occupancy-map resolver moves exactly the slots the old scan over resolved slots did
+    def resolve_by_scan(current_slots, occupied_slots):
+        busy = lambda slots, day, period, s: any(o.day == day and o.period == period and (o.lecturer == s.lecturer or o.room == s.room) for o in slots)
+        resolved = []
+        for s in current_slots:
+            if busy(occupied_slots, s.day, s.period, s) or busy(resolved, s.day, s.period, s):
+                free = [(d, p) for d in metadata.working_days for p in range(1, metadata.periods_per_day + 1)
+                        if not busy(occupied_slots, d, p, s) and not busy(resolved, d, p, s)]
+                if free:
+                    s.day, s.period = free[0]
+            resolved.append(s)
+        return resolved
+
+    rng = random.Random(3)
+    random_slots = lambda n, division: to_internal_slots([
+        slot(division, rng.choice(metadata.working_days), rng.randint(1, 7), "CS-301", rng.choice(["ST-01", "ST-02", "ST-03"]), rng.choice(["CR-101", "CR-102", "LB-101"]))
+        for _ in range(n)
+    ])
+    for n in (5, 20, 40):
+        occupied, current = random_slots(n, "Div A"), random_slots(n, "Div B")
+        expected = resolve_by_scan([s.copy() for s in current], occupied)
+        assert [(s.day, s.period) for s in resolve_sequential_conflicts(current, occupied, request)] == [(s.day, s.period) for s in expected]
+
+    print("\n--- Test 5: Batch validation endpoint ---")
+    client = TestClient(app)
+    stored = TimetableResponse(timetable_id="tt-1", metadata=metadata, divisions=request.divisions, lecturers=request.lecturers, classrooms=request.classrooms, slots=div_a + div_b_valid).model_dump(mode="json")
+
+    def batch(**kwargs):
+        response = client.post("/timetable/validate/batch", **kwargs)
+        assert response.status_code == 200, response.text
+        return sorted((json.loads(line) for line in response.text.splitlines()), key=lambda r: r["index"])
+
+    # NDJSON read in small chunks; a malformed line only fails its own entry
+    body = "\n".join([json.dumps(stored), "{not json", json.dumps({**stored, "timetable_id": "tt-2"})]).encode()
+    results = batch(content=(body[i:i + 64] for i in range(0, len(body), 64)), headers={"content-type": "application/x-ndjson"})
+    assert [(r["index"], r["timetable_id"], r["valid"]) for r in results] == [(0, "tt-1", True), (1, None, False), (2, "tt-2", True)]
+    invalid = {**stored, "timetable_id": "tt-3", "slots": stored["slots"] + [stored["slots"][0]]}
+    results = batch(json=[stored, invalid])
+    assert [(r["timetable_id"], r["valid"]) for r in results] == [("tt-1", True), ("tt-3", False)]
+    assert client.post("/timetable/validate/batch", json={"timetables": []}).status_code == 400
+
+    # A failing or crashed worker yields an error line; a broken pool is replaced
+    validate = batch_validation.validate_timetable_payload
+    def flaky(index, payload):
+        if index == 1:
+            raise ValueError("boom")
+        if index == 2:
+            raise BrokenProcessPool("worker died")
+        return validate(index, payload)
+    batch_validation._executor = ThreadPoolExecutor(max_workers=1)
+    batch_validation.validate_timetable_payload = flaky
+    try:
+        results = batch(json=[stored, stored, stored])
+    finally:
+        batch_validation.validate_timetable_payload = validate
+    assert results[0]["valid"] and results[1]["errors"] == ["Validation failed: boom"], results
+    assert "crashed" in results[2]["errors"][0] and batch_validation._executor is None
+    assert [r["valid"] for r in batch(json=[stored])] == [True]
+    print("Validator tests passed successfully!")
+
+if __name__ == "__main__":
+    run_test()
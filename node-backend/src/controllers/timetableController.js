@@ -4,6 +4,56 @@ const Timetable = require('../models/Timetable');
 const Subject = require('../models/Subject');
 const Staff = require('../models/Staff');
 
+const GENERATION_TIMEOUT_MS = 180000; // 3 minutes for LLM generation
+
+// Axios options for a generation call: the Python side gets the same deadline
+// (as remaining milliseconds) and the call is aborted if our client hangs up,
+// so Python stops working on a response nobody will read.
+const generationRequestOptions = (req, res) => {
+  const controller = new AbortController();
+  res.on('close', () => {
+    if (!res.writableFinished) controller.abort();
+  });
+  return {
+    timeout: GENERATION_TIMEOUT_MS,
+    signal: controller.signal,
+    headers: { 'X-Request-Timeout-Ms': String(GENERATION_TIMEOUT_MS) }
+  };
+};
+
+// Opt-in compact responses from Python (hashed resources, integer-coded slot
+// columns, gzip); expanded back to the full shape before saving.
+const COMPACT_RESPONSES = process.env.PYTHON_COMPACT_RESPONSES === 'true';
+const RESOURCE_GROUPS = ['divisions', 'lecturers', 'classrooms', 'labs'];
+const SLOT_FIELDS = ['division', 'day', 'period', 'subject', 'lecturer', 'room', 'type'];
+
+const generationUrl = (path) => `${process.env.PYTHON_BACKEND_URL}${path}${COMPACT_RESPONSES ? '?format=compact' : ''}`;
+
+const decodeCompactTimetable = (payload) => {
+  if (payload.format !== 'timetable.compact/1') return payload;
+  const { tables, slots: columns, resources = {} } = payload;
+  const slots = columns.period.map((period, i) => {
+    const slot = {};
+    for (const field of SLOT_FIELDS) {
+      slot[field] = field === 'period' ? period : tables[field][columns[field][i]];
+    }
+    return slot;
+  });
+  const timetable = {
+    timetable_id: payload.timetable_id,
+    created_at: payload.created_at,
+    metadata: payload.metadata,
+    pipeline: payload.pipeline,
+    diagnostics: payload.diagnostics,
+    blocked: payload.blocked || [],
+    slots
+  };
+  for (const group of RESOURCE_GROUPS) {
+    timetable[group] = (payload[group] || []).map((hash) => resources[hash]);
+  }
+  return timetable;
+};
+
 exports.getStats = async (req, res) => {
   try {
     // 1. Total Timetables
@@ -116,14 +166,12 @@ exports.generate = async (req, res) => {
     const timetableRequestData = req.body;
 
     console.log("Forwarding generation request to Python microservice...");
-    const pythonUrl = `${process.env.PYTHON_BACKEND_URL}/timetable/generate`;
+    const pythonUrl = generationUrl('/timetable/generate');
     
     // Call Python backend
-    const response = await axios.post(pythonUrl, timetableRequestData, {
-      timeout: 180000 // 3 minutes timeout for LLM generation
-    });
+    const response = await axios.post(pythonUrl, timetableRequestData, generationRequestOptions(req, res));
 
-    const generatedData = response.data;
+    const generatedData = decodeCompactTimetable(response.data);
     
     // Generate UUIDs for Node DB persistence
     const timetableId = generatedData.timetable_id || randomUUID();
@@ -138,6 +186,10 @@ exports.generate = async (req, res) => {
     await newTimetable.save();
     return res.status(200).json(newTimetable);
   } catch (error) {
+    if (axios.isCancel(error)) {
+      console.log("Client disconnected; generation request cancelled.");
+      return;
+    }
     console.error("Generate timetable error:", error.message);
     if (error.response) {
       console.error("Python response error:", error.response.data);
@@ -166,16 +218,14 @@ exports.regenerate = async (req, res) => {
 
     // 2. Forward request to Python backend
     console.log("Forwarding regeneration request to Python microservice...");
-    const pythonUrl = `${process.env.PYTHON_BACKEND_URL}/timetable/regenerate`;
+    const pythonUrl = generationUrl('/timetable/regenerate');
     
     const response = await axios.post(pythonUrl, {
       original_timetable: originalTimetableObj,
       additional_constraints: additional_constraints || ""
-    }, {
-      timeout: 180000 // 3 minutes
-    });
+    }, generationRequestOptions(req, res));
 
-    const generatedData = response.data;
+    const generatedData = decodeCompactTimetable(response.data);
 
     // 3. Save new timetable with a new ID
     const newTimetableId = generatedData.timetable_id || randomUUID();
@@ -190,6 +240,10 @@ exports.regenerate = async (req, res) => {
     await newTimetable.save();
     return res.status(200).json(newTimetable);
   } catch (error) {
+    if (axios.isCancel(error)) {
+      console.log("Client disconnected; regeneration request cancelled.");
+      return;
+    }
     console.error("Regenerate timetable error:", error.message);
     if (error.response) {
       console.error("Python response error:", error.response.data);
@@ -199,6 +253,22 @@ exports.regenerate = async (req, res) => {
   }
 };
 
+exports.getExplanation = async (req, res) => {
+  try {
+    const { explanationId } = req.params;
+    const pythonUrl = `${process.env.PYTHON_BACKEND_URL}/timetable/explanations/${encodeURIComponent(explanationId)}`;
+
+    const response = await axios.get(pythonUrl, { timeout: 10000 });
+    return res.status(200).json(response.data);
+  } catch (error) {
+    console.error("Get explanation error:", error.message);
+    if (error.response) {
+      return res.status(error.response.status).json(error.response.data);
+    }
+    return res.status(500).json({ detail: `Server error getting explanation: ${error.message}` });
+  }
+};
+
 exports.autoAllocate = async (req, res) => {
   try {
     let { department, semester, divisions, subjects, lecturers } = req.body;
@@ -246,7 +316,8 @@ exports.autoAllocate = async (req, res) => {
       semester: parseInt(semester),
       divisions,
       subjects,
-      lecturers
+      lecturers,
+      use_llm: Boolean(req.body.use_llm)
     }, {
       timeout: 180000 // 3 minutes
     });
@@ -46,6 +46,8 @@ const TimetableSchema = new mongoose.Schema(
     classrooms: [mongoose.Schema.Types.Mixed], // Allow nested classroom objects
     labs: [mongoose.Schema.Types.Mixed], // Allow nested laboratory objects
     slots: [TimetableSlotSchema],
+    blocked: [mongoose.Schema.Types.Mixed], // Lecturer/room periods committed elsewhere, kept for regeneration
+    pipeline: mongoose.Schema.Types.Mixed, // Stage timings reported by the Python generator
     created_at: {
       type: Date,
       default: Date.now,
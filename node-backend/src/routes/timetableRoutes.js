@@ -8,6 +8,7 @@ router.get('/list/all', timetableController.listTimetables);
 router.post('/generate', timetableController.generate);
 router.post('/regenerate', timetableController.regenerate);
 router.post('/auto-allocate', timetableController.autoAllocate);
+router.get('/explanations/:explanationId', timetableController.getExplanation);
 router.get('/:timetableId', timetableController.getTimetable);
 router.delete('/:timetableId', timetableController.deleteTimetable);
 router.put('/:timetableId/slots', timetableController.updateTimetableSlots);